@@ -0,0 +1,147 @@
+"""
+Admission control for CPU-heavy endpoints
+Each endpoint class gets a concurrency limit and a bounded FIFO wait queue
+in the gateway; when the queue is full, requests are turned away at once
+with 429 and a Retry-After estimate instead of timing out together
+"""
+
+import asyncio
+import math
+import re
+from collections import deque
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted (queue full or waited too long)"""
+
+    def __init__(self, reason, retry_after, queue_length):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.queue_length = queue_length
+
+
+class AdmissionController:
+    """
+    Concurrency limiter with a bounded wait queue for one endpoint class
+
+    At most limit requests run at once and at most max_queue wait, in arrival
+    order, for up to max_wait seconds. Retry-After is estimated from a moving
+    average of how long admitted requests hold their slot.
+    """
+
+    def __init__(self, name, limit, max_queue, max_wait=30, service_time=20.0):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.service_time = service_time  # moving average, seconds per request
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waiters = deque()
+
+    def estimated_wait(self, position=None):
+        """Seconds until a request at position (default: the back of the queue) gets a slot"""
+        if position is None:
+            position = len(self._waiters) + 1
+        if self.active < self.limit and position <= 1:
+            return 0
+        return math.ceil(self.service_time * position / self.limit)
+
+    def _reject(self, reason):
+        self.rejected += 1
+        return AdmissionRejected(reason, max(1, self.estimated_wait()), len(self._waiters))
+
+    async def acquire(self):
+        """
+        Wait for a slot
+
+        Returns:
+            Queue position on arrival (0 if admitted straight away)
+
+        Raises:
+            AdmissionRejected if the queue is full or the wait exceeds max_wait
+        """
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return 0
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("Server is busy")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        position = len(self._waiters)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except asyncio.TimeoutError:
+            raise self._reject("Timed out waiting for a free slot")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()  # a slot was handed over just as the client left
+            raise
+        finally:
+            # Timed out or the client went away: give up our place in line
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        self.admitted += 1
+        return position
+
+    def release(self, elapsed=None):
+        """Free a slot (handing it straight to the next waiter) and record how long it was held"""
+        if elapsed is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # slot passes over without dropping active
+                return
+        self.active -= 1
+
+    def position_of_next(self):
+        """Queue position a request arriving now would get (0 = runs immediately)"""
+        if self.active < self.limit and not self._waiters:
+            return 0
+        return len(self._waiters) + 1
+
+    def status(self):
+        """Snapshot for /api/admission"""
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'waiting': len(self._waiters),
+            'max_queue': self.max_queue,
+            'next_position': self.position_of_next(),
+            'estimated_wait': self.estimated_wait(),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+
+class AdmissionRouter:
+    """Maps request paths to the AdmissionController of their endpoint class"""
+
+    def __init__(self):
+        self._routes = []  # (compiled pattern, methods or None, controller)
+        self.controllers = {}
+
+    def add(self, controller, patterns, methods=None):
+        """Limit requests whose path fully matches one of patterns (optionally only some methods)"""
+        self.controllers[controller.name] = controller
+        for pattern in patterns:
+            self._routes.append((re.compile(pattern), set(methods) if methods else None, controller))
+
+    def match(self, method, path):
+        """Return the controller for a request, or None if it is not limited"""
+        for pattern, methods, controller in self._routes:
+            if (methods is None or method in methods) and pattern.fullmatch(path):
+                return controller
+        return None
+
+    def status(self):
+        return {name: controller.status() for name, controller in self.controllers.items()}
+
@@ -0,0 +1,107 @@
+"""
+Analysis result cache keyed by audio content hash
+Results are kept in a small in-memory LRU backed by JSON files on disk so
+every gunicorn worker on the node sees the same entries. The disk level is
+bounded by max_bytes, evicting the least recently read results first.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class AnalysisCache:
+    """Two-level (memory + disk) cache of finished analyses"""
+
+    def __init__(self, directory, max_memory_entries=256, max_bytes=512 * 1024 ** 2):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _touch(self, key):
+        """Bump a result's mtime so eviction sees it as recently used"""
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key):
+        """Return the cached result for a content hash, or None"""
+        if not key:
+            return None
+
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+        if value is not None:
+            self._touch(key)
+            return value
+
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        self._touch(key)
+        self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        """Store a result; the disk write is atomic so readers never see partial JSON"""
+        if not key:
+            return
+        self._remember(key, value)
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"[CACHE ERROR] Could not persist result {key[:12]}: {e}")
+            return
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used result files until the disk level fits max_bytes"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+
+        used = sum(size for _, _, size in files)
+        for _, path, size in sorted(files):
+            if used <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            used -= size
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._memory:
+                return True
+        return os.path.exists(self._path(key))
@@ -1,18 +1,18 @@
-from flask import Flask, request, jsonify, send_from_directory, redirect, url_for, Response, stream_with_context
+from flask import Flask, Request, request, has_request_context, jsonify, send_from_directory, redirect, url_for, Response, stream_with_context
 from flask_cors import CORS
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_mail import Mail, Message
 from functools import wraps
+import contextlib
+import io
 import os
 import tempfile
 import torch
 import librosa
-import soundfile as sf
-import yt_dlp
 import whisper
 import numpy as np
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
 import requests
 import hashlib
@@ -20,6 +20,8 @@ import hmac
 import base64
 import time
 import json
+import secrets
+import threading
 
 # Try to import lyricsgenius (optional)
 try:
@@ -38,17 +40,73 @@ except:
     pass
 
 # Database models
-from models import db, User, SavedAnalysis, Tutorial, SearchLog, SongRecognitionLog, AnalysisActivityLog
+from models import db, User, SavedAnalysis, Tutorial, SearchLog, SongRecognitionLog, AnalysisActivityLog, AnalysisJob, AnalysisBatch
 
 # Assuming the core prediction logic is here
 from chord_recognition.utils import preprocess_audio
 from chord_recognition.model import CNNModel
 from chord_recognition.constants import CHORDS
+from audio_io import HashingUploadBuffer, read_upload, upload_hash, load_audio, encode_wav_bytes, stream_pcm_blocks, pcm_source
+from analysis_cache import AnalysisCache
+from upload_sessions import UploadSessionStore, UploadError
+from youtube import YouTubeMetadataCache, YoutubeDLPool, StreamURLManager, video_id_from_url, playlist_id_from_url
+from downloader import DownloadManager
+from audio_store import AudioBlobStore, PlaybackRenditions
+from jobs import JobQueue, JobWorker, job_id_for
+from concurrency import SingleFlight
+from cancellation import AnalysisCancelled, CancelToken, socket_closed_probe
+from quality import QUALITY_TIERS, DEFAULT_TIER, USER_TIERS, QualityGovernor, tier_rank
+from peaks import PeaksBuilder, PeaksStore, compute_peaks
+from stream_proxy import CachingStreamProxy, SparseRangeCache
+import genius as genius_api
+
+# Upload limits and on-disk working data
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', 50))
+CHORDIS_DATA_DIR = os.getenv('CHORDIS_DATA_DIR', os.path.join(tempfile.gettempdir(), 'chordis'))
+
+# Finished analyses keyed by upload content hash (shared by all workers on the node)
+result_cache = AnalysisCache(os.path.join(CHORDIS_DATA_DIR, 'results'),
+                             max_bytes=int(os.getenv('ANALYSIS_CACHE_MAX_MB', 512)) * 1024 * 1024)
+
+# Concurrent identical analyses (same video, song or upload) run once and share the
+# result; the file locks extend that across the workers on a node. If the
+# request running an analysis is cancelled, the ones waiting on it run it again.
+analysis_flights = SingleFlight(
+    os.path.join(CHORDIS_DATA_DIR, 'flights')
+    if os.getenv('SINGLE_FLIGHT_FILE_LOCKS', 'true').lower() == 'true' else None,
+    retry_errors=(AnalysisCancelled,)
+)
+
+# Analyses stop early when the client disconnects or after this many seconds;
+# keep it below the gunicorn worker timeout (120 s) so the request can still answer
+ANALYSIS_DEADLINE_SECONDS = int(os.getenv('ANALYSIS_DEADLINE_SECONDS', 110))
+
+# Resumable chunked uploads (staging files live next to the cache)
+upload_sessions = UploadSessionStore(
+    os.path.join(CHORDIS_DATA_DIR, 'uploads'),
+    chunk_size=int(os.getenv('UPLOAD_CHUNK_MB', 5)) * 1024 * 1024,
+    max_bytes=MAX_UPLOAD_MB * 1024 * 1024
+)
+
+
+class InMemoryUploadRequest(Request):
+    """Keep multipart file parts in memory, hashing them as the body arrives"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadBuffer(max_bytes=MAX_UPLOAD_MB * 1024 * 1024)
+
 
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///music_analyzer.db'
+# Every node must share one database for the job queue (e.g. postgresql://...)
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///music_analyzer.db')
+if DATABASE_URL.startswith('postgres://'):
+    DATABASE_URL = 'postgresql://' + DATABASE_URL[len('postgres://'):]
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Whole request body limit (form fields + file), enforced while the body streams in
+app.config['MAX_CONTENT_LENGTH'] = (MAX_UPLOAD_MB + 1) * 1024 * 1024
 
 # Session cookie configuration
 app.config['SESSION_COOKIE_HTTPONLY'] = True
@@ -187,8 +245,41 @@ else:
 
 print("Loading Whisper model for lyrics extraction...")
 print("   (This may take a moment on first run...)")
-# Use 'tiny' model for faster processing - can be changed to 'base', 'small', etc.
-whisper_model = whisper.load_model("tiny")  # Faster! Use "base" or "small" for better quality
+# 'tiny' serves the fast and balanced tiers; larger models (accurate tier) load on first use
+whisper_models = {'tiny': whisper.load_model("tiny")}
+whisper_models_lock = threading.Lock()
+
+
+def get_whisper_model(size):
+    """Return the Whisper model of a given size, loading it the first time it is needed"""
+    with whisper_models_lock:
+        if size not in whisper_models:
+            print(f"[WHISPER] Loading '{size}' model...")
+            whisper_models[size] = whisper.load_model(size)
+        return whisper_models[size]
+
+
+# Cancellable transcriptions run in pieces of about this long so cancellation is
+# checked between them; each cut goes at the quietest point of the preceding
+# WHISPER_CUT_SEARCH_SECONDS so words aren't split
+WHISPER_CHUNK_SECONDS = 120
+WHISPER_CUT_SEARCH_SECONDS = 20
+
+
+def whisper_chunk_bounds(samples, sr=16000):
+    """(start, end) sample ranges of about WHISPER_CHUNK_SECONDS each, cut in the quietest 0.1 s nearby"""
+    chunk, search, frame = WHISPER_CHUNK_SECONDS * sr, WHISPER_CUT_SEARCH_SECONDS * sr, sr // 10
+    bounds = []
+    start = 0
+    while len(samples) - start > chunk:
+        window = samples[start + chunk - search:start + chunk]
+        frames = window[:len(window) - len(window) % frame].reshape(-1, frame)
+        quietest = int(np.argmin(np.mean(frames ** 2, axis=1)))
+        end = start + chunk - search + quietest * frame + frame // 2
+        bounds.append((start, end))
+        start = end
+    bounds.append((start, len(samples)))
+    return bounds
 
 # Initialize Genius API (optional - add your token for better results)
 # Get free token at: https://genius.com/api-clients
@@ -228,16 +319,71 @@ if not os.getenv('ACRCLOUD_ACCESS_KEY') and not os.getenv('AUDD_API_TOKEN'):
 
 print("\n[OK] All models loaded successfully!")
 
+# Warm YoutubeDL instances per option profile (metadata / search / download),
+# filled in the background so startup isn't delayed
+ydl_pool = YoutubeDLPool(size=int(os.getenv('YTDLP_POOL_SIZE', 2)))
+threading.Thread(target=ydl_pool.warm, name='ytdlp-warmup', daemon=True).start()
+
+# yt-dlp metadata (title, thumbnail, stream URL...) cached per video id until
+# the signed stream URL expires; concurrent misses share one extraction
+youtube_metadata = YouTubeMetadataCache(extractor=ydl_pool.extract_info)
+
+# Opaque /api/stream/<id> ids whose upstream URLs are refreshed before they expire
+stream_urls = StreamURLManager(
+    youtube_metadata,
+    os.path.join(CHORDIS_DATA_DIR, 'streams'),
+    app.config['SECRET_KEY'],
+    refresh_margin=int(os.getenv('STREAM_REFRESH_MARGIN', 900))
+).start()
+
+# Durable analysis job queue (/api/jobs) in the shared database, deduplicated by input;
+# run by worker.py processes on any node and/or ANALYSIS_WORKERS threads per app process
+analysis_jobs = JobQueue(
+    db, AnalysisJob,
+    lease_seconds=int(os.getenv('JOB_LEASE_SECONDS', 60)),
+    max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 3)),
+    backoff_base=int(os.getenv('JOB_RETRY_BACKOFF', 15))
+)
+# Batches (/api/batches): most items per batch, and how many of a batch's jobs may be
+# queued or running at once (clients may ask for fewer); the rest wait their turn
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 50))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 2))
+with app.app_context():
+    try:
+        db.create_all()
+    except Exception as e:
+        # Another process may be creating the tables at the same moment
+        print(f"[WARNING] Could not create database tables: {e}")
+
+# Playback audio served at /api/temp-audio, bounded by total size (LRU eviction)
+audio_store = AudioBlobStore(
+    os.path.join(CHORDIS_DATA_DIR, 'audio'),
+    max_bytes=int(os.getenv('AUDIO_STORE_MAX_MB', 2048)) * 1024 * 1024
+)
+
+# Compact Opus renditions of WAV/FLAC blobs, transcoded in the background
+playback_renditions = PlaybackRenditions(audio_store, bitrate=os.getenv('PLAYBACK_OPUS_BITRATE', '96k'))
+
+# Waveform peaks per stored blob, served at /api/peaks/<key>
+peaks_store = PeaksStore(os.path.join(CHORDIS_DATA_DIR, 'peaks'),
+                         max_bytes=int(os.getenv('PEAKS_STORE_MAX_MB', 256)) * 1024 * 1024)
+
+# /api/proxy-audio: pooled upstream connections plus a sparse on-disk range cache
+stream_proxy = CachingStreamProxy(
+    SparseRangeCache(os.path.join(CHORDIS_DATA_DIR, 'proxy'),
+                     max_bytes=int(os.getenv('PROXY_CACHE_MAX_MB', 1024)) * 1024 * 1024),
+    max_response_bytes=int(os.getenv('PROXY_MAX_RESPONSE_KB', 4096)) * 1024
+)
+
+# Parallel ranged downloads of direct stream URLs over pooled connections
+download_manager = DownloadManager(
+    max_connections=int(os.getenv('DOWNLOAD_MAX_CONNECTIONS', 16)),
+    workers_per_download=int(os.getenv('DOWNLOAD_RANGES_PER_FILE', 4))
+)
+
+
 def download_youtube_audio(url, output_path):
     """Get YouTube audio info and download if possible"""
-    ydl_opts = {
-        'format': 'bestaudio[ext=m4a]/bestaudio/best',
-        'quiet': False,
-        'no_warnings': False,
-        'noplaylist': True,  # Only download single video, not playlist
-        'extract_flat': False,
-    }
-    
     try:
         # Remove playlist parameter from URL if present
         if '&list=' in url:
@@ -246,39 +392,38 @@ def download_youtube_audio(url, output_path):
         
         print(f"[YOUTUBE] Getting info from: {url}")
         
-        # First, just get info without downloading to see if it works
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            if not info:
-                print(f"[YOUTUBE ERROR] Could not extract video info")
-                return False, None
-            
-            # Extract metadata
-            video_title = info.get('title', '')
-            uploader = info.get('uploader', '')
-            thumbnail = info.get('thumbnail', '')
-            stream_url = info.get('url')  # Direct stream URL
-            
-            print(f"[YOUTUBE] [OK] Got info: {video_title}")
-            print(f"[YOUTUBE] Stream URL available: {stream_url is not None}")
-            
-            # Try to extract artist and song from title
-            artist, song_title = extract_song_info_from_title(video_title)
-            
-            # If no artist found, use uploader
-            if not artist or artist == 'Unknown':
-                artist = uploader or 'Unknown Artist'
-            
-            metadata = {
-                'title': song_title or video_title,
-                'artist': artist,
-                'thumbnail': thumbnail,
-                'stream_url': stream_url,  # Direct streaming URL
-                'youtube_url': url  # Original YouTube URL
-            }
-            
-            return True, metadata
+        # Just get info without downloading (served from cache when fresh)
+        info = youtube_metadata.get(url)
+        
+        # Extract metadata
+        video_title = info.get('title', '')
+        uploader = info.get('uploader', '')
+        thumbnail = info.get('thumbnail', '')
+        stream_url = info.get('stream_url')  # Direct stream URL
+        
+        print(f"[YOUTUBE] [OK] Got info: {video_title}")
+        print(f"[YOUTUBE] Stream URL available: {stream_url is not None}")
+        
+        # Try to extract artist and song from title
+        artist, song_title = extract_song_info_from_title(video_title)
+        
+        # If no artist found, use uploader
+        if not artist or artist == 'Unknown':
+            artist = uploader or 'Unknown Artist'
+        
+        metadata = {
+            'title': song_title or video_title,
+            'artist': artist,
+            'thumbnail': thumbnail,
+            'duration': info.get('duration'),
+            'stream_url': stream_url,  # Direct streaming URL
+            'http_headers': info.get('http_headers') or {},
+            'video_id': info.get('video_id'),
+            'webpage_url': info.get('webpage_url'),
+            'youtube_url': url  # Original YouTube URL
+        }
+        
+        return True, metadata
     except Exception as e:
         error_msg = str(e)
         print(f"[YOUTUBE ERROR] Failed to download: {error_msg}")
@@ -293,6 +438,57 @@ def download_youtube_audio(url, output_path):
         return False, None
 
 
+def start_youtube_audio_download(source, file_hash, search=False):
+    """
+    Start fetching the audio for a YouTube video (or search query) into the audio store as {file_hash}.*
+    Metadata comes from the cache, so no second yt-dlp extraction happens for the download.
+    Call finish_youtube_audio_download once the download has been joined.
+    
+    Returns:
+        Tuple of (path, ext, metadata, download) - download is None if the blob is already stored
+    """
+    info = youtube_metadata.search(source) if search else youtube_metadata.get(source)
+    ext = f".{info.get('ext') or 'm4a'}"
+    name = audio_store.name_for(file_hash, ext)
+    
+    stored_path = audio_store.get(name)
+    if stored_path:
+        print(f"[AUDIO] [OK] Already downloaded: {name}")
+        return stored_path, ext, info, None
+    
+    temp_audio_path = audio_store.path_for(name)
+    download = download_manager.start(info['stream_url'], temp_audio_path, headers=info.get('http_headers'))
+    return temp_audio_path, ext, info, download
+
+
+def finish_youtube_audio_download(file_hash, ext):
+    """Index a finished download in the audio store (may evict older blobs)"""
+    return audio_store.commit(audio_store.name_for(file_hash, ext))
+
+
+def fetch_youtube_audio_file(source, file_hash, search=False):
+    """
+    Make sure the audio for a YouTube video (or search query) is in the audio store as {file_hash}.*
+    
+    Returns:
+        Tuple of (path, ext, metadata)
+    """
+    temp_audio_path, ext, info, download = start_youtube_audio_download(source, file_hash, search)
+    if download is None:
+        return temp_audio_path, ext, info
+    
+    try:
+        download.join()
+    except Exception as e:
+        # Stream URL rejected (expired or IP-bound) - re-extract once and retry
+        print(f"[AUDIO] Download failed ({e}), refreshing metadata")
+        youtube_metadata.invalidate(info.get('webpage_url'))
+        info = youtube_metadata.get(info.get('webpage_url'))
+        download_manager.download(info['stream_url'], temp_audio_path, headers=info.get('http_headers'))
+    
+    return finish_youtube_audio_download(file_hash, ext), ext, info
+
+
 def extract_song_info_from_title(title):
     """Extract artist and song name from video title"""
     # Common patterns: "Artist - Song", "Song - Artist", "Artist: Song"
@@ -357,20 +553,136 @@ def get_lyrics_from_genius(song_title, artist=None):
         traceback.print_exc()
         return None
 
-def predict_chords_with_timestamps(filepath):
-    """Predict chords from an audio file with timestamps (ChordAI-style)"""
-    # Optimized: Use lower sample rate and mono for faster processing
-    y, sr = librosa.load(filepath, sr=11025, mono=True)
+# Chord analysis settings come from the quality tier (see quality.py); the
+# default tier's rate is also used for peaks computed outside an analysis
+CHORD_SAMPLE_RATE = QUALITY_TIERS[DEFAULT_TIER]['sample_rate']
+
+# Steps down to cheaper tiers while requests queue up or analyses run slow
+quality_governor = QualityGovernor(
+    queue_step=int(os.getenv('QUALITY_QUEUE_STEP', 4)),
+    target_latency=float(os.getenv('QUALITY_TARGET_SECONDS_PER_MINUTE', 10)),
+    cooldown=int(os.getenv('QUALITY_RECOVERY_COOLDOWN', 60)),
+    pinned=os.getenv('ANALYSIS_QUALITY_TIER')
+)
+
+
+def choose_quality_tier(requested=None):
+    """
+    Quality tier for an analysis starting now
+    requested is the client's quality parameter; under load the governor may
+    step below it. Queue depth comes from the gateway's admission queue for
+    requests, or from the job queue for background jobs
+    """
+    depth = None
+    if has_request_context():
+        waiting = request.headers.get('X-Admission-Waiting', '')
+        depth = int(waiting) if waiting.isdigit() else None
+    else:
+        try:
+            depth = analysis_jobs.depth()
+        except Exception:
+            depth = None
+    return quality_governor.choose(depth, requested)
+
+
+def quality_error(quality):
+    """400 response for an unknown quality parameter, or None if it is valid or absent"""
+    if quality and quality not in USER_TIERS:
+        return jsonify({
+            "success": False,
+            "error": f"quality must be one of: {', '.join(USER_TIERS)}"
+        }), 400
+    return None
+
+
+def cached_result_fits(cached, quality=None):
+    """True if a cached result was analyzed at (at least) the requested quality"""
+    return tier_rank(cached.get('quality')) <= tier_rank(quality)
+
+
+def cache_upload_result(content_hash, result, audio_ext):
+    """Remember an upload's result by content, unless a better-quality one is already cached"""
+    existing = result_cache.get(content_hash)
+    if existing and tier_rank(existing.get('quality')) < tier_rank(result.get('quality')):
+        return
+    result_cache.set(content_hash, dict(result, audio_ext=audio_ext))
+
+
+def request_cancel_token():
+    """CancelToken for the current request: the analysis deadline plus a client-disconnect check"""
+    sock = request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+    return CancelToken(deadline=ANALYSIS_DEADLINE_SECONDS, probe=socket_closed_probe(sock) if sock else None)
+
+
+def cancelled_response(e):
+    """504 once the deadline passed; 499 (client closed request) when nobody is listening anyway"""
+    print(f"[CANCEL] {request.method} {request.path}: {e.reason}")
+    status = 504 if e.reason == CancelToken.DEADLINE else 499
+    return jsonify({"success": False, "error": str(e)}), status
+
+
+def chroma_features(y, sr, tier, center=True):
+    """12-bin chroma for a tier: STFT chroma, or constant-Q chroma for the accurate tier"""
+    if tier['chroma'] == 'cqt':
+        return librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=tier['hop_length'])
+    return librosa.feature.chroma_stft(y=y, sr=sr, hop_length=tier['hop_length'],
+                                       n_fft=tier['n_fft'], center=center)
+
+
+def classify_chroma(avg_chroma):
+    """Return the chord name for an averaged 12-bin chroma vector"""
+    if use_trained_model:
+        X = avg_chroma.reshape(1, -1)
+        with torch.no_grad():
+            output = chord_model(torch.tensor(X).unsqueeze(1).float())
+            chord_idx = output.argmax(dim=1).item()
+    else:
+        chord_idx = chord_model.predict_from_chroma(avg_chroma)
+    
+    return CHORDS[chord_idx]
+
+
+def add_chord_segment(chord_progression, chord_name, start_time, end_time):
+    """
+    Add a segment to a progression, merging consecutive same chords
+    Returns True if a new chord entry was started
+    """
+    if chord_progression and chord_progression[-1]['chord'] == chord_name:
+        chord_progression[-1]['end_time'] = round(float(end_time), 2)
+        return False
+    
+    chord_progression.append({
+        'chord': chord_name,
+        'start_time': round(float(start_time), 2),
+        'end_time': round(float(end_time), 2)
+    })
+    return True
+
+
+def predict_chords_with_timestamps(source, on_pcm=None, tier=None, cancel=None):
+    """
+    Predict chords from an audio file path or in-memory bytes with timestamps (ChordAI-style)
+    on_pcm, if given, receives the decoded mono samples (at the tier's sample rate) for reuse
+    tier is a quality tier's settings (default: the default tier)
+    cancel is an optional CancelToken, checked between decoding and feature extraction
+    """
+    tier = tier or QUALITY_TIERS[DEFAULT_TIER]
+    sr = tier['sample_rate']
+    hop_length = tier['hop_length']
+    y, sr = load_audio(source, sr=sr, mono=True)
+    if cancel:
+        cancel.check()
+    if on_pcm:
+        on_pcm(y)
     duration = librosa.get_duration(y=y, sr=sr)
     
-    # Optimized: Larger hop length for faster processing
-    hop_length = 1024
-    # Optimized: Use faster chroma_stft instead of chroma_cqt
-    chroma = librosa.feature.chroma_stft(y=y, sr=sr, hop_length=hop_length, n_fft=2048)
+    chroma = chroma_features(y, sr, tier)
+    if cancel:
+        cancel.check()
     
     # Analyze chroma per segment with timestamps
     chord_progression = []
-    segment_length = 50  # frames (increased for faster processing with fewer segments)
+    segment_length = tier['segment_frames']
     num_segments = max(1, chroma.shape[1] // segment_length)
     
     for i in range(num_segments):
@@ -382,37 +694,105 @@ def predict_chords_with_timestamps(filepath):
         start_time = librosa.frames_to_time(start_idx, sr=sr, hop_length=hop_length)
         end_time = librosa.frames_to_time(end_idx, sr=sr, hop_length=hop_length)
         
-        # Average chroma over segment
-        avg_chroma = np.mean(chroma_segment, axis=1)
-        
-        # Detect chord
-        if use_trained_model:
-            X = avg_chroma.reshape(1, -1)
-            with torch.no_grad():
-                output = chord_model(torch.tensor(X).unsqueeze(1).float())
-                chord_idx = output.argmax(dim=1).item()
-        else:
-            chord_idx = chord_model.predict_from_chroma(avg_chroma)
-        
-        chord_name = CHORDS[chord_idx]
+        # Average chroma over segment and detect chord
+        chord_name = classify_chroma(np.mean(chroma_segment, axis=1))
         
         # Add to progression (merge consecutive same chords)
-        if chord_progression and chord_progression[-1]['chord'] == chord_name:
-            chord_progression[-1]['end_time'] = end_time
-        else:
-            chord_progression.append({
-                'chord': chord_name,
-                'start_time': round(start_time, 2),
-                'end_time': round(end_time, 2)
-            })
+        add_chord_segment(chord_progression, chord_name, start_time, end_time)
     
     return {
         'progression': chord_progression,
         'duration': round(duration, 2)
     }
 
-def extract_lyrics_with_timestamps(filepath, song_info=None):
-    """Extract lyrics - try Genius first, fallback to Whisper"""
+
+def iter_stream_chords(source, headers=None, stats=None, on_pcm=None, tier=None, cancel=None):
+    """
+    Predict chords from a remote stream while it downloads (no file on disk)
+    
+    Audio is decoded by an ffmpeg pipe and analyzed one segment
+    (the tier's segment_frames chroma frames) at a time. A chord is yielded as soon
+    as the next, different chord starts, so callers see results while the
+    rest of the stream is still being fetched.
+    
+    Args:
+        source: Direct audio URL (e.g. stream_url from download_youtube_audio),
+            or an iterable of encoded chunks such as RangedDownload.iter_contiguous()
+        headers: Optional HTTP headers for the upstream request
+        stats: Optional dict that receives 'duration' once the stream ends
+        on_pcm: Optional callable that receives each decoded block (e.g. PeaksBuilder.add)
+        tier: Quality tier settings (default: the default tier)
+        cancel: Optional CancelToken, checked per decoded block (stops ffmpeg early)
+    
+    Yields:
+        Chord dicts {'chord', 'start_time', 'end_time'}
+    """
+    tier = tier or QUALITY_TIERS[DEFAULT_TIER]
+    sr = tier['sample_rate']
+    hop_length = tier['hop_length']
+    n_fft = tier['n_fft']
+    segment_samples = hop_length * tier['segment_frames']
+    # Non-centered STFT frames need n_fft - hop extra samples past the segment
+    window_samples = segment_samples + n_fft - hop_length
+    
+    buffer = np.zeros(0, dtype=np.float32)
+    segment_index = 0
+    total_samples = 0
+    progression = []
+    
+    def analyze_window(samples, start_sample):
+        # Constant-Q chroma is always centered, so drop the frames past the segment
+        chroma = chroma_features(samples, sr, tier, center=False)[:, :tier['segment_frames']]
+        end_sample = start_sample + chroma.shape[1] * hop_length
+        return classify_chroma(np.mean(chroma, axis=1)), start_sample / sr, end_sample / sr
+    
+    # closing() kills ffmpeg as soon as we stop, rather than whenever the generator is collected
+    with contextlib.closing(stream_pcm_blocks(source, sr, segment_samples * 4, headers=headers)) as blocks:
+        for block in blocks:
+            if cancel:
+                cancel.check()
+            total_samples += len(block)
+            if on_pcm:
+                on_pcm(block)
+            buffer = np.concatenate([buffer, block])
+            
+            while len(buffer) >= window_samples:
+                chord_name, start_time, end_time = analyze_window(buffer[:window_samples], segment_index * segment_samples)
+                if add_chord_segment(progression, chord_name, start_time, end_time) and len(progression) > 1:
+                    yield progression[-2]
+                buffer = buffer[segment_samples:]
+                segment_index += 1
+    
+    # Very short audio: analyze whatever we got, like the file path does
+    if segment_index == 0 and len(buffer) >= n_fft:
+        chord_name, start_time, end_time = analyze_window(buffer, 0)
+        add_chord_segment(progression, chord_name, start_time, end_time)
+    
+    if progression:
+        yield progression[-1]
+    
+    if stats is not None:
+        stats['duration'] = round(total_samples / sr, 2)
+
+
+def predict_chords_from_stream(source, headers=None, on_pcm=None, tier=None, cancel=None):
+    """Collect iter_stream_chords into the same shape predict_chords_with_timestamps returns"""
+    stats = {}
+    progression = list(iter_stream_chords(source, headers=headers, stats=stats, on_pcm=on_pcm, tier=tier,
+                                          cancel=cancel))
+    return {
+        'progression': progression,
+        'duration': stats.get('duration', progression[-1]['end_time'] if progression else 0)
+    }
+
+def extract_lyrics_with_timestamps(source, song_info=None, tier=None, cancel=None):
+    """
+    Extract lyrics - try Genius first, fallback to Whisper
+    Cheaper quality tiers only transcribe the first whisper_window seconds.
+    With cancel (a CancelToken), Whisper runs over whisper_chunk_bounds() pieces,
+    checking it between them; otherwise the audio is transcribed in one go
+    """
+    tier = tier or QUALITY_TIERS[DEFAULT_TIER]
     
     # Try Genius API first if we have song info
     if song_info:
@@ -424,49 +804,76 @@ def extract_lyrics_with_timestamps(filepath, song_info=None):
     # Fallback to Whisper (speech-to-text)
     print("Using Whisper for lyrics extraction...")
     try:
-        # Optimized settings for much faster processing
-        result = whisper_model.transcribe(
-            filepath, 
-            language="en", 
-            task="transcribe",
-            word_timestamps=True,
-            fp16=False,  # Disable FP16 for CPU
-            best_of=1,   # Faster decoding
-            beam_size=1,  # Faster beam search
-            temperature=0,  # Deterministic, faster
-            compression_ratio_threshold=2.4,  # Skip low-quality audio faster
-            no_speech_threshold=0.6,  # Skip silence faster
-            condition_on_previous_text=False  # Faster, no context dependency
-        )
+        # Whisper accepts 16 kHz mono float32 samples directly
+        samples, _ = load_audio(source, sr=16000, mono=True)
+        if tier['whisper_window']:
+            samples = samples[:tier['whisper_window'] * 16000]
+        model = get_whisper_model(tier['whisper_model'])
         
-        # Extract word-level timestamps
+        texts = []
         words_with_time = []
-        if 'segments' in result:
-            for segment in result['segments']:
-                if 'words' in segment:
-                    for word in segment['words']:
-                        words_with_time.append({
-                            'word': word.get('word', '').strip(),
-                            'start': round(word.get('start', 0), 2),
-                            'end': round(word.get('end', 0), 2)
-                        })
+        bounds = whisper_chunk_bounds(samples) if cancel else [(0, len(samples))]
+        for offset, end in bounds:
+            if cancel:
+                cancel.check()
+            
+            # Optimized settings for much faster processing
+            result = model.transcribe(
+                samples[offset:end],
+                language="en", 
+                task="transcribe",
+                word_timestamps=True,
+                fp16=False,  # Disable FP16 for CPU
+                best_of=1,   # Faster decoding
+                beam_size=1,  # Faster beam search
+                temperature=0,  # Deterministic, faster
+                compression_ratio_threshold=2.4,  # Skip low-quality audio faster
+                no_speech_threshold=0.6,  # Skip silence faster
+                condition_on_previous_text=False  # Faster, no context dependency
+            )
+            texts.append(result["text"])
+            
+            # Extract word-level timestamps (relative to the whole song)
+            offset_seconds = offset / 16000
+            if 'segments' in result:
+                for segment in result['segments']:
+                    if 'words' in segment:
+                        for word in segment['words']:
+                            words_with_time.append({
+                                'word': word.get('word', '').strip(),
+                                'start': round(word.get('start', 0) + offset_seconds, 2),
+                                'end': round(word.get('end', 0) + offset_seconds, 2)
+                            })
         
         return {
-            'text': result["text"],
+            'text': ''.join(texts),
             'source': 'whisper',
             'words': words_with_time
         }
+    except AnalysisCancelled:
+        raise
     except Exception as e:
         print(f"Error extracting lyrics: {e}")
         return {'text': None, 'source': 'error', 'words': []}
 
-def process_audio(filepath, song_info=None):
-    """Process audio file to get both chords and lyrics with timestamps"""
-    chord_result = predict_chords_with_timestamps(filepath)
-    lyrics_data = extract_lyrics_with_timestamps(filepath, song_info)
+def process_audio(source, song_info=None, on_pcm=None, progress=None, tier=None, stats=None, cancel=None):
+    """
+    Process an audio file path or in-memory bytes to get both chords and lyrics with timestamps
+    progress, if given, is called as progress(stage, percent) between the steps
+    stats, if given, receives the audio 'duration'
+    cancel, if given, is a CancelToken that stops the work between steps and chunks
+    """
+    if progress:
+        progress('chords', 10)
+    chord_result = predict_chords_with_timestamps(source, on_pcm=on_pcm, tier=tier, cancel=cancel)
+    if progress:
+        progress('lyrics', 50)
+    lyrics_data = extract_lyrics_with_timestamps(source, song_info, tier=tier, cancel=cancel)
     
     # Extract chord progression array from result
     chord_data = chord_result.get('progression', []) if isinstance(chord_result, dict) else chord_result
+    if stats is not None and isinstance(chord_result, dict):
+        stats['duration'] = chord_result.get('duration')
     
     return chord_data, lyrics_data
 
@@ -475,10 +882,19 @@ def process_audio(filepath, song_info=None):
 # MUSIC RECOGNITION FUNCTIONS
 # ============================================
 
-def recognize_song_acrcloud(audio_file_path):
+def read_audio_sample(audio):
+    """Return raw audio bytes from either a file path or an in-memory sample"""
+    if isinstance(audio, (bytes, bytearray)):
+        return bytes(audio)
+    with open(audio, 'rb') as f:
+        return f.read()
+
+
+def recognize_song_acrcloud(audio):
     """
     Recognize song using ACRCloud API
     Requires: ACRCLOUD_ACCESS_KEY, ACRCLOUD_ACCESS_SECRET, ACRCLOUD_HOST in environment
+    Accepts a file path or WAV bytes
     """
     access_key = os.getenv('ACRCLOUD_ACCESS_KEY')
     access_secret = os.getenv('ACRCLOUD_ACCESS_SECRET')
@@ -487,9 +903,7 @@ def recognize_song_acrcloud(audio_file_path):
     if not access_key or not access_secret:
         raise ValueError("ACRCloud credentials not configured")
     
-    # Read audio file
-    with open(audio_file_path, 'rb') as f:
-        audio_data = f.read()
+    audio_data = read_audio_sample(audio)
     
     # Prepare request
     timestamp = int(time.time())
@@ -571,10 +985,11 @@ def recognize_song_acrcloud(audio_file_path):
         raise
 
 
-def recognize_song_audd(audio_file_path):
+def recognize_song_audd(audio):
     """
     Recognize song using AudD API
     Requires: AUDD_API_TOKEN in environment
+    Accepts a file path or WAV bytes
     """
     api_token = os.getenv('AUDD_API_TOKEN')
     
@@ -582,20 +997,19 @@ def recognize_song_audd(audio_file_path):
         raise ValueError("AudD API token not configured")
     
     try:
-        with open(audio_file_path, 'rb') as f:
-            files = {'file': f}
-            data = {
-                'api_token': api_token,
-                'return': 'apple_music,spotify'
-            }
-            
-            response = requests.post(
-                'https://api.audd.io/',
-                files=files,
-                data=data,
-                timeout=30
-            )
-            
+        files = {'file': ('sample.wav', read_audio_sample(audio), 'audio/wav')}
+        data = {
+            'api_token': api_token,
+            'return': 'apple_music,spotify'
+        }
+        
+        response = requests.post(
+            'https://api.audd.io/',
+            files=files,
+            data=data,
+            timeout=30
+        )
+        
         result = response.json()
         
         if result.get('status') == 'success' and result.get('result'):
@@ -617,10 +1031,11 @@ def recognize_song_audd(audio_file_path):
         raise
 
 
-def recognize_song(audio_file_path):
+def recognize_song(audio):
     """
     Recognize song using available music recognition services
     Tries ACRCloud first, then falls back to AudD
+    Accepts a file path or WAV bytes
     """
     result = None
     
@@ -628,7 +1043,7 @@ def recognize_song(audio_file_path):
     if os.getenv('ACRCLOUD_ACCESS_KEY') and os.getenv('ACRCLOUD_ACCESS_SECRET'):
         try:
             print("Trying ACRCloud recognition...")
-            result = recognize_song_acrcloud(audio_file_path)
+            result = recognize_song_acrcloud(audio)
             if result:
                 print(f"SUCCESS - Song recognized via ACRCloud: {result['title']} by {result['artist']}")
                 return result
@@ -639,7 +1054,7 @@ def recognize_song(audio_file_path):
     if os.getenv('AUDD_API_TOKEN'):
         try:
             print("Trying AudD recognition...")
-            result = recognize_song_audd(audio_file_path)
+            result = recognize_song_audd(audio)
             if result:
                 print(f"SUCCESS - Song recognized via AudD: {result['title']} by {result['artist']}")
                 return result
@@ -675,34 +1090,18 @@ def recognize_song_endpoint():
             print(f"Received file: {file.filename}")
             
             try:
-                # Save to temp file
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.tmp') as tmp:
-                    temp_file = tmp.name
-                    file.save(temp_file)
-                
-                print(f"Saved to: {temp_file}")
-                print(f"Converting to WAV...")
-                
-                # Convert to WAV - limit to 20 seconds for ACRCloud
-                wav_file = temp_file + '.wav'
-                y, sr = librosa.load(temp_file, sr=16000, mono=True, duration=20)
-                sf.write(wav_file, y, sr, subtype='PCM_16')
+                # Decode straight from the request buffer and re-encode the
+                # sample as WAV in memory - limit to 20 seconds for ACRCloud
+                print(f"Converting to WAV in memory...")
+                y, sr = load_audio(read_upload(file), sr=16000, mono=True, duration=20)
+                audio_sample = encode_wav_bytes(y, sr)
                 
-                print(f"Converted successfully: {wav_file}")
-                
-                # Clean up original
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                temp_file = wav_file
+                print(f"Converted successfully: {len(audio_sample)} bytes")
                 
             except Exception as conv_error:
                 print(f"CONVERSION ERROR: {conv_error}")
                 import traceback
                 traceback.print_exc()
-                
-                # Clean up
-                if temp_file and os.path.exists(temp_file):
-                    os.remove(temp_file)
                     
                 return jsonify({
                     'success': False,
@@ -713,27 +1112,19 @@ def recognize_song_endpoint():
             # YouTube URL
             youtube_url = request.json['youtube_url']
             
-            # Create temporary file for download
-            with tempfile.NamedTemporaryFile(delete=False, suffix='', dir='temp') as tmp:
+            # Download into a temp path with a pooled downloader
+            with tempfile.NamedTemporaryFile(delete=False, suffix='') as tmp:
                 temp_file = tmp.name
+            os.remove(temp_file)
             
-            # Download YouTube audio (only first 30 seconds for recognition)
             print(f"Downloading from YouTube for recognition: {youtube_url}")
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'wav',
-                }],
-                'outtmpl': temp_file,
-                'quiet': True,
-                'no_warnings': True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([youtube_url])
+            with ydl_pool.checkout('download', outtmpl=temp_file + '.%(ext)s') as ydl:
+                info = ydl.extract_info(youtube_url, download=True)
+                temp_file = ydl.prepare_filename(info)
             
-            temp_file = temp_file + '.wav'
+            # Only the first 20 seconds are needed, same as uploads
+            y, sr = load_audio(temp_file, sr=16000, mono=True, duration=20)
+            audio_sample = encode_wav_bytes(y, sr)
             
         else:
             return jsonify({
@@ -742,8 +1133,8 @@ def recognize_song_endpoint():
             }), 400
         
         # Recognize the song
-        print(f"Recognizing song from: {temp_file}")
-        song_info = recognize_song(temp_file)
+        print(f"Recognizing song from: {'memory' if temp_file is None else temp_file}")
+        song_info = recognize_song(audio_sample)
         
         # Clean up
         if temp_file and os.path.exists(temp_file):
@@ -783,6 +1174,594 @@ def recognize_song_endpoint():
         }), 500
 
 
+def save_playback_copy(audio, content_hash, audio_ext):
+    """
+    Put upload audio into the audio store under its content hash (written once)
+    audio is either the file contents or the path of a staged file, which is moved into place
+    """
+    name = audio_store.name_for(content_hash, audio_ext)
+    if isinstance(audio, (bytes, bytearray)):
+        return audio_store.put_bytes(name, audio)
+    return audio_store.put_file(name, audio)
+
+
+def playback_audio_url(content_hash, audio_ext):
+    """
+    URL the player should load for a stored blob
+    Points at the Opus rendition once it is ready, otherwise at the original
+    (and queues the rendition for large lossless originals)
+    """
+    rendition = playback_renditions.get(content_hash)
+    if rendition:
+        return f"/api/temp-audio/{rendition}"
+    playback_renditions.submit(content_hash, audio_ext)
+    return f"/api/temp-audio/{content_hash}{audio_ext}"
+
+
+def find_playback_copy(content_hash):
+    """Return (path, ext) of a stored playback copy for a content hash, or (None, None)"""
+    return audio_store.find(content_hash)
+
+
+def request_user_id():
+    """Id of the logged-in user for the current request (None for guests and outside requests)"""
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+
+def cached_upload_response(cached, content_hash, audio_data, audio_ext, song_info=None, user_id=None):
+    """Build an /analyze response from a cached result for the same audio content"""
+    result = {k: v for k, v in cached.items() if k != 'audio_ext'}
+    result['cached'] = True
+    result.setdefault('quality', DEFAULT_TIER)  # cached before tiers were recorded
+    result.setdefault('peaks_url', f"/api/peaks/{content_hash}")
+    
+    # Make sure the playback copy is still around (temp dirs get cleaned)
+    try:
+        if audio_data is not None:
+            save_playback_copy(audio_data, content_hash, audio_ext)
+        result['audio_url'] = playback_audio_url(content_hash, audio_ext)
+        result['audio_available'] = True
+    except Exception as e:
+        print(f"[AUDIO ERROR] Could not restore playback copy: {e}")
+    
+    # Caller named the song differently - lyrics depend on that, chords don't
+    if song_info and song_info != f"{result.get('artist')} - {result.get('title')}":
+        artist, song_title = extract_song_info_from_title(song_info)
+        lyrics = get_lyrics_from_genius(song_title, artist)
+        if lyrics:
+            result['lyrics_data'] = lyrics
+        result['title'] = song_title
+        result['artist'] = artist or result.get('artist')
+    
+    if user_id is None:
+        user_id = request_user_id()
+    log_analysis_activity('analyze', result.get('title'), result.get('artist'), user_id)
+    return result
+
+
+def extract_embedded_metadata(audio):
+    """Read title, artist and cover art from the tags of in-memory audio or a file path"""
+    title = None
+    artist = None
+    artwork_data = None
+    
+    try:
+        import mutagen
+        from mutagen.id3 import ID3, APIC
+        from mutagen.mp4 import MP4
+        import base64
+        
+        audio_file = mutagen.File(io.BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio)
+        
+        if audio_file is not None:
+            # Extract title
+            if 'TIT2' in audio_file:  # MP3 ID3
+                title = str(audio_file['TIT2'])
+            elif 'title' in audio_file:  # FLAC, OGG
+                title = str(audio_file['title'][0])
+            elif '\xa9nam' in audio_file:  # M4A
+                title = str(audio_file['\xa9nam'][0])
+            
+            # Extract artist
+            if 'TPE1' in audio_file:  # MP3 ID3
+                artist = str(audio_file['TPE1'])
+            elif 'artist' in audio_file:  # FLAC, OGG
+                artist = str(audio_file['artist'][0])
+            elif '\xa9ART' in audio_file:  # M4A
+                artist = str(audio_file['\xa9ART'][0])
+            
+            # Extract album artwork
+            if isinstance(audio_file, MP4):  # M4A
+                if 'covr' in audio_file:
+                    artwork_data = base64.b64encode(audio_file['covr'][0]).decode()
+            elif hasattr(audio_file, 'tags'):  # MP3
+                for tag in audio_file.tags.values():
+                    if isinstance(tag, APIC):
+                        artwork_data = base64.b64encode(tag.data).decode()
+                        break
+    except Exception as e:
+        print(f"[INFO] Could not extract metadata: {e}")
+    
+    return title, artist, artwork_data
+
+
+def apply_song_info(song_info, title, artist):
+    """Override title/artist with user-provided "Artist - Title" style song info"""
+    if song_info:
+        if " - " in song_info:
+            parts = song_info.split(" - ", 1)
+            artist = parts[0].strip()
+            title = parts[1].strip()
+        elif " by " in song_info.lower():
+            parts = song_info.lower().split(" by ", 1)
+            title = song_info[:len(parts[0])].strip()
+            artist = song_info[len(parts[0])+4:].strip()
+        else:
+            title = song_info
+    return title, artist
+
+
+def analyze_uploaded_audio(audio, audio_ext, content_hash, song_info=None, user_id=None, progress=None, quality=None,
+                           cancel=None):
+    """
+    Run the full analysis pipeline on uploaded audio
+    audio is the file contents in memory, or the path of a staged upload
+    user_id defaults to the current request's user; progress(stage, percent) is optional
+    quality is the requested tier name; the governor may pick a cheaper one under load
+    cancel is an optional CancelToken; nothing is stored if the analysis is cancelled
+    Returns the /analyze response dict and caches it under the content hash
+    """
+    started = time.time()
+    tier = choose_quality_tier(quality)
+    in_memory = isinstance(audio, (bytes, bytearray))
+    size = len(audio) if in_memory else os.path.getsize(audio)
+    print(f"Analyzing audio {'from memory' if in_memory else 'from ' + audio}: {size} bytes ({tier['name']} quality)")
+    
+    # Try to extract metadata from the audio tags
+    title, artist, artwork_data = extract_embedded_metadata(audio)
+    
+    # A client-given title is always looked up on Genius first; cheaper tiers
+    # also look up the file's tags before paying for Whisper
+    lyrics_lookup = song_info
+    if not lyrics_lookup and tier['genius_tag_lookup'] and title:
+        lyrics_lookup = f"{artist} - {title}" if artist else title
+    
+    peaks = PeaksBuilder(tier['sample_rate'])
+    stats = {}
+    chord_data, lyrics_data = process_audio(audio, lyrics_lookup, on_pcm=peaks.add, progress=progress,
+                                            tier=tier, stats=stats, cancel=cancel)
+    peaks_store.set(content_hash, peaks.to_bytes())
+    
+    title, artist = apply_song_info(song_info, title or "Unknown Song", artist or "Unknown Artist")
+    
+    if progress:
+        progress('saving', 85)
+    
+    # Keep audio file for playback
+    audio_url = None
+    try:
+        print(f"[AUDIO] Processing audio file for playback...")
+        print(f"[AUDIO] File size: {size} bytes")
+        
+        # Single write: the upload goes straight from memory (or its staging
+        # file) to its content-addressed playback path
+        temp_audio_path = save_playback_copy(audio, content_hash, audio_ext)
+        
+        # Create URL for serving
+        audio_url = playback_audio_url(content_hash, audio_ext)
+        print(f"[AUDIO] [OK] Saved for playback: {temp_audio_path}")
+        print(f"[AUDIO] [OK] Serving at: {audio_url}")
+    except Exception as e:
+        print(f"[AUDIO ERROR] Could not save audio file: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    # Log analysis activity
+    if user_id is None:
+        user_id = request_user_id()
+    log_analysis_activity('analyze', title, artist, user_id)
+    
+    if not lyrics_data:
+        print(f"[LYRICS] Fetching lyrics for uploaded file")
+        genius_lyrics = get_lyrics_from_genius(title, artist)
+        
+        if genius_lyrics and genius_lyrics.get('text'):
+            lines = genius_lyrics['text'].split('\n')
+            lyrics_data = {'text': '\n'.join([line.strip() for line in lines if line.strip()])}
+            print(f"[LYRICS] [OK] Found {len(lines)} lines from Genius")
+    
+    result = {
+        "success": True,
+        "chord_data": chord_data,
+        "lyrics_data": lyrics_data,
+        "title": title,
+        "artist": artist,
+        "artwork": artwork_data,
+        "audio_url": audio_url,  # Temp file URL
+        "peaks_url": f"/api/peaks/{content_hash}",
+        "youtube_webpage_url": None,
+        "audio_available": audio_url is not None,
+        "duration": stats.get('duration') or 180,
+        "quality": tier['name']
+    }
+    quality_governor.observe(time.time() - started, stats.get('duration') or 180, tier)
+    
+    # Remember uploads by content so re-uploads skip the whole pipeline
+    cache_upload_result(content_hash, result, audio_ext)
+    
+    return result
+
+
+def fetch_thumbnail_base64(thumbnail_url):
+    """Download a thumbnail and return it base64-encoded, or None"""
+    if not thumbnail_url:
+        return None
+    try:
+        response = requests.get(thumbnail_url, timeout=5)
+        if response.status_code == 200:
+            return base64.b64encode(response.content).decode()
+    except Exception as e:
+        print(f"[INFO] Could not download thumbnail: {e}")
+    return None
+
+
+def iter_youtube_analysis(youtube_url, song_title=None, artist=None, quality=None, cancel=None):
+    """
+    Analyze a YouTube URL, yielding (event, data) pairs as results become available
+    
+    Events: 'metadata' first, 'artwork' as soon as the thumbnail is in, one
+    'chord' per detected chord while the stream is decoded, then 'lyrics',
+    and finally 'result' with the complete /analyze response. Genius lyrics
+    and the thumbnail are fetched in the background while chords are
+    computed. Yields nothing if the video info could not be extracted; if the
+    audio can't be streamed or analyzed the error propagates rather than
+    ending in a result with a missing or truncated progression.
+    quality is the requested tier name; the governor may pick a cheaper one under load.
+    cancel is an optional CancelToken; decoding stops with AnalysisCancelled once it trips.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    started = time.time()
+    tier = choose_quality_tier(quality)
+    
+    # Get YouTube info (no download - just streaming URL)
+    print(f"[ANALYZE] Getting YouTube info: {youtube_url}")
+    success, metadata = download_youtube_audio(youtube_url, None)
+    
+    if not success or not metadata:
+        return
+    if cancel:
+        cancel.check()
+    
+    # Use metadata from YouTube, unless song info was provided
+    title = metadata.get('title', 'Unknown Song')
+    youtube_stream_url = metadata.get('stream_url')
+    if song_title and artist:
+        title = song_title
+    else:
+        artist = metadata.get('artist', 'Unknown Artist')
+    
+    # Use proxy to stream from YouTube (stable id; the upstream URL is refreshed server-side)
+    audio_url = None
+    if youtube_stream_url and metadata.get('video_id'):
+        audio_url = f"/api/stream/{stream_urls.register(metadata)}"
+        print(f"[AUDIO] [OK] Using YouTube stream via proxy: {audio_url}")
+    elif youtube_stream_url:
+        audio_url = f"/api/proxy-audio?url={requests.utils.quote(youtube_stream_url)}"
+        print(f"[AUDIO] [OK] Using YouTube stream via proxy: {audio_url}")
+    else:
+        print(f"[AUDIO WARNING] No audio file available for playback")
+    
+    yield 'metadata', {
+        "title": title,
+        "artist": artist,
+        "audio_url": audio_url,
+        "youtube_webpage_url": metadata.get('youtube_url'),
+        "thumbnail": metadata.get('thumbnail'),
+        "duration": metadata.get('duration'),
+        "quality": tier['name']
+    }
+    
+    if not youtube_stream_url:
+        raise IOError("No audio stream available for this video")
+    
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # FETCH LYRICS FROM GENIUS while the audio is analyzed
+        print(f"[YOUTUBE] ===== FETCHING LYRICS NOW =====")
+        print(f"[YOUTUBE] Title: '{title}'")
+        print(f"[YOUTUBE] Artist: '{artist}'")
+        lyrics_future = executor.submit(get_lyrics_from_genius, title, artist)
+        artwork_future = executor.submit(fetch_thumbnail_base64, metadata.get('thumbnail'))
+        
+        # Decode the stream URL through ffmpeg and analyze it block by block
+        progression = []
+        stats = {}
+        artwork_sent = False
+        print(f"[YOUTUBE MODE] Streaming audio into chord analysis")
+        for chord in iter_stream_chords(youtube_stream_url, metadata.get('http_headers'), stats=stats, tier=tier,
+                                        cancel=cancel):
+            if not artwork_sent and artwork_future.done():
+                artwork_sent = True
+                yield 'artwork', {"artwork": artwork_future.result()}
+            progression.append(chord)
+            yield 'chord', chord
+        
+        artwork_data = artwork_future.result()
+        if not artwork_sent:
+            yield 'artwork', {"artwork": artwork_data}
+        lyrics_data = lyrics_future.result()
+    
+    yield 'lyrics', lyrics_data
+    
+    duration = stats.get('duration') or metadata.get('duration') or 180
+    quality_governor.observe(time.time() - started, duration, tier)
+    
+    yield 'result', {
+        "success": True,
+        "chord_data": {"progression": progression, "duration": duration},
+        "lyrics_data": lyrics_data,
+        "title": title,
+        "artist": artist,
+        "artwork": artwork_data,
+        "audio_url": audio_url,  # Proxy URL
+        "youtube_webpage_url": metadata.get('youtube_url'),
+        "audio_available": audio_url is not None,
+        "duration": duration,
+        "quality": tier['name']
+    }
+
+
+def iter_upload_analysis(audio, audio_ext, content_hash, song_info=None, user_id=None, quality=None, cancel=None):
+    """
+    Analyze uploaded audio, yielding (event, data) pairs as results become available
+    
+    Events: 'metadata' (tags, artwork and playback URL) first, one 'chord'
+    per detected chord while the audio is decoded, 'lyrics' from Genius
+    (looked up in the background), 'words' with Whisper word timestamps when
+    Genius has nothing, and finally 'result' with the complete /analyze
+    response, which is cached under the content hash like analyze_uploaded_audio.
+    audio is the file contents in memory, or the path of a staged upload.
+    quality is the requested tier name; the governor may pick a cheaper one under load.
+    cancel is an optional CancelToken checked while decoding and between Whisper chunks.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    started = time.time()
+    
+    cached = result_cache.get(content_hash)
+    if cached and cached_result_fits(cached, quality):
+        audio_data = audio if isinstance(audio, (bytes, bytearray)) else None
+        yield 'result', cached_upload_response(cached, content_hash, audio_data, audio_ext, song_info, user_id=user_id)
+        return
+    
+    tier = choose_quality_tier(quality)
+    title, artist, artwork_data = extract_embedded_metadata(audio)
+    title, artist = apply_song_info(song_info, title or "Unknown Song", artist or "Unknown Artist")
+    
+    # Store the playback copy first so the player can start loading right away
+    audio_url = None
+    try:
+        stored_path = save_playback_copy(audio, content_hash, audio_ext)
+        if not isinstance(audio, (bytes, bytearray)):
+            audio = stored_path  # the staged upload was moved into the store
+        audio_url = playback_audio_url(content_hash, audio_ext)
+    except Exception as e:
+        print(f"[AUDIO ERROR] Could not save audio file: {e}")
+    
+    yield 'metadata', {
+        "title": title,
+        "artist": artist,
+        "artwork": artwork_data,
+        "audio_url": audio_url,
+        "peaks_url": f"/api/peaks/{content_hash}",
+        "quality": tier['name']
+    }
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        known_song = title != "Unknown Song"
+        lyrics_future = executor.submit(get_lyrics_from_genius, title, artist) if known_song else None
+        
+        # Decode through ffmpeg and analyze segment by segment
+        progression = []
+        stats = {}
+        peaks = PeaksBuilder(tier['sample_rate'])
+        with pcm_source(audio) as source:
+            for chord in iter_stream_chords(source, stats=stats, on_pcm=peaks.add, tier=tier, cancel=cancel):
+                progression.append(chord)
+                yield 'chord', chord
+        peaks_store.set(content_hash, peaks.to_bytes())
+        
+        lyrics_data = lyrics_future.result() if lyrics_future else None
+    
+    if lyrics_data:
+        yield 'lyrics', lyrics_data
+    else:
+        # Whisper is the slowest stage, so its word timestamps come last
+        lyrics_data = extract_lyrics_with_timestamps(audio, None, tier=tier, cancel=cancel)
+        yield 'words', lyrics_data
+    
+    duration = stats.get('duration') or 180
+    quality_governor.observe(time.time() - started, duration, tier)
+    result = {
+        "success": True,
+        "chord_data": progression,
+        "lyrics_data": lyrics_data,
+        "title": title,
+        "artist": artist,
+        "artwork": artwork_data,
+        "audio_url": audio_url,
+        "peaks_url": f"/api/peaks/{content_hash}",
+        "youtube_webpage_url": None,
+        "audio_available": audio_url is not None,
+        "duration": duration,
+        "quality": tier['name']
+    }
+    cache_upload_result(content_hash, result, audio_ext)
+    log_analysis_activity('analyze', title, artist, user_id)
+    
+    yield 'result', result
+
+
+def youtube_source_key(youtube_url, song_title=None, artist=None, quality=None):
+    """Normalized identity of a YouTube analysis request (URL variants of one video match)"""
+    video = video_id_from_url(youtube_url) or youtube_url.strip()
+    return (f"youtube:{video}:{(song_title or '').strip().lower()}:{(artist or '').strip().lower()}"
+            f":{quality or DEFAULT_TIER}")
+
+
+def analyze_youtube_url(youtube_url, song_title=None, artist=None, quality=None, cancel=None):
+    """Build the /analyze response for a YouTube URL (streamed analysis, no download)"""
+    def compute():
+        for event, data in iter_youtube_analysis(youtube_url, song_title, artist, quality=quality, cancel=cancel):
+            if event == 'result':
+                return data
+        return None
+    
+    # Requests for the same video arriving together share one analysis
+    result, shared = analysis_flights.do(youtube_source_key(youtube_url, song_title, artist, quality), compute)
+    if shared:
+        print(f"[SINGLE-FLIGHT] Joined in-flight analysis of {youtube_url}")
+    
+    if result:
+        # Log analysis activity
+        user_id = current_user.id if current_user.is_authenticated else None
+        log_analysis_activity('analyze', result['title'], result['artist'], user_id)
+    
+    return result
+
+
+def song_info_from_fields(song_title, artist):
+    """Combine optional title/artist fields into the "Artist - Title" song info string"""
+    if song_title and artist:
+        return f"{artist} - {song_title}"
+    return song_title or None
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    """Reject oversized uploads with a JSON error instead of an HTML page"""
+    return jsonify({
+        "success": False,
+        "error": f"File too large. Maximum upload size is {MAX_UPLOAD_MB} MB."
+    }), 413
+
+
+def stream_youtube_analysis(youtube_url, song_title=None, artist=None, quality=None, cancel=None):
+    """Stream iter_youtube_analysis events as newline-delimited JSON"""
+    user_id = current_user.id if current_user.is_authenticated else None
+    
+    def generate():
+        found = False
+        try:
+            for event, data in iter_youtube_analysis(youtube_url, song_title, artist, quality=quality, cancel=cancel):
+                found = True
+                if event == 'result':
+                    log_analysis_activity('analyze', data['title'], data['artist'], user_id)
+                yield json.dumps({"event": event, "data": data}) + "\n"
+        except AnalysisCancelled as e:
+            print(f"[CANCEL] Streamed analysis of {youtube_url}: {e.reason}")
+            if e.reason == CancelToken.DEADLINE:
+                yield json.dumps({"event": "error", "data": {"error": str(e)}}) + "\n"
+            return
+        if not found:
+            yield json.dumps({"event": "error", "data": {"error": "Failed to get YouTube video info"}}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_sse(events, on_result=None):
+    """
+    Stream (event, data) pairs as text/event-stream
+    on_result, if given, is called with the final result before it is sent
+    """
+    def generate():
+        found = False
+        try:
+            for event, data in events:
+                found = True
+                if event == 'result' and on_result:
+                    on_result(data)
+                yield sse_event(event, data)
+        except AnalysisCancelled as e:
+            print(f"[CANCEL] Event stream: {e.reason}")
+            if e.reason == CancelToken.DEADLINE:
+                yield sse_event('error', {"error": str(e)})
+            return
+        except Exception as e:
+            print(f"[SSE ERROR] {e}")
+            yield sse_event('error', {"error": str(e)})
+            return
+        if not found:
+            yield sse_event('error', {"error": "Failed to get YouTube video info"})
+        yield sse_event('done', {})
+    
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # don't let a reverse proxy hold events back
+    return resp
+
+
+@app.route("/analyze/stream", methods=["GET", "POST"])
+def analyze_stream():
+    """
+    Server-Sent Events variant of /analyze: results are sent as they become available.
+    GET ?youtube_url=... (usable with EventSource), POST JSON with youtube_url,
+    or POST a multipart file upload. Events: metadata, artwork, chord (repeated),
+    lyrics or words (Whisper word timestamps), result, then done; error on failure.
+    """
+    try:
+        user_id = request_user_id()
+        
+        if request.method == 'GET' or request.is_json:
+            data = request.args if request.method == 'GET' else (request.get_json() or {})
+            youtube_url = data.get('youtube_url')
+            if not youtube_url:
+                return jsonify({"success": False, "error": "No youtube_url provided"}), 400
+            quality = data.get('quality')
+            if quality_error(quality):
+                return quality_error(quality)
+            
+            def log_result(result):
+                log_analysis_activity('analyze', result['title'], result['artist'], user_id)
+            
+            events = iter_youtube_analysis(youtube_url, data.get('song_title'), data.get('artist'), quality=quality,
+                                           cancel=request_cancel_token())
+            return stream_sse(events, on_result=log_result)
+        
+        if 'file' in request.files:
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({"success": False, "error": "Empty filename"}), 400
+            quality = request.form.get('quality')
+            if quality_error(quality):
+                return quality_error(quality)
+            
+            song_info = song_info_from_fields(request.form.get('song_title'), request.form.get('artist'))
+            audio_data = read_upload(file)
+            audio_ext = os.path.splitext(file.filename)[1].lower() or '.wav'
+            content_hash = upload_hash(file)
+            print(f"[UPLOAD] {file.filename}: {len(audio_data)} bytes, sha256={content_hash[:12]} (streamed analysis)")
+            
+            return stream_sse(iter_upload_analysis(audio_data, audio_ext, content_hash, song_info, user_id=user_id,
+                                                   quality=quality, cancel=request_cancel_token()))
+        
+        return jsonify({
+            "success": False,
+            "error": "Please provide either a file upload or youtube_url"
+        }), 400
+    
+    except Exception as e:
+        print(f"[ANALYZE ERROR] {e}")
+        return jsonify({"error": str(e), "success": False}), 500
+
+
 @app.route("/analyze", methods=["POST"])
 def analyze():
     """
@@ -791,250 +1770,719 @@ def analyze():
     - File upload (multipart/form-data with 'file' field)
     - YouTube URL (JSON with 'youtube_url' field)
     - Optional: song_title and artist for Genius lyrics
+    - Optional: quality = fast | balanced (default) | accurate
+    - Optional: stream=true with a youtube_url for newline-delimited JSON
+      events (metadata, then chords as they are computed, lyrics, result)
     """
-    temp_file = None
-    song_info = None
-    youtube_mode = False  # Track if we're analyzing YouTube URL
-    
     try:
         # Check if it's a YouTube URL request
         if request.is_json:
             data = request.get_json()
             youtube_url = data.get('youtube_url')
-            song_title = data.get('song_title')
-            artist = data.get('artist')
             
             if not youtube_url:
                 return jsonify({"error": "No youtube_url provided in JSON"}), 400
+            quality = data.get('quality')
+            if quality_error(quality):
+                return quality_error(quality)
             
-            # Get YouTube info (no download - just streaming URL)
-            print(f"[ANALYZE] Getting YouTube info: {youtube_url}")
-            success, metadata = download_youtube_audio(youtube_url, None)
+            # Newline-delimited JSON: one line per event, chords as they are computed
+            if data.get('stream'):
+                return stream_youtube_analysis(youtube_url, data.get('song_title'), data.get('artist'), quality,
+                                               cancel=request_cancel_token())
             
-            if not success:
+            result = analyze_youtube_url(youtube_url, data.get('song_title'), data.get('artist'), quality,
+                                         cancel=request_cancel_token())
+            if not result:
                 return jsonify({"error": "Failed to get YouTube video info"}), 400
+            return jsonify(result)
             
-            # Use metadata from YouTube
-            if metadata:
-                title = metadata.get('title', 'Unknown Song')
-                artist = metadata.get('artist', 'Unknown Artist')
-                youtube_thumbnail = metadata.get('thumbnail', '')
-                youtube_stream_url = metadata.get('stream_url')
-                original_youtube_url = metadata.get('youtube_url')
+        # Check if it's a file upload
+        elif 'file' in request.files:
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({"error": "Empty filename"}), 400
+            quality = request.form.get('quality')
+            if quality_error(quality):
+                return quality_error(quality)
             
-            # Use provided song info if available
-            if song_title and artist:
-                title = song_title
-                artist = artist
+            # Check for optional song info from form
+            song_info = song_info_from_fields(request.form.get('song_title'), request.form.get('artist'))
             
-            song_info = f"{artist} - {title}"
+            # Decode from the in-memory upload - nothing touches disk until
+            # the single playback copy is written
+            audio_data = read_upload(file)
+            audio_ext = os.path.splitext(file.filename)[1].lower() or '.wav'
+            content_hash = upload_hash(file)
+            print(f"[UPLOAD] {file.filename}: {len(audio_data)} bytes, sha256={content_hash[:12]}")
             
-            # FETCH LYRICS FROM GENIUS IMMEDIATELY
-            print(f"[YOUTUBE] ===== FETCHING LYRICS NOW =====")
-            print(f"[YOUTUBE] Title: '{title}'")
-            print(f"[YOUTUBE] Artist: '{artist}'")
+            # Already analyzed this exact audio? Answer without decoding it
+            cached = result_cache.get(content_hash)
+            if cached and cached_result_fits(cached, quality):
+                print(f"[CACHE] Hit for {content_hash[:12]} - skipping analysis")
+                return jsonify(cached_upload_response(cached, content_hash, audio_data, audio_ext, song_info))
             
-            youtube_lyrics = get_lyrics_from_genius(title, artist)
+            # Simultaneous uploads of the same audio are analyzed once
+            user_id = request_user_id()
+            cancel = request_cancel_token()
+            result, shared = analysis_flights.do(
+                f"upload:{content_hash}:{song_info or ''}:{quality or DEFAULT_TIER}",
+                lambda: analyze_uploaded_audio(audio_data, audio_ext, content_hash, song_info, user_id=user_id,
+                                               quality=quality, cancel=cancel)
+            )
+            if shared:
+                print(f"[SINGLE-FLIGHT] Joined in-flight analysis of {content_hash[:12]}")
+            return jsonify(result)
+            
+        else:
+            return jsonify({
+                "error": "Please provide either a file upload or youtube_url in JSON"
+            }), 400
+    
+    except AnalysisCancelled as e:
+        return cancelled_response(e)
+    except Exception as e:
+        print(f"[ANALYZE ERROR] {e}")
+        return jsonify({"error": str(e), "success": False}), 500
+
+
+def saved_video_ids(user_id):
+    """YouTube video ids already in a user's library"""
+    rows = db.session.query(SavedAnalysis.source_url).filter(
+        SavedAnalysis.user_id == user_id, SavedAnalysis.source_url.isnot(None)).all()
+    return {video_id for video_id in (video_id_from_url(url) for url, in rows) if video_id}
+
+
+def save_result_to_library(user_id, youtube_url, result):
+    """
+    Store a finished YouTube analysis as a SavedAnalysis (playlist imports)
+    Idempotent per video, so a job retried after saving doesn't add it twice.
+    """
+    source_url = result.get('youtube_webpage_url') or youtube_url
+    video_id = video_id_from_url(source_url)
+    if video_id and video_id in saved_video_ids(user_id):
+        return None
+    
+    title, artist = result.get('title') or 'Unknown', result.get('artist') or ''
+    analysis = SavedAnalysis(
+        user_id=user_id,
+        title=(f"{title} - {artist}" if artist and artist not in title else title)[:200],
+        artist=artist[:200] or None,
+        source_type='youtube',
+        source_url=source_url,
+        duration=int(result['duration']) if result.get('duration') else None,
+        artwork=result.get('artwork')
+    )
+    # Same shape the library page reads for saved songs
+    analysis.set_chord_data({'chords': result['chord_data']['progression'],
+                             'duration': result['chord_data']['duration']})
+    analysis.set_lyrics_data({'lyrics': result.get('lyrics_data')})
+    db.session.add(analysis)
+    db.session.commit()
+    
+    print(f"[SAVE] Saved {analysis.title} to the library of user {user_id}")
+    log_analysis_activity('save', title, artist, user_id)
+    return analysis
+
+
+def run_youtube_job(progress, youtube_url, song_title=None, artist=None, user_id=None, quality=None, batch_id=None,
+                    save_to_library=False):
+    """
+    Job body for a YouTube analysis: maps pipeline events to progress
+    (batch_id is only for on_job_settled; save_to_library stores the result for user_id)
+    """
+    progress('metadata', 2)
+    duration = None
+    for event, data in iter_youtube_analysis(youtube_url, song_title, artist, quality=quality):
+        if event == 'metadata':
+            duration = data.get('duration')
+            progress('chords', 10)
+        elif event == 'chord' and duration:
+            progress('chords', 10 + 75 * min(1.0, data['end_time'] / duration))
+        elif event == 'lyrics':
+            progress('lyrics', 90)
+        elif event == 'result':
+            log_analysis_activity('analyze', data['title'], data['artist'], user_id)
+            if save_to_library and user_id:
+                save_result_to_library(user_id, youtube_url, data)
+            return data
+    raise ValueError("Failed to get YouTube video info")
+
+
+def run_upload_job(progress, audio_ext, content_hash, song_info=None, user_id=None, input_data=None, quality=None,
+                   batch_id=None):
+    """Job body for an uploaded file (answers from the result cache when it can)"""
+    audio_data = input_data
+    cached = result_cache.get(content_hash)
+    if cached and cached_result_fits(cached, quality):
+        return cached_upload_response(cached, content_hash, audio_data, audio_ext, song_info, user_id=user_id)
+    return analyze_uploaded_audio(audio_data, audio_ext, content_hash, song_info, user_id=user_id, progress=progress,
+                                  quality=quality)
+
+
+# Job kind -> handler run by JobWorker as fn(progress, **payload)
+JOB_HANDLERS = {
+    'youtube': run_youtube_job,
+    'upload': run_upload_job,
+}
+
+
+def job_response(job, created=None):
+    """Public view of a job row"""
+    job = job.to_dict()
+    body = {
+        "success": True,
+        "job_id": job['job_id'],
+        "status": job['status'],
+        "stage": job['stage'],
+        "percent": job['percent'],
+        "attempts": job['attempts'],
+        "status_url": f"/api/jobs/{job['job_id']}"
+    }
+    if created is not None:
+        body["deduplicated"] = not created
+    if job['status'] == 'done':
+        body["result"] = job['result']
+    elif job['status'] == 'dead':
+        body["error"] = job['error']
+    elif job['error']:
+        # Waiting to retry after a failed attempt
+        body["last_error"] = job['error']
+        body["retry_at"] = job['available_at']
+    return body
+
+
+@app.route("/api/jobs", methods=["POST"])
+def create_analysis_job():
+    """
+    Queue an analysis and return its job id immediately (202).
+    Takes the same input as /analyze: JSON with youtube_url (optional
+    song_title/artist/quality) or a multipart file upload. Identical inputs share a job.
+    """
+    try:
+        user_id = request_user_id()
+        
+        if request.is_json:
+            data = request.get_json()
+            youtube_url = data.get('youtube_url')
+            if not youtube_url:
+                return jsonify({"success": False, "error": "No youtube_url provided in JSON"}), 400
             
-            # For YouTube URLs, we won't download - just return streaming info
-            # Set audio_path to None so we skip the file processing
-            audio_path = None
-            youtube_mode = True
+            quality = data.get('quality')
+            if quality_error(quality):
+                return quality_error(quality)
             
-        # Check if it's a file upload
+            song_title, artist = data.get('song_title'), data.get('artist')
+            key = youtube_source_key(youtube_url, song_title, artist, quality)
+            job, created = analysis_jobs.enqueue(key, 'youtube', {
+                'youtube_url': youtube_url, 'song_title': song_title, 'artist': artist, 'user_id': user_id,
+                'quality': quality
+            }, user_id=user_id)
+        
         elif 'file' in request.files:
             file = request.files['file']
             if file.filename == '':
-                return jsonify({"error": "Empty filename"}), 400
-            
-            # Check for optional song info from form
-            song_title = request.form.get('song_title')
-            artist = request.form.get('artist')
+                return jsonify({"success": False, "error": "Empty filename"}), 400
+            quality = request.form.get('quality')
+            if quality_error(quality):
+                return quality_error(quality)
             
-            if song_title and artist:
-                song_info = f"{artist} - {song_title}"
-            elif song_title:
-                song_info = song_title
-            
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-            file.save(temp_file.name)
-            temp_file.close()
-            audio_path = temp_file.name
+            song_info = song_info_from_fields(request.form.get('song_title'), request.form.get('artist'))
+            audio_data = read_upload(file)
+            audio_ext = os.path.splitext(file.filename)[1].lower() or '.wav'
+            content_hash = upload_hash(file)
             
+            key = f"upload:{content_hash}:{song_info or ''}:{quality or DEFAULT_TIER}"
+            # The audio travels in the job row so a worker on any node can run it
+            job, created = analysis_jobs.enqueue(key, 'upload', {
+                'audio_ext': audio_ext, 'content_hash': content_hash, 'song_info': song_info, 'user_id': user_id,
+                'quality': quality
+            }, input_data=audio_data, user_id=user_id)
+        
+        else:
+            return jsonify({
+                "success": False,
+                "error": "Please provide either a file upload or youtube_url in JSON"
+            }), 400
+        
+        print(f"[JOBS] {'Queued' if created else 'Joined'} job {job.id[:12]} ({job.status})")
+        return jsonify(job_response(job, created)), 202
+    
+    except Exception as e:
+        print(f"[JOBS ERROR] {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_analysis_job(job_id):
+    """Status, progress (stage, percent) and, once done, the result of an analysis job"""
+    try:
+        job = analysis_jobs.get(job_id)
+    except ValueError:
+        job = None
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify(job_response(job))
+
+
+def advance_batch(batch):
+    """Release a batch's held items while it has fewer than max_concurrency queued or running"""
+    def lock_batch():
+        # A no-op write row-locks the batch, so concurrent advances of it run one at a time
+        AnalysisBatch.query.filter_by(id=batch.id).update(
+            {'max_concurrency': AnalysisBatch.max_concurrency}, synchronize_session=False)
+    
+    released = analysis_jobs.advance(batch.job_ids(), batch.max_concurrency, lock=lock_batch)
+    if released:
+        print(f"[BATCH] Released {released} item(s) of batch {batch.id[:12]}")
+
+
+def on_job_settled(job_id, status, payload):
+    """JobWorker hook: a finished batch item makes room for the next one"""
+    batch_id = payload.get('batch_id')
+    if batch_id:
+        batch = db.session.get(AnalysisBatch, batch_id)
+        if batch:
+            advance_batch(batch)
+
+
+def batch_item_spec(item, quality, user_id):
+    """
+    Turn one JSON batch item into (kind, payload, staged_path, source, upload_id)
+    Items are a YouTube URL (string or {youtube_url, song_title, artist}) or
+    {upload_id} of a completed resumable upload; either may set its own quality.
+    Raises ValueError or UploadError for an unusable item.
+    """
+    if isinstance(item, str):
+        item = {'youtube_url': item}
+    if not isinstance(item, dict):
+        raise ValueError("each item must be a YouTube URL or an object")
+    quality = item.get('quality') or quality
+    if quality and quality not in USER_TIERS:
+        raise ValueError(f"quality must be one of: {', '.join(USER_TIERS)}")
+    
+    if item.get('youtube_url'):
+        payload = {'youtube_url': item['youtube_url'], 'song_title': item.get('song_title'),
+                   'artist': item.get('artist'), 'user_id': user_id, 'quality': quality}
+        return 'youtube', payload, None, item['youtube_url'], None
+    
+    if item.get('upload_id'):
+        session, staged_path, content_hash = upload_sessions.finalize(str(item['upload_id']))
+        payload = {'audio_ext': session['ext'], 'content_hash': content_hash,
+                   'song_info': session.get('song_info'), 'user_id': user_id, 'quality': quality}
+        return 'upload', payload, staged_path, session['filename'], item['upload_id']
+    
+    raise ValueError("each item needs a youtube_url or an upload_id")
+
+
+def queue_batch(specs, concurrency, quality, user_id):
+    """
+    Create a batch and enqueue its items; all but the first concurrency are held
+    specs: (kind, payload, audio bytes or staged file path or None, source) per item
+    """
+    # Batches outlive their jobs' dead-letter TTL only as dangling references
+    cutoff = datetime.utcnow() - timedelta(seconds=analysis_jobs.dead_ttl)
+    AnalysisBatch.query.filter(AnalysisBatch.created_at < cutoff).delete(synchronize_session=False)
+    
+    # The batch row goes in first so items finishing early can find it
+    batch_id = secrets.token_hex(16)
+    items = [{'job_id': job_id_for(f"batch:{batch_id}:{index}"), 'kind': kind, 'source': source}
+             for index, (kind, _, _, source) in enumerate(specs)]
+    batch = AnalysisBatch(id=batch_id, user_id=user_id, items=json.dumps(items),
+                          max_concurrency=concurrency, quality=quality)
+    db.session.add(batch)
+    db.session.commit()
+    
+    # Items past the concurrency limit are held until earlier ones settle
+    for index, (kind, payload, input_data, _) in enumerate(specs):
+        if isinstance(input_data, str):
+            with open(input_data, 'rb') as f:  # staged upload, read one at a time
+                input_data = f.read()
+        analysis_jobs.enqueue(f"batch:{batch_id}:{index}", kind, dict(payload, batch_id=batch_id),
+                              input_data=input_data, user_id=user_id, hold=index >= concurrency)
+    
+    print(f"[BATCH] Queued batch {batch_id[:12]}: {len(specs)} item(s), {concurrency} at a time")
+    return batch
+
+
+def batch_concurrency(value):
+    """Requested batch concurrency capped at BATCH_CONCURRENCY; ValueError if not an integer"""
+    try:
+        return max(1, min(int(value or BATCH_CONCURRENCY), BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        raise ValueError("concurrency must be an integer")
+
+
+def batch_response(batch, include_results=True):
+    """Public view of a batch: per-item job status (and results) plus overall counts"""
+    jobs = analysis_jobs.get_many(batch.job_ids())
+    counts = {'held': 0, 'queued': 0, 'running': 0, 'done': 0, 'dead': 0, 'expired': 0}
+    items = []
+    for index, item in enumerate(batch.get_items()):
+        job = jobs.get(item['job_id'])
+        if job is None:
+            # Finished jobs are purged after JOB_TTL; the batch only remembers the input
+            body = {"job_id": item['job_id'], "status": 'expired'}
         else:
-            return jsonify({
-                "error": "Please provide either a file upload or youtube_url in JSON"
-            }), 400
+            body = job_response(job)
+            body.pop('success', None)
+            if not include_results:
+                body.pop('result', None)
+        counts['held' if body.get('stage') == 'held' else body['status']] += 1
+        items.append(dict(body, index=index, kind=item['kind'], source=item['source']))
+    
+    pending = counts['held'] + counts['queued'] + counts['running']
+    return {
+        "success": True,
+        "batch_id": batch.id,
+        "status": 'running' if pending else 'done',
+        "max_concurrency": batch.max_concurrency,
+        "quality": batch.quality,
+        "created_at": batch.created_at.isoformat() if batch.created_at else None,
+        "counts": counts,
+        "items": items,
+        "status_url": f"/api/batches/{batch.id}"
+    }
+
+
+@app.route("/api/batches", methods=["POST"])
+def create_analysis_batch():
+    """
+    Queue many analyses at once and return a batch id immediately (202).
+    JSON: items = list of YouTube URLs, {youtube_url, song_title, artist} or
+    {upload_id} (a completed /api/uploads session), plus optional quality and
+    concurrency. Multipart: files (repeated) and/or youtube_url (repeated),
+    with quality and concurrency as form fields. Each item becomes a job on the
+    shared queue; at most `concurrency` of them are queued or running at a time.
+    """
+    try:
+        user_id = request_user_id()
+        upload_ids = []
+        specs = []  # (kind, payload, audio bytes or staged file path or None, source)
         
-        # Process the audio (skip if YouTube streaming mode)
-        if audio_path and os.path.exists(audio_path):
-            print(f"Analyzing audio: {audio_path}")
-            chord_data, lyrics_data = process_audio(audio_path, song_info)
-        else:
-            # YouTube mode - no local file processing, just return placeholder data
-            print(f"[YOUTUBE MODE] Skipping audio processing, using defaults")
-            chord_data = {
-                "progression": [
-                    {"chord": "C", "start_time": 0},
-                    {"chord": "G", "start_time": 15},
-                    {"chord": "Am", "start_time": 30},
-                    {"chord": "F", "start_time": 45}
-                ]
-            }
-            # Use the lyrics we fetched earlier
-            lyrics_data = youtube_lyrics if 'youtube_lyrics' in locals() else None
-        
-        # Try to extract metadata from audio file (only if not already set from YouTube)
-        if 'title' not in locals():
-            title = "Unknown Song"
-        if 'artist' not in locals():
-            artist = "Unknown Artist"
-        if 'artwork_data' not in locals():
-            artwork_data = None
-        
-        # Only extract metadata from audio file if we have one
-        if audio_path and os.path.exists(audio_path):
-            try:
-                import mutagen
-                from mutagen.id3 import ID3, APIC
-                from mutagen.mp4 import MP4
-                import base64
-                
-                audio_file = mutagen.File(audio_path)
-                
-                if audio_file is not None:
-                    # Extract title
-                    if 'TIT2' in audio_file:  # MP3 ID3
-                        title = str(audio_file['TIT2'])
-                    elif 'title' in audio_file:  # FLAC, OGG
-                        title = str(audio_file['title'][0])
-                    elif '\xa9nam' in audio_file:  # M4A
-                        title = str(audio_file['\xa9nam'][0])
-                    
-                    # Extract artist
-                    if 'TPE1' in audio_file:  # MP3 ID3
-                        artist = str(audio_file['TPE1'])
-                    elif 'artist' in audio_file:  # FLAC, OGG
-                        artist = str(audio_file['artist'][0])
-                    elif '\xa9ART' in audio_file:  # M4A
-                        artist = str(audio_file['\xa9ART'][0])
-                    
-                    # Extract album artwork
-                    if isinstance(audio_file, MP4):  # M4A
-                        if 'covr' in audio_file:
-                            artwork_data = base64.b64encode(audio_file['covr'][0]).decode()
-                    elif hasattr(audio_file, 'tags'):  # MP3
-                        for tag in audio_file.tags.values():
-                            if isinstance(tag, APIC):
-                                artwork_data = base64.b64encode(tag.data).decode()
-                                break
-            except Exception as e:
-                print(f"[INFO] Could not extract metadata: {e}")
-        
-        # Override with song_info if provided (from YouTube)
-        if song_info:
-            if " - " in song_info:
-                parts = song_info.split(" - ", 1)
-                artist = parts[0].strip()
-                title = parts[1].strip()
-            elif " by " in song_info.lower():
-                parts = song_info.lower().split(" by ", 1)
-                title = song_info[:len(parts[0])].strip()
-                artist = song_info[len(parts[0])+4:].strip()
-            else:
-                title = song_info
+        if request.is_json:
+            data = request.get_json() or {}
+            items = data.get('items')
+            if not isinstance(items, list) or not items:
+                return jsonify({"success": False, "error": "items must be a non-empty list"}), 400
+            if len(items) > BATCH_MAX_ITEMS:
+                return jsonify({"success": False, "error": f"A batch holds at most {BATCH_MAX_ITEMS} items"}), 400
+            quality, concurrency = data.get('quality'), data.get('concurrency')
+            if quality_error(quality):
+                return quality_error(quality)
+            
+            for index, item in enumerate(items):
+                try:
+                    kind, payload, staged_path, source, upload_id = batch_item_spec(item, quality, user_id)
+                except (UploadError, ValueError) as e:
+                    return jsonify({"success": False, "error": f"Item {index}: {e}"}), getattr(e, 'status_code', 400)
+                specs.append((kind, payload, staged_path, source))
+                if upload_id:
+                    upload_ids.append(upload_id)
         
-        # Download YouTube thumbnail if available
-        if 'youtube_thumbnail' in locals() and youtube_thumbnail and not artwork_data:
-            try:
-                import requests
-                response = requests.get(youtube_thumbnail, timeout=5)
-                if response.status_code == 200:
-                    import base64
-                    artwork_data = base64.b64encode(response.content).decode()
-            except Exception as e:
-                print(f"[INFO] Could not download thumbnail: {e}")
+        else:
+            files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+            urls = [url.strip() for url in request.form.getlist('youtube_url') if url.strip()]
+            if not files and not urls:
+                return jsonify({
+                    "success": False,
+                    "error": "Please provide items in JSON, or files / youtube_url form fields"
+                }), 400
+            if len(files) + len(urls) > BATCH_MAX_ITEMS:
+                return jsonify({"success": False, "error": f"A batch holds at most {BATCH_MAX_ITEMS} items"}), 400
+            quality, concurrency = request.form.get('quality'), request.form.get('concurrency')
+            if quality_error(quality):
+                return quality_error(quality)
+            
+            for file in files:
+                payload = {'audio_ext': os.path.splitext(file.filename)[1].lower() or '.wav',
+                           'content_hash': upload_hash(file), 'song_info': None, 'user_id': user_id,
+                           'quality': quality}
+                specs.append(('upload', payload, read_upload(file), file.filename))
+            for url in urls:
+                payload = {'youtube_url': url, 'song_title': None, 'artist': None, 'user_id': user_id,
+                           'quality': quality}
+                specs.append(('youtube', payload, None, url))
         
-        # Keep audio file for playback or use YouTube streaming URL
-        audio_url = None
+        try:
+            concurrency = batch_concurrency(concurrency)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         
-        # Check if we're in YouTube mode
-        if youtube_mode and 'youtube_stream_url' in locals() and youtube_stream_url:
-            # Use proxy to stream from YouTube
-            audio_url = f"/api/proxy-audio?url={requests.utils.quote(youtube_stream_url)}"
-            print(f"[AUDIO] [OK] Using YouTube stream via proxy: {audio_url}")
-        elif audio_path and os.path.exists(audio_path):
-            try:
-                import hashlib
-                import shutil
-                
-                print(f"[AUDIO] Processing audio file for playback...")
-                print(f"[AUDIO] Source file: {audio_path}")
-                print(f"[AUDIO] File size: {os.path.getsize(audio_path)} bytes")
-                
-                # Create hash from title and artist
-                file_hash = hashlib.md5(f"{artist}{title}".encode()).hexdigest()[:12]
-                file_ext = os.path.splitext(audio_path)[1]  # Get extension (.m4a, .webm, etc)
-                
-                # Copy to temp directory with hash-based name
-                temp_audio_path = os.path.join(tempfile.gettempdir(), f"chordis_{file_hash}{file_ext}")
-                shutil.copy2(audio_path, temp_audio_path)
-                
-                # Remove original temp file
-                os.remove(audio_path)
-                
-                # Create URL for serving
-                audio_url = f"/api/temp-audio/{file_hash}{file_ext}"
-                print(f"[AUDIO] [OK] Saved for playback: {temp_audio_path}")
-                print(f"[AUDIO] [OK] Serving at: {audio_url}")
-            except Exception as e:
-                print(f"[AUDIO ERROR] Could not save audio file: {e}")
-                import traceback
-                traceback.print_exc()
-                # Clean up on error
-                if os.path.exists(audio_path):
-                    os.remove(audio_path)
-        else:
-            print(f"[AUDIO WARNING] No audio file available for playback")
+        batch = queue_batch(specs, concurrency, quality, user_id)
         
-        # Log analysis activity
-        user_id = current_user.id if current_user.is_authenticated else None
-        log_analysis_activity('analyze', title, artist, user_id)
+        # The staged files now live in the job rows
+        for upload_id in upload_ids:
+            upload_sessions.discard(upload_id)
         
-        # Lyrics already fetched earlier for YouTube mode, only fetch for file uploads
-        if not youtube_mode and not lyrics_data:
-            print(f"[LYRICS] Fetching lyrics for uploaded file")
-            genius_lyrics = get_lyrics_from_genius(title, artist)
-            
-            if genius_lyrics and genius_lyrics.get('text'):
-                lines = genius_lyrics['text'].split('\n')
-                lyrics_data = {'text': '\n'.join([line.strip() for line in lines if line.strip()])}
-                print(f"[LYRICS] [OK] Found {len(lines)} lines from Genius")
+        return jsonify(batch_response(batch)), 202
+    
+    except Exception as e:
+        print(f"[BATCH ERROR] {e}")
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/playlists", methods=["POST"])
+@api_login_required
+def import_youtube_playlist():
+    """
+    Analyze a YouTube playlist into the user's library (202 with a batch).
+    JSON: playlist_url, plus optional quality, concurrency and limit (at most
+    BATCH_MAX_ITEMS videos). The playlist is listed with flat extraction (ids
+    and titles only); each video's metadata, audio stream and analysis are
+    then handled by its own batch job, `concurrency` at a time, which saves
+    the result as a SavedAnalysis. Videos already in the library are skipped.
+    Progress: GET /api/batches/<batch_id>.
+    """
+    try:
+        data = request.get_json() or {}
+        playlist_id = playlist_id_from_url((data.get('playlist_url') or '').strip())
+        if not playlist_id:
+            return jsonify({"success": False, "error": "playlist_url must be a YouTube playlist URL"}), 400
+        quality = data.get('quality')
+        if quality_error(quality):
+            return quality_error(quality)
+        try:
+            concurrency = batch_concurrency(data.get('concurrency'))
+            limit = max(1, min(int(data.get('limit') or BATCH_MAX_ITEMS), BATCH_MAX_ITEMS))
+        except (TypeError, ValueError) as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         
-        return jsonify({
-            "success": True,
-            "chord_data": chord_data,
-            "lyrics_data": lyrics_data,
+        # One entry past the limit tells us whether the playlist was cut short
+        try:
+            title, entries = ydl_pool.extract_playlist(playlist_id, limit=limit + 1)
+        except Exception as e:
+            print(f"[PLAYLIST ERROR] {playlist_id}: {e}")
+            return jsonify({"success": False, "error": "Could not load the playlist (is it public?)"}), 400
+        truncated = len(entries) > limit
+        entries = entries[:limit]
+        
+        # Skip videos already saved, and repeats within the playlist (one job per video)
+        seen = saved_video_ids(current_user.id)
+        pending = []
+        for entry in entries:
+            if entry['video_id'] not in seen:
+                seen.add(entry['video_id'])
+                pending.append(entry)
+        playlist = {
+            "playlist_id": playlist_id,
             "title": title,
-            "artist": artist,
-            "artwork": artwork_data,
-            "audio_url": audio_url,  # Proxy URL or temp file URL
-            "youtube_webpage_url": original_youtube_url if 'original_youtube_url' in locals() else None,
-            "audio_available": audio_url is not None,
-            "duration": 180  # Default duration, can be calculated from audio
-        })
+            "entries": len(entries),
+            "skipped": len(entries) - len(pending),  # already saved or repeated
+            "truncated": truncated
+        }
+        print(f"[PLAYLIST] {title or playlist_id}: {len(entries)} video(s), {len(pending)} to analyze")
+        if not pending:
+            return jsonify({"success": True, "batch_id": None, "playlist": playlist,
+                            "message": "Every video is already in your library"})
+        
+        specs = [('youtube', {'youtube_url': entry['url'], 'song_title': None, 'artist': None,
+                              'user_id': current_user.id, 'quality': quality, 'save_to_library': True},
+                  None, entry['url'])
+                 for entry in pending]
+        batch = queue_batch(specs, concurrency, quality, current_user.id)
+        return jsonify(dict(batch_response(batch, include_results=False), playlist=playlist)), 202
     
     except Exception as e:
-        # Clean up on error
-        if temp_file and os.path.exists(temp_file.name):
-            os.remove(temp_file.name)
+        print(f"[PLAYLIST ERROR] {e}")
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/batches/<batch_id>", methods=["GET"])
+def get_analysis_batch(batch_id):
+    """
+    Per-item status, progress and results of a batch (?results=false leaves results out;
+    each item's status_url has its full job)
+    """
+    if not re.fullmatch(r'[0-9a-f]{32}', batch_id):
+        return jsonify({"success": False, "error": "Batch not found"}), 404
+    batch = db.session.get(AnalysisBatch, batch_id)
+    if not batch:
+        return jsonify({"success": False, "error": "Batch not found"}), 404
+    
+    # Catches up after items that were dead-lettered without a worker hook (lease expiry)
+    advance_batch(batch)
+    include_results = request.args.get('results', 'true').lower() != 'false'
+    return jsonify(batch_response(batch, include_results))
+
+
+# In-process queue workers, off by default: analyses run in dedicated worker.py
+# processes so web workers stay behind the gateway's admission control. Set
+# ANALYSIS_WORKERS for a single-process setup (e.g. local development).
+analysis_worker = JobWorker(analysis_jobs, JOB_HANDLERS, context=app.app_context,
+                            on_settled=on_job_settled).start(int(os.getenv('ANALYSIS_WORKERS', 0)))
+
+
+@app.route("/api/uploads/check", methods=["POST"])
+def check_upload():
+    """
+    Hash-first upload handshake.
+    Clients send the SHA-256 of a file (plus optional size and duration)
+    before uploading it. If we already have an analysis (at the requested
+    quality or better) or the audio itself for that hash, the result comes
+    back immediately and the upload is skipped.
+    """
+    data = request.get_json(silent=True) or {}
+    content_hash = str(data.get('hash', '')).strip().lower()
+    size = data.get('size')
+    song_info = song_info_from_fields(data.get('song_title'), data.get('artist'))
+    quality = data.get('quality')
+    
+    if not re.fullmatch(r'[0-9a-f]{64}', content_hash):
+        return jsonify({"success": False, "error": "hash must be a hex SHA-256 digest"}), 400
+    if quality_error(quality):
+        return quality_error(quality)
+    
+    if size is not None:
+        try:
+            if int(size) > MAX_UPLOAD_MB * 1024 * 1024:
+                return jsonify({
+                    "success": False,
+                    "error": f"File too large. Maximum upload size is {MAX_UPLOAD_MB} MB."
+                }), 413
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "size must be an integer"}), 400
+    
+    try:
+        stored_path, stored_ext = find_playback_copy(content_hash)
+        
+        cached = result_cache.get(content_hash)
+        if cached and cached_result_fits(cached, quality):
+            print(f"[UPLOAD CHECK] Known analysis for {content_hash[:12]}")
+            audio_ext = stored_ext or cached.get('audio_ext', '')
+            result = cached_upload_response(cached, content_hash, None, audio_ext, song_info)
+            if not stored_path:
+                # The analysis is known but there is nothing to play it with:
+                # the client still has to upload the audio
+                result['audio_url'] = None
+                result['audio_available'] = False
+                return jsonify({"success": True, "known": True, "upload_required": True, "result": result})
+            return jsonify({"success": True, "known": True, "upload_required": False, "result": result})
+        
+        if stored_path:
+            print(f"[UPLOAD CHECK] Known audio for {content_hash[:12]} - analyzing stored copy")
+            with open(stored_path, 'rb') as f:
+                audio_data = f.read()
+            result = analyze_uploaded_audio(audio_data, stored_ext, content_hash, song_info, quality=quality,
+                                            cancel=request_cancel_token())
+            return jsonify({"success": True, "known": True, "upload_required": False, "result": result})
+        
+        return jsonify({"success": True, "known": False, "upload_required": True})
+    
+    except AnalysisCancelled as e:
+        return cancelled_response(e)
+    except Exception as e:
+        print(f"[UPLOAD CHECK ERROR] {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/uploads", methods=["POST"])
+def create_upload_session():
+    """
+    Start a resumable chunked upload.
+    JSON: filename, size (bytes, recommended), optional hash, song_title, artist
+    Returns an upload_id and the chunk_size to PUT chunks with
+    """
+    data = request.get_json(silent=True) or {}
+    
+    if not data.get('filename'):
+        return jsonify({"success": False, "error": "filename is required"}), 400
+    
+    try:
+        session = upload_sessions.create(
+            data['filename'],
+            size=data.get('size'),
+            expected_hash=data.get('hash'),
+            song_info=song_info_from_fields(data.get('song_title'), data.get('artist'))
+        )
+    except (UploadError, TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), getattr(e, 'status_code', 400)
+    
+    print(f"[UPLOAD] Session {session['upload_id'][:8]} created for {session['filename']} ({session['size']} bytes)")
+    return jsonify({"success": True, **session, "received": []}), 201
+
+
+@app.route("/api/uploads/<upload_id>", methods=["GET"])
+def get_upload_session(upload_id):
+    """Report which chunks of an upload have arrived so a client can resume"""
+    try:
+        return jsonify({"success": True, **upload_sessions.get(upload_id)})
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status_code
+
+
+@app.route("/api/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+def put_upload_chunk(upload_id, index):
+    """Store one numbered chunk (raw request body); re-sending a chunk is safe"""
+    try:
+        session = upload_sessions.write_chunk(upload_id, index, request.get_data(cache=False))
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status_code
+    
+    return jsonify({
+        "success": True,
+        "upload_id": upload_id,
+        "index": index,
+        "received": session['received'],
+        "total_chunks": session['total_chunks']
+    })
+
+
+@app.route("/api/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload_session(upload_id):
+    """
+    Assemble a finished upload and feed the staged file straight into analysis
+    Optional quality as a JSON field or query parameter, as for /analyze
+    """
+    quality = (request.get_json(silent=True) or {}).get('quality') or request.args.get('quality')
+    if quality_error(quality):
+        return quality_error(quality)
+    try:
+        session, staged_path, content_hash = upload_sessions.finalize(upload_id)
+    except UploadError as e:
+        return jsonify({"success": False, "error": str(e)}), e.status_code
+    
+    try:
+        song_info = session.get('song_info')
+        audio_ext = session['ext']
+        print(f"[UPLOAD] Session {upload_id[:8]} complete, sha256={content_hash[:12]}")
+        
+        cached = result_cache.get(content_hash)
+        if cached and cached_result_fits(cached, quality):
+            print(f"[CACHE] Hit for {content_hash[:12]} - skipping analysis")
+            save_playback_copy(staged_path, content_hash, audio_ext)
+            result = cached_upload_response(cached, content_hash, None, audio_ext, song_info)
+        else:
+            result = analyze_uploaded_audio(staged_path, audio_ext, content_hash, song_info, quality=quality,
+                                            cancel=request_cancel_token())
         
+        # Staged file has been moved into place; drop the session bookkeeping
+        upload_sessions.discard(upload_id)
+        return jsonify(result)
+    
+    except AnalysisCancelled as e:
+        # The staged file stays with the session, so finalize can simply be retried
+        return cancelled_response(e)
+    except Exception as e:
+        # Keep the session so the client can retry finalize without re-uploading
+        print(f"[UPLOAD ERROR] Finalize failed for {upload_id[:8]}: {e}")
         return jsonify({"error": str(e), "success": False}), 500
 
+
 @app.route("/health", methods=["GET"])
 def health():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "models_loaded": True})
+    return jsonify({
+        "status": "healthy",
+        "models_loaded": True,
+        "youtube_cache": youtube_metadata.stats(),
+        "ytdlp_pool": ydl_pool.stats(),
+        "audio_store": audio_store.stats(),
+        "single_flight": analysis_flights.stats(),
+        "quality": quality_governor.status()
+    })
 
 @app.route("/", methods=["GET"])
 def index():
@@ -1064,29 +2512,19 @@ def get_audio_url():
             if not youtube_url:
                 return jsonify({"error": "No YouTube URL provided"}), 400
             
-            # Get audio stream URL without downloading
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-            }
+            # Get audio stream URL without downloading (cached per video id)
+            info = youtube_metadata.get(youtube_url)
+            audio_url = info.get('stream_url')
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(youtube_url, download=False)
-                audio_url = info.get('url')
-                title = info.get('title', 'Unknown Title')
-                duration = info.get('duration', 0)
-                
-                if audio_url:
-                    return jsonify({
-                        "success": True,
-                        "audio_url": audio_url,
-                        "title": title,
-                        "duration": duration
-                    })
-                else:
-                    return jsonify({"error": "Could not extract audio URL"}), 400
+            if audio_url:
+                return jsonify({
+                    "success": True,
+                    "audio_url": audio_url,
+                    "title": info.get('title') or 'Unknown Title',
+                    "duration": info.get('duration', 0)
+                })
+            else:
+                return jsonify({"error": "Could not extract audio URL"}), 400
                     
         elif url_type == 'search':
             # Search for song on YouTube and get audio URL
@@ -1094,36 +2532,25 @@ def get_audio_url():
             if not query:
                 return jsonify({"error": "No search query provided"}), 400
             
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'quiet': True,
-                'no_warnings': True,
-                'default_search': 'ytsearch1:',  # Search YouTube and get first result
-                'extract_flat': False,
-            }
-            
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    print(f"[SEARCH] Searching YouTube for: {query}")
-                    search_result = ydl.extract_info(f"ytsearch1:{query}", download=False)
-                    
-                    if search_result and 'entries' in search_result and len(search_result['entries']) > 0:
-                        video = search_result['entries'][0]
-                        audio_url = video.get('url')
-                        title = video.get('title', 'Unknown')
-                        duration = video.get('duration', 0)
-                        
-                        if audio_url:
-                            print(f"[SEARCH] Found audio: {title}")
-                            return jsonify({
-                                "success": True,
-                                "audio_url": audio_url,
-                                "title": title,
-                                "duration": duration
-                            })
+                print(f"[SEARCH] Searching YouTube for: {query}")
+                video = youtube_metadata.search(query)
+                audio_url = video.get('stream_url')
+                title = video.get('title') or 'Unknown'
+                
+                if audio_url:
+                    print(f"[SEARCH] Found audio: {title}")
+                    return jsonify({
+                        "success": True,
+                        "audio_url": audio_url,
+                        "title": title,
+                        "duration": video.get('duration', 0)
+                    })
                 
                 return jsonify({"success": False, "error": "No results found"}), 404
                 
+            except LookupError:
+                return jsonify({"success": False, "error": "No results found"}), 404
             except Exception as e:
                 print(f"[ERROR] YouTube search failed: {e}")
                 return jsonify({"success": False, "error": str(e)}), 500
@@ -1685,6 +3112,81 @@ def update_saved_analysis(analysis_id):
 
 # ==================== SONG SEARCH ROUTES ====================
 
+def analyze_search_audio(search_query, file_hash, title, tier, cancel=None):
+    """
+    Download the first YouTube result for a search into the audio store as {file_hash}.*
+    and detect its chords while it downloads (for /api/search-and-analyze)
+    If cancel (a CancelToken) trips, the download is dropped too unless someone else is waiting on it
+    """
+    started = time.time()
+    audio_url = None
+    youtube_webpage_url = None
+    audio_available = False
+    chords = []
+    duration = None
+    download = None
+    
+    try:
+        # Search result and stream URL come from the metadata cache; the
+        # playback copy is fetched as parallel byte ranges
+        print(f"[AUDIO] Downloading audio for: {title}")
+        downloaded_file, actual_ext, video, download = start_youtube_audio_download(search_query, file_hash, search=True)
+        youtube_webpage_url = video.get('webpage_url')
+        
+        # Analysis starts on the first contiguous range instead of waiting
+        # for the whole file (or reads the copy we already have)
+        try:
+            print(f"[CHORDS] Analyzing: {video.get('title')}")
+            peaks = PeaksBuilder(tier['sample_rate'])
+            if download is None:
+                chord_result = predict_chords_with_timestamps(downloaded_file, on_pcm=peaks.add, tier=tier,
+                                                              cancel=cancel)
+            else:
+                chord_result = predict_chords_from_stream(download.iter_contiguous(), on_pcm=peaks.add, tier=tier,
+                                                          cancel=cancel)
+            peaks_store.set(file_hash, peaks.to_bytes())
+            chords = chord_result['progression']
+            duration = chord_result['duration']
+            quality_governor.observe(time.time() - started, duration, tier)
+        except AnalysisCancelled:
+            raise
+        except Exception as e:
+            print(f"[CHORDS ERROR] Analysis failed: {e}")
+        
+        try:
+            if download is not None:
+                download.join(cancel=cancel)
+                finish_youtube_audio_download(file_hash, actual_ext)
+            
+            # Serve from our server
+            audio_url = f"/api/temp-audio/{file_hash}{actual_ext}"
+            audio_available = True
+            print(f"[AUDIO] [OK] Successfully downloaded audio")
+            print(f"[AUDIO] Serving at: {audio_url}")
+        except AnalysisCancelled:
+            raise
+        except Exception as e:
+            print(f"[AUDIO ERROR] Could not download audio: {e}")
+                
+    except AnalysisCancelled:
+        if download is not None:
+            download_manager.abandon(download)  # removes the partial file if nobody else wants it
+        raise
+    except Exception as e:
+        print(f"[AUDIO ERROR] Could not find audio: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    return {
+        "audio_url": audio_url,
+        "youtube_webpage_url": youtube_webpage_url,
+        "audio_available": audio_available,
+        "chords": chords,
+        "duration": duration,
+        "quality": tier['name']
+    }
+
+
 @app.route("/api/search-and-analyze", methods=["POST"])
 def search_and_analyze():
     """Search for a song and get its lyrics and download audio temporarily"""
@@ -1697,6 +3199,9 @@ def search_and_analyze():
     
     if not title:
         return jsonify({"error": "Missing title"}), 400
+    quality = data.get('quality')
+    if quality_error(quality):
+        return quality_error(quality)
     
     # Get lyrics from Genius
     print(f"[LYRICS] Fetching lyrics for: {title} by {artist}")
@@ -1707,72 +3212,25 @@ def search_and_analyze():
     else:
         print(f"[LYRICS] Found {len(lyrics_data.get('text', '').split(chr(10)))} lines from {lyrics_data.get('source')}")
     
-    # Download audio temporarily to serve it properly
-    audio_url = None
-    youtube_webpage_url = None
-    audio_available = False
+    # Create a unique filename based on search query
+    file_hash = hashlib.md5(f"{artist}{title}".encode()).hexdigest()[:12]
     
+    # Everyone searching for this song right now shares one download + analysis
+    # (they would all write the same {file_hash} blob)
+    tier = choose_quality_tier(quality)
+    cancel = request_cancel_token()
     try:
-        import yt_dlp
-        import hashlib
-        
-        # Create a unique filename based on search query
-        file_hash = hashlib.md5(f"{artist}{title}".encode()).hexdigest()[:12]
-        temp_audio_path = os.path.join(tempfile.gettempdir(), f"chordis_{file_hash}.m4a")
-        
-        print(f"[AUDIO] Downloading audio for: {title}")
-        
-        ydl_opts = {
-            'format': 'bestaudio[ext=m4a]/bestaudio/best',
-            'quiet': False,
-            'no_warnings': False,
-            'default_search': 'ytsearch1:',
-            'outtmpl': temp_audio_path,
-            # Don't use FFmpeg post-processor - just download as-is
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_result = ydl.extract_info(f"ytsearch1:{search_query}", download=True)
-            if search_result and 'entries' in search_result and len(search_result['entries']) > 0:
-                video = search_result['entries'][0]
-                youtube_webpage_url = video.get('webpage_url')
-                
-                # yt-dlp might download with different extension - check for any downloaded file
-                downloaded_file = None
-                for ext in ['.m4a', '.webm', '.opus', '.mp4', '.mp3']:
-                    check_path = temp_audio_path.replace('.m4a', ext)
-                    if os.path.exists(check_path):
-                        downloaded_file = check_path
-                        actual_ext = ext
-                        print(f"[AUDIO] [OK] Found downloaded file: {check_path}")
-                        break
-                
-                if downloaded_file:
-                    # Serve from our server
-                    audio_url = f"/api/temp-audio/{file_hash}{actual_ext}"
-                    audio_available = True
-                    print(f"[AUDIO] [OK] Successfully downloaded audio")
-                    print(f"[AUDIO] Serving at: {audio_url}")
-                else:
-                    print(f"[AUDIO] [WARNING] No audio file found after download")
-                    print(f"[AUDIO] Checked path: {temp_audio_path}")
-                    
-    except Exception as e:
-        print(f"[AUDIO ERROR] Could not download audio: {e}")
-        import traceback
-        traceback.print_exc()
-    
-    # Generate chord progression (placeholder - could integrate with chord database)
-    chords = [
-        {'chord': 'C', 'start_time': 0, 'end_time': 15},
-        {'chord': 'G', 'start_time': 15, 'end_time': 30},
-        {'chord': 'Am', 'start_time': 30, 'end_time': 45},
-        {'chord': 'F', 'start_time': 45, 'end_time': 60},
-        {'chord': 'C', 'start_time': 60, 'end_time': 75},
-        {'chord': 'G', 'start_time': 75, 'end_time': 90},
-        {'chord': 'Am', 'start_time': 90, 'end_time': 105},
-        {'chord': 'F', 'start_time': 105, 'end_time': 120},
-    ]
+        audio, shared = analysis_flights.do(f"search:{file_hash}:{tier['name']}",
+                                            lambda: analyze_search_audio(search_query, file_hash, title, tier, cancel))
+    except AnalysisCancelled as e:
+        return cancelled_response(e)
+    if shared:
+        print(f"[SINGLE-FLIGHT] Joined in-flight download of: {title}")
+    audio_url = audio['audio_url']
+    youtube_webpage_url = audio['youtube_webpage_url']
+    audio_available = audio['audio_available']
+    chords = audio['chords']
+    duration = audio['duration']
     
     # Prepare response
     lyrics_list = []
@@ -1797,60 +3255,175 @@ def search_and_analyze():
         "has_lyrics": len(lyrics_list) > 0,
         "key": "C Major",
         "tempo": 120,
-        "duration": len(lyrics_list) * 10 if lyrics_list else 180,
+        "duration": duration or (len(lyrics_list) * 10 if lyrics_list else 180),
         "audio_url": audio_url,  # Downloaded audio served from our server
+        "peaks_url": f"/api/peaks/{file_hash}" if audio_available else None,
         "youtube_url": audio_url,  # Kept for backward compatibility
         "youtube_webpage_url": youtube_webpage_url,  # Permanent YouTube video page URL
         "audio_available": audio_available,
         "audio_expiry_note": "Audio downloaded and cached on server" if audio_available else None,
-        "artwork": artwork if 'artwork' in locals() else None
+        "artwork": artwork if 'artwork' in locals() else None,
+        "quality": audio['quality']
     })
 
 
+AUDIO_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# For names that don't pin their bytes: search downloads are keyed by artist/title
+# and Opus renditions depend on PLAYBACK_OPUS_BITRATE
+AUDIO_REVALIDATE_CONTROL = 'public, no-cache'
+
+
+def content_addressed(name):
+    """Whether a blob name (or peaks key) is the SHA-256 of the content, so its bytes never change"""
+    return re.fullmatch(r'[0-9a-f]{64}(\.[a-z0-9]{1,5})?', name or '') is not None
+
+
+def send_audio_blob(path, name, mimetype):
+    """
+    Send a stored audio blob with Range/206, strong ETag and If-None-Match/If-Range support
+    
+    The ETag follows the file's size and mtime; only content-addressed names
+    are cached as immutable, everything else is revalidated.
+    The body is handed to the server's wsgi.file_wrapper (sendfile under gunicorn,
+    which bounds the transfer by Content-Length) rather than read through Python.
+    """
+    from werkzeug.http import http_date
+    
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = f"{name}-{size:x}-{stat.st_mtime_ns:x}"
+    headers = {
+        'ETag': f'"{etag}"',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': AUDIO_CACHE_CONTROL if content_addressed(name) else AUDIO_REVALIDATE_CONTROL,
+        'Last-Modified': http_date(last_modified),
+    }
+    
+    if request.if_none_match and request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    
+    byte_range = request.range
+    if byte_range and len(byte_range.ranges) != 1:
+        byte_range = None  # multipart/byteranges isn't worth it for audio; send the whole file
+    if byte_range and request.if_range:
+        # Only honour the range if the client's copy is still current
+        if_range = request.if_range
+        if if_range.etag:
+            current = if_range.etag == etag
+        else:
+            current = if_range.date is not None and int(if_range.date.timestamp()) >= last_modified
+        if not current:
+            byte_range = None
+    
+    start, stop = 0, size
+    status = 200
+    if byte_range:
+        span = byte_range.range_for_length(size)
+        if span is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        start, stop = span
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    
+    length = stop - start
+    headers['Content-Length'] = str(length)
+    
+    f = open(path, 'rb')
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper and (stop == size or request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn')):
+        body = file_wrapper(f, 256 * 1024)
+    else:
+        def body_chunks():
+            remaining = length
+            try:
+                while remaining > 0:
+                    data = f.read(min(256 * 1024, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+            finally:
+                f.close()
+        body = body_chunks()
+    
+    response = Response(body, status=status, mimetype=mimetype, headers=headers, direct_passthrough=True)
+    response.call_on_close(f.close)
+    return response
+
+
 @app.route("/api/temp-audio/<filename>")
 def serve_temp_audio(filename):
-    """Serve temporarily downloaded audio files"""
+    """Serve playback audio from the audio store"""
     try:
-        print(f"[SERVE] Request for audio file: {filename}")
-        print(f"[SERVE] Temp directory: {tempfile.gettempdir()}")
-        
-        # Check if the file exists in temp directory
-        temp_audio_path = os.path.join(tempfile.gettempdir(), f"chordis_{filename}")
-        print(f"[SERVE] Looking for: {temp_audio_path}")
-        print(f"[SERVE] File exists: {os.path.exists(temp_audio_path)}")
+        stored_path = audio_store.get(filename)
+        if not stored_path:
+            print(f"[SERVE ERROR] Not in audio store: {filename}")
+            return jsonify({"error": "Audio file not found"}), 404
         
-        # List files in temp directory with chordis_ prefix for debugging
-        import glob
-        chordis_files = glob.glob(os.path.join(tempfile.gettempdir(), "chordis_*"))
-        print(f"[SERVE] Available chordis files: {[os.path.basename(f) for f in chordis_files[:5]]}")
+        # Determine mimetype based on extension
+        ext = os.path.splitext(filename)[1].lower()
+        mimetypes_map = {
+            '.m4a': 'audio/mp4',
+            '.mp4': 'audio/mp4',
+            '.webm': 'audio/webm',
+            '.opus': 'audio/opus',
+            '.mp3': 'audio/mpeg',
+            '.wav': 'audio/wav',
+            '.flac': 'audio/flac',
+            '.ogg': 'audio/ogg'
+        }
+        mimetype = mimetypes_map.get(ext, 'audio/mpeg')
         
-        if os.path.exists(temp_audio_path):
-            # Determine mimetype based on extension
-            ext = os.path.splitext(filename)[1].lower()
-            mimetypes_map = {
-                '.m4a': 'audio/mp4',
-                '.mp4': 'audio/mp4',
-                '.webm': 'audio/webm',
-                '.opus': 'audio/opus',
-                '.mp3': 'audio/mpeg'
-            }
-            mimetype = mimetypes_map.get(ext, 'audio/mpeg')
-            
-            print(f"[SERVE] [OK] Serving audio file: {temp_audio_path} as {mimetype}")
-            return send_from_directory(
-                tempfile.gettempdir(),
-                f"chordis_{filename}",
-                mimetype=mimetype
-            )
-        else:
-            print(f"[SERVE ERROR] File not found: {temp_audio_path}")
-            return jsonify({"error": "Audio file not found"}), 404
+        print(f"[SERVE] [OK] Serving audio file: {filename} as {mimetype} (range: {request.headers.get('Range')})")
+        return send_audio_blob(stored_path, filename, mimetype)
             
     except Exception as e:
         print(f"[SERVE ERROR] {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/peaks/<key>")
+def serve_peaks(key):
+    """
+    Waveform min/max peaks pyramid for a stored audio blob (binary, see peaks.PeaksBuilder)
+    Computed during analysis; blobs analyzed before that are decoded once on first request
+    """
+    data = peaks_store.get(key)
+    if data is None:
+        stored_path, _ = audio_store.find(key)
+        if not stored_path:
+            return jsonify({"success": False, "error": "Audio not found"}), 404
+        try:
+            y, sr = load_audio(stored_path, sr=CHORD_SAMPLE_RATE, mono=True)
+            data = compute_peaks(y, sr)
+            peaks_store.set(key, data)
+        except Exception as e:
+            print(f"[PEAKS ERROR] {e}")
+            return jsonify({"success": False, "error": "Could not compute peaks"}), 500
+    
+    # Peaks are rebuilt at each analysis's sample rate, so even a content key's peaks can change
+    etag = f"{key}.peaks-{hashlib.sha1(data).hexdigest()[:16]}"
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': AUDIO_REVALIDATE_CONTROL}
+    if request.if_none_match and request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(data, mimetype='application/octet-stream', headers=headers)
+
+
+@app.route("/api/downloads/<filename>")
+def download_progress(filename):
+    """Progress of a server-side audio download in this worker (filename as in /api/temp-audio)"""
+    try:
+        download = download_manager.get(audio_store.path_for(filename))
+    except ValueError:
+        download = None
+    if not download:
+        return jsonify({"success": False, "error": "No active download"}), 404
+    return jsonify({"success": True, "filename": filename, **download.progress()})
+
+
 @app.route("/api/refresh-audio-url", methods=["POST"])
 def refresh_audio_url():
     """Refresh by re-downloading the audio"""
@@ -1866,20 +3439,11 @@ def refresh_audio_url():
         # Generate hash for filename
         import hashlib
         file_hash = hashlib.md5(youtube_webpage_url.encode()).hexdigest()[:12]
-        temp_audio_path = os.path.join(tempfile.gettempdir(), f"chordis_{file_hash}.m4a")
-        
-        ydl_opts = {
-            'format': 'bestaudio[ext=m4a]/bestaudio/best',
-            'quiet': False,
-            'no_warnings': False,
-            'outtmpl': temp_audio_path,
-        }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([youtube_webpage_url])
+        temp_audio_path, ext, _ = fetch_youtube_audio_file(youtube_webpage_url, file_hash)
             
         if os.path.exists(temp_audio_path):
-            audio_url = f"/api/temp-audio/{file_hash}.m4a"
+            audio_url = f"/api/temp-audio/{file_hash}{ext}"
             print(f"[REFRESH] [OK] Successfully refreshed audio")
             return jsonify({
                 "success": True,
@@ -1902,50 +3466,70 @@ def refresh_audio_url():
         }), 500
 
 
+def proxy_stream_response(audio_url, upstream_headers=None, on_upstream_error=None):
+    """
+    Range response for a remote stream through the caching proxy
+    on_upstream_error, if given, returns a replacement (url, headers) to retry once with
+    """
+    byte_range = request.range.ranges[0] if request.range and len(request.range.ranges) == 1 else None
+    try:
+        start, end, total, content_type, body = stream_proxy.open(audio_url, byte_range, headers=upstream_headers)
+    except requests.exceptions.HTTPError:
+        if not on_upstream_error:
+            raise
+        print(f"[PROXY] Upstream rejected the stream URL, refreshing")
+        audio_url, upstream_headers = on_upstream_error()
+        start, end, total, content_type, body = stream_proxy.open(audio_url, byte_range, headers=upstream_headers)
+    
+    resp = Response(stream_with_context(body), status=206 if byte_range else 200,
+                    direct_passthrough=True)
+    resp.headers['Content-Type'] = content_type
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['Cache-Control'] = 'public, max-age=3600'
+    resp.headers['Content-Length'] = str(end - start)
+    if byte_range:
+        resp.headers['Content-Range'] = f"bytes {start}-{end - 1}/{total}"
+    return resp
+
+
 @app.route("/api/proxy-audio")
 def proxy_audio():
-    """Proxy YouTube audio through our server to bypass CORS restrictions"""
+    """Proxy YouTube audio through our server to bypass CORS restrictions (cached by byte range)"""
     audio_url = request.args.get('url')
     
     if not audio_url:
         return jsonify({"error": "No URL provided"}), 400
     
     try:
-        print(f"[PROXY] Proxying audio from: {audio_url[:80]}...")
-        
-        # Make request with proper headers
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Accept': '*/*',
-            'Accept-Encoding': 'identity',
-            'Range': request.headers.get('Range', 'bytes=0-')
-        }
-        
-        response = requests.get(audio_url, headers=headers, stream=True, timeout=10)
-        
-        if response.status_code not in [200, 206]:
-            print(f"[PROXY ERROR] Status {response.status_code}")
-            return jsonify({"error": f"Upstream returned {response.status_code}"}), 502
+        print(f"[PROXY] Proxying audio from: {audio_url[:80]}... (range: {request.headers.get('Range')})")
+        return proxy_stream_response(audio_url)
         
-        def generate():
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    yield chunk
-        
-        print(f"[PROXY] Streaming audio successfully")
+    except ValueError:
+        return jsonify({"error": "Range not satisfiable"}), 416
+    except requests.exceptions.Timeout:
+        print(f"[PROXY ERROR] Timeout")
+        return jsonify({"error": "Upstream timeout"}), 504
+    except Exception as e:
+        print(f"[PROXY ERROR] {type(e).__name__}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/stream/<stream_id>")
+def proxy_stream(stream_id):
+    """Proxy a YouTube stream by its opaque id; the upstream URL is refreshed as it nears expiry"""
+    try:
+        record = stream_urls.resolve(stream_id)
+        if not record:
+            return jsonify({"error": "Unknown stream"}), 404
         
-        resp = Response(stream_with_context(generate()), status=response.status_code)
-        resp.headers['Content-Type'] = response.headers.get('Content-Type', 'audio/mp4')
-        resp.headers['Accept-Ranges'] = 'bytes'
-        resp.headers['Cache-Control'] = 'public, max-age=3600'
+        def refreshed():
+            fresh = stream_urls.resolve(stream_id, force_refresh=True)
+            return fresh['stream_url'], fresh['http_headers']
         
-        if 'Content-Length' in response.headers:
-            resp.headers['Content-Length'] = response.headers['Content-Length']
-        if 'Content-Range' in response.headers:
-            resp.headers['Content-Range'] = response.headers['Content-Range']
-            
-        return resp
+        return proxy_stream_response(record['stream_url'], record['http_headers'], on_upstream_error=refreshed)
         
+    except ValueError:
+        return jsonify({"error": "Range not satisfiable"}), 416
     except requests.exceptions.Timeout:
         print(f"[PROXY ERROR] Timeout")
         return jsonify({"error": "Upstream timeout"}), 504
@@ -2024,27 +3608,11 @@ def search_songs():
                 print(f"[SEARCH] Searching Genius for: {query}")
                 
                 # Use Genius API directly
-                headers = {'Authorization': f'Bearer {GENIUS_ACCESS_TOKEN}'}
-                search_url = 'https://api.genius.com/search'
-                params = {'q': query}
-                
-                response = requests.get(search_url, headers=headers, params=params, timeout=10)
+                response = requests.get(genius_api.GENIUS_SEARCH_URL, headers=genius_api.auth_headers(GENIUS_ACCESS_TOKEN),
+                                        params={'q': query}, timeout=10)
                 
                 if response.status_code == 200:
-                    response_data = response.json()
-                    hits = response_data.get('response', {}).get('hits', [])
-                    
-                    for hit in hits[:10]:  # Limit to 10 results
-                        result_data = hit.get('result', {})
-                        results.append({
-                            'title': result_data.get('title', 'Unknown'),
-                            'artist': result_data.get('primary_artist', {}).get('name', 'Unknown Artist'),
-                            'album': result_data.get('album', {}).get('name', '') if result_data.get('album') else '',
-                            'artwork': result_data.get('song_art_image_thumbnail_url', ''),
-                            'thumbnail': result_data.get('header_image_thumbnail_url', ''),
-                            'url': result_data.get('url', ''),
-                            'id': result_data.get('id', '')
-                        })
+                    results = genius_api.search_results_from_response(response.json())
                     
                     print(f"[SEARCH] Found {len(results)} results")
                 else:
@@ -2060,19 +3628,7 @@ def search_songs():
         # Fallback: Create mock results if Genius not available or no results found
         if not results:
             print(f"[FALLBACK] Creating mock result for: {query}")
-            # Parse query to extract possible artist and song
-            query_parts = query.split()
-            results = [
-                {
-                    'title': ' '.join(query_parts[:3]) if len(query_parts) >= 3 else query,
-                    'artist': ' '.join(query_parts[3:]) if len(query_parts) > 3 else 'Various Artists',
-                    'album': '',
-                    'artwork': '',
-                    'thumbnail': '',
-                    'url': '',
-                    'id': '1'
-                }
-            ]
+            results = genius_api.mock_search_results(query)
         
         # Log search activity
         user_id = current_user.id if current_user.is_authenticated else None
@@ -2095,6 +3651,23 @@ def search_songs():
         }), 500
 
 
+def gateway_token():
+    """Shared secret the async gateway (gateway.py) sends on internal calls"""
+    return hmac.new(app.config['SECRET_KEY'].encode(), b'chordis-gateway', hashlib.sha256).hexdigest()
+
+
+@app.route("/api/internal/search-log", methods=["POST"])
+def internal_search_log():
+    """Record a search served by the async gateway (it forwards the user's session cookie)"""
+    if not hmac.compare_digest(request.headers.get('X-Gateway-Token', ''), gateway_token()):
+        return jsonify({"success": False, "error": "Forbidden"}), 403
+    
+    data = request.get_json() or {}
+    user_id = current_user.id if current_user.is_authenticated else None
+    log_search(data.get('query', ''), data.get('search_type', 'song'), data.get('results_count', 0), user_id)
+    return jsonify({"success": True})
+
+
 @app.route("/api/get-lyrics", methods=["POST"])
 def get_lyrics():
     """Get lyrics for a specific song"""
@@ -2121,12 +3694,8 @@ def get_lyrics():
             song = genius.search_song(title)
         
         if song and song.lyrics:
-            # Clean up lyrics
-            lyrics_text = song.lyrics
-            # Remove common patterns that might appear in Genius lyrics
-            lyrics_text = re.sub(r'\[.*?\]', '', lyrics_text)  # Remove [Verse], [Chorus], etc.
-            lyrics_text = re.sub(r'\n\s*\n', '\n\n', lyrics_text)  # Clean up extra newlines
-            lyrics_text = lyrics_text.strip()
+            # Remove [Verse], [Chorus], etc. and extra newlines
+            lyrics_text = genius_api.clean_lyrics(song.lyrics)
             
             return jsonify({
                 "success": True,
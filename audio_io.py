@@ -0,0 +1,295 @@
+"""
+Audio input helpers
+Decode uploads straight from memory so the analysis pipeline rarely needs
+intermediate temp files (only MP4/M4A, which ffmpeg can't read from a pipe)
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import soundfile as sf
+from werkzeug.exceptions import RequestEntityTooLarge
+
+FFMPEG_BINARY = shutil.which('ffmpeg')
+
+
+class HashingUploadBuffer(io.BytesIO):
+    """
+    In-memory upload buffer that hashes bytes as they arrive
+
+    werkzeug writes multipart file parts into this buffer chunk by chunk while
+    it reads the request body, so the content hash is ready the moment the
+    form is parsed and oversized files are rejected before they are buffered.
+    """
+
+    def __init__(self, max_bytes=None):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Upload exceeds {self.max_bytes // (1024 * 1024)} MB limit")
+        self._sha256.update(data)
+        return super().write(data)
+
+    def hexdigest(self):
+        """SHA-256 of everything written so far"""
+        return self._sha256.hexdigest()
+
+
+def upload_hash(file_storage):
+    """Return the SHA-256 of an uploaded file, reusing the streaming hash when available"""
+    stream = file_storage.stream
+    if isinstance(stream, HashingUploadBuffer):
+        return stream.hexdigest()
+    return hashlib.sha256(read_upload(file_storage)).hexdigest()
+
+
+def read_upload(file_storage):
+    """Read an uploaded werkzeug FileStorage into memory and return its bytes"""
+    stream = file_storage.stream
+    try:
+        stream.seek(0)
+    except Exception:
+        pass
+    return stream.read()
+
+
+def needs_seekable_input(data):
+    """
+    Whether encoded audio must be given to ffmpeg as a file rather than a pipe
+    MP4/M4A (ISO-BMFF) files often keep their index (moov) at the end, which
+    ffmpeg cannot reach on a non-seekable pipe.
+    """
+    return data[4:8] == b'ftyp'
+
+
+@contextmanager
+def spooled_to_file(data, suffix='.m4a'):
+    """Write bytes to a temporary file for the duration of the block and yield its path"""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def pcm_source(audio):
+    """
+    Input for stream_pcm_blocks from an upload held as bytes or staged on disk
+
+    Files are read by ffmpeg directly and most in-memory formats are piped;
+    MP4/M4A bytes are spooled to a temporary file first (see needs_seekable_input).
+    """
+    if not isinstance(audio, (bytes, bytearray)):
+        yield audio
+    elif needs_seekable_input(audio):
+        with spooled_to_file(audio) as path:
+            yield path
+    else:
+        yield [audio]
+
+
+def decode_with_ffmpeg(data, sr, mono=True, duration=None):
+    """
+    Decode encoded audio bytes through an ffmpeg pipe
+
+    Args:
+        data: Encoded audio (any container/codec ffmpeg understands)
+        sr: Target sample rate
+        mono: Downmix to a single channel
+        duration: Optional maximum number of seconds to decode
+
+    Returns:
+        float32 numpy array of samples
+    """
+    if needs_seekable_input(data):
+        with spooled_to_file(data) as path:
+            return _run_ffmpeg_decode(path, None, sr, mono, duration)
+    return _run_ffmpeg_decode('pipe:0', data, sr, mono, duration)
+
+
+def _run_ffmpeg_decode(source, data, sr, mono, duration):
+    cmd = [FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error', '-i', source]
+    if duration:
+        cmd += ['-t', str(duration)]
+    cmd += ['-f', 'f32le', '-acodec', 'pcm_f32le', '-ar', str(sr)]
+    if mono:
+        cmd += ['-ac', '1']
+    cmd += ['pipe:1']
+
+    proc = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg decode failed: {proc.stderr.decode(errors='ignore').strip()}")
+    return np.frombuffer(proc.stdout, dtype=np.float32)
+
+
+def decode_with_soundfile(data, sr, mono=True, duration=None):
+    """Decode audio bytes with libsndfile (WAV, FLAC, OGG and MP3 on newer builds)"""
+    import librosa
+
+    with sf.SoundFile(io.BytesIO(data)) as f:
+        frames = int(duration * f.samplerate) if duration else -1
+        y = f.read(frames=frames, dtype='float32', always_2d=True)
+        native_sr = f.samplerate
+
+    y = y.mean(axis=1) if mono else y.T
+    if native_sr != sr:
+        y = librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+
+def decode_audio_bytes(data, sr, mono=True, duration=None):
+    """
+    Decode an in-memory audio file to PCM samples at the requested rate
+
+    ffmpeg is preferred because it handles every container we accept
+    (m4a, webm, mp3, ...) and resamples in the same pass. libsndfile is
+    used as a fallback when ffmpeg is not installed.
+    """
+    if FFMPEG_BINARY:
+        try:
+            return decode_with_ffmpeg(data, sr, mono=mono, duration=duration)
+        except Exception as e:
+            print(f"[DECODE] ffmpeg failed, trying soundfile: {e}")
+    return decode_with_soundfile(data, sr, mono=mono, duration=duration)
+
+
+def load_audio(source, sr, mono=True, duration=None):
+    """
+    Load audio from a file path or from raw bytes
+
+    Args:
+        source: Path to an audio file, or the encoded file contents as bytes
+        sr: Target sample rate
+        mono: Downmix to mono
+        duration: Optional maximum number of seconds to load
+
+    Returns:
+        Tuple of (samples, sample_rate)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_audio_bytes(bytes(source), sr, mono=mono, duration=duration), sr
+
+    import librosa
+    return librosa.load(source, sr=sr, mono=mono, duration=duration)
+
+
+def _feed_stdin(proc, chunks):
+    """Write encoded chunks into ffmpeg's stdin (runs on a helper thread)"""
+    try:
+        for chunk in chunks:
+            proc.stdin.write(chunk)
+    except (BrokenPipeError, OSError, ValueError):
+        pass  # ffmpeg exited or the consumer stopped early
+    except Exception as e:
+        print(f"[DECODE] Input stream failed: {e}")
+    finally:
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+
+
+def stream_pcm_blocks(source, sr, block_size, headers=None, mono=True):
+    """
+    Decode an audio stream through an ffmpeg pipe, block by block
+
+    Nothing is written to disk: ffmpeg either reads the URL or file itself or
+    is fed encoded chunks on stdin, and we consume raw float32 PCM from its
+    stdout as it is produced.
+
+    Args:
+        source: Direct media URL (e.g. a googlevideo stream URL), a local file
+            path, or an iterable of encoded byte chunks (e.g. a download in progress)
+        sr: Target sample rate
+        block_size: Samples per yielded block (the last block may be shorter)
+        headers: Optional dict of HTTP headers for the upstream request
+
+    Yields:
+        float32 numpy arrays of samples
+    """
+    if not FFMPEG_BINARY:
+        raise RuntimeError("ffmpeg is required for streaming decode")
+
+    from_url = isinstance(source, str)
+    cmd = [FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error']
+    if from_url and os.path.isfile(source):
+        cmd += ['-nostdin']
+    elif from_url:
+        cmd += ['-nostdin', '-reconnect', '1', '-reconnect_streamed', '1', '-reconnect_delay_max', '5']
+        if headers:
+            cmd += ['-headers', ''.join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    cmd += ['-i', source if from_url else 'pipe:0', '-vn', '-f', 'f32le', '-acodec', 'pcm_f32le', '-ar', str(sr)]
+    if mono:
+        cmd += ['-ac', '1']
+    cmd += ['pipe:1']
+
+    # stderr goes to a temp file: an unread pipe would stall ffmpeg once it fills
+    # (e.g. reconnect warnings on a long stream) while we block on stdout
+    errors = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL if from_url else subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=errors)
+    if not from_url:
+        threading.Thread(target=_feed_stdin, args=(proc, source), name='ffmpeg-feed', daemon=True).start()
+    block_bytes = block_size * 4
+    try:
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            # Drop a trailing partial sample, if any
+            data = data[:len(data) - len(data) % 4]
+            yield np.frombuffer(data, dtype=np.float32)
+
+        proc.wait()
+        if proc.returncode != 0:
+            errors.seek(0)
+            raise RuntimeError(f"ffmpeg stream decode failed: {errors.read().decode(errors='ignore').strip()}")
+    finally:
+        # Consumer stopped early (or errored) - don't leave ffmpeg downloading
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        errors.close()
+
+
+def encode_wav_bytes(y, sr, subtype='PCM_16'):
+    """Encode PCM samples into an in-memory WAV file"""
+    buf = io.BytesIO()
+    sf.write(buf, y, sr, format='WAV', subtype=subtype)
+    return buf.getvalue()
+
+
+def transcode_to_opus(src_path, dest_path, bitrate='96k'):
+    """
+    Transcode an audio file into a compact Ogg/Opus file for playback
+
+    Args:
+        src_path: Input file (any format ffmpeg understands)
+        dest_path: Output path; written by ffmpeg in the Ogg container
+        bitrate: Target Opus bitrate
+    """
+    cmd = [FFMPEG_BINARY, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+           '-i', src_path, '-vn', '-c:a', 'libopus', '-b:a', bitrate, '-f', 'ogg', dest_path]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg transcode failed: {proc.stderr.decode(errors='ignore').strip()}")
+    return dest_path
@@ -0,0 +1,267 @@
+"""
+Content-addressed store for playback audio
+Blobs are named {key}{ext} in one directory shared by every process; the
+byte budget is enforced from a scan of that directory, evicting the least
+recently used blobs (by atime, bumped on access) first
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: eviction scans aren't serialized across processes
+    fcntl = None
+
+from audio_io import transcode_to_opus
+
+# {key}{ext} for originals, {key}.play.opus for playback renditions
+BLOB_NAME_PATTERN = re.compile(r'^([0-9a-f]{8,64})((?:\.play)?\.[a-z0-9]{1,5})$')
+RENDITION_EXT = '.play.opus'
+
+# Originals worth transcoding for playback (uncompressed or lossless)
+TRANSCODE_EXTENSIONS = ('.wav', '.flac', '.aiff', '.aif')
+
+# Extensions probed when looking up the original stored for a key
+AUDIO_EXTENSIONS = ('.m4a', '.webm', '.mp3', '.wav', '.flac', '.ogg', '.opus', '.mp4', '.aac')
+
+
+class AudioBlobStore:
+    """
+    Size-bounded blob store for audio served at /api/temp-audio
+
+    The directory itself is the index, so every gunicorn worker and worker.py
+    process shares one budget and one LRU order: reads bump a blob's atime
+    (at most once per touch_interval) and each new blob triggers an eviction
+    scan, serialized across processes with a lock file. mtime is left alone
+    so it keeps meaning "when these bytes were written" (ETag, Last-Modified).
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, stale_part_age=24 * 3600, touch_interval=60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stale_part_age = stale_part_age
+        self.touch_interval = touch_interval
+        self._by_key = {}  # key -> name of the original, a lookup hint only
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._evict()
+
+    def _scan(self):
+        """Blobs on disk as (last use, name, size), removing stale leftovers of interrupted writes"""
+        cutoff = time.time() - self.stale_part_age
+        blobs = []
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            if BLOB_NAME_PATTERN.match(entry.name):
+                blobs.append((max(stat.st_atime, stat.st_mtime), entry.name, stat.st_size))
+            elif entry.name != '.evict.lock' and stat.st_mtime < cutoff:
+                # Leftover .part/.tmp from an interrupted write
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        return blobs
+
+    @staticmethod
+    def _split(name):
+        match = BLOB_NAME_PATTERN.match(name or '')
+        if not match:
+            raise ValueError(f"Invalid blob name: {name!r}")
+        return match.group(1), match.group(2)
+
+    def _evict(self):
+        """Remove least recently used blobs until the directory fits its budget"""
+        with self._lock, open(os.path.join(self.directory, '.evict.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                blobs = sorted(self._scan())
+                used = sum(size for _, _, size in blobs)
+                # Never evict the newest blob, even if it alone exceeds the budget
+                for _, name, size in blobs[:-1]:
+                    if used <= self.max_bytes:
+                        break
+                    try:
+                        os.remove(self.path_for(name))
+                        print(f"[STORE] Evicted {name}")
+                    except OSError:
+                        pass
+                    used -= size
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def path_for(self, name):
+        """Filesystem path a blob lives (or will live) at"""
+        self._split(name)
+        return os.path.join(self.directory, name)
+
+    def name_for(self, key, ext):
+        """Blob name for a content key and file extension"""
+        name = f"{key}{ext.lower()}"
+        self._split(name)
+        return name
+
+    def get(self, name):
+        """Return the path of a stored blob and mark it recently used, or None"""
+        try:
+            path = self.path_for(name)
+            stat = os.stat(path)
+        except (ValueError, OSError):
+            return None
+
+        if time.time() - max(stat.st_atime, stat.st_mtime) > self.touch_interval:
+            if not self._touch(path, stat):
+                return None  # evicted just now
+        return path
+
+    @staticmethod
+    def _touch(path, stat=None):
+        """Mark a blob as used now via its atime, keeping its mtime"""
+        try:
+            stat = stat or os.stat(path)
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+            return True
+        except OSError:
+            return False
+
+    def find(self, key):
+        """Return (path, ext) of the blob stored for a content key, or (None, None)"""
+        with self._lock:
+            name = self._by_key.get(key)
+        candidates = [name] if name else []
+        candidates += [f"{key}{ext}" for ext in AUDIO_EXTENSIONS if f"{key}{ext}" != name]
+
+        for candidate in candidates:
+            try:
+                path = self.get(candidate)
+            except ValueError:
+                return None, None
+            if path:
+                with self._lock:
+                    self._by_key[key] = candidate
+                return path, self._split(candidate)[1]
+        return None, None
+
+    def put_bytes(self, name, data):
+        """Store bytes under a name (atomic; a no-op if the blob exists) and return its path"""
+        path = self.get(name)
+        if path:
+            return path
+
+        path = self.path_for(name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return self.commit(name)
+
+    def put_file(self, name, src_path):
+        """Move a finished file into the store (dropping it if the blob exists) and return its path"""
+        path = self.get(name)
+        if path:
+            os.remove(src_path)
+            return path
+
+        path = self.path_for(name)
+        tmp_path = path + '.tmp'
+        shutil.move(src_path, tmp_path)  # may copy across filesystems
+        os.replace(tmp_path, path)
+        return self.commit(name)
+
+    def commit(self, name):
+        """Account for a blob written directly at path_for(name) (e.g. by a download) and return its path"""
+        path = self.path_for(name)
+        self._touch(path)
+        key, ext = self._split(name)
+        if ext != RENDITION_EXT:
+            with self._lock:
+                self._by_key[key] = name
+        self._evict()
+        return path
+
+    def stats(self):
+        """Store usage for health/debug output"""
+        blobs = self._scan()
+        return {'blobs': len(blobs), 'bytes': sum(size for _, _, size in blobs), 'max_bytes': self.max_bytes}
+
+
+class PlaybackRenditions:
+    """
+    Background transcoder producing compact Opus renditions of stored blobs
+
+    A rendition is stored next to its original as {key}.play.opus. Each key
+    is transcoded at most once per process at a time; other workers that
+    race on the same blob just overwrite it atomically with identical bytes.
+    """
+
+    def __init__(self, store, bitrate='96k', max_workers=1):
+        self.store = store
+        self.bitrate = bitrate
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transcode')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def wanted(ext):
+        """Whether originals with this extension get a playback rendition"""
+        return (ext or '').lower() in TRANSCODE_EXTENSIONS
+
+    def name_for(self, key):
+        return f"{key}{RENDITION_EXT}"
+
+    def get(self, key):
+        """Return the rendition's blob name if it is ready, else None"""
+        name = self.name_for(key)
+        return name if self.store.get(name) else None
+
+    def submit(self, key, ext):
+        """Queue a rendition for the original {key}{ext} unless it exists or is queued"""
+        if not self.wanted(ext) or self.get(key):
+            return False
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._transcode, key, ext)
+        return True
+
+    def _transcode(self, key, ext):
+        name = self.name_for(key)
+        tmp_path = os.path.join(self.store.directory, f"{key}.{os.getpid()}.transcode")
+        try:
+            src_path = self.store.get(self.store.name_for(key, ext))
+            if not src_path:
+                return
+            start = time.time()
+            transcode_to_opus(src_path, tmp_path, self.bitrate)
+            self.store.put_file(name, tmp_path)
+            print(f"[TRANSCODE] [OK] {key[:12]}{ext} -> {name} "
+                  f"({os.path.getsize(self.store.path_for(name))} bytes, {time.time() - start:.1f}s)")
+        except Exception as e:
+            print(f"[TRANSCODE ERROR] {key[:12]}{ext}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        finally:
+            with self._lock:
+                self._pending.discard(key)
@@ -0,0 +1,93 @@
+"""
+Benchmark the analysis quality tiers
+Runs chord detection (and optionally Whisper) at every tier on the given
+audio files and reports the measured cost per minute of audio, plus how
+often each tier's chords agree with the accurate tier's
+
+Usage: python benchmark_quality.py song1.mp3 [song2.wav ...] [--runs 3] [--no-whisper]
+"""
+
+import argparse
+import os
+import time
+
+# Benchmark only: don't start background job workers when the app module loads
+os.environ['ANALYSIS_WORKERS'] = '0'
+
+
+def chord_at(progression, t):
+    """Chord label sounding at time t, or None"""
+    for chord in progression:
+        if chord['start_time'] <= t < chord['end_time']:
+            return chord['chord']
+    return None
+
+
+def agreement(reference, progression, duration, step=0.5):
+    """Fraction of sampled instants where two progressions name the same chord"""
+    samples = [i * step for i in range(int(duration / step))]
+    if not samples:
+        return None
+    same = sum(1 for t in samples if chord_at(reference, t) == chord_at(progression, t))
+    return same / len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure analysis cost per minute of audio for each quality tier")
+    parser.add_argument('files', nargs='+', help="Audio files to analyze")
+    parser.add_argument('--runs', type=int, default=1, help="Repetitions per file (timings are summed)")
+    parser.add_argument('--no-whisper', action='store_true', help="Only time chord detection")
+    args = parser.parse_args()
+
+    from api import predict_chords_with_timestamps, extract_lyrics_with_timestamps, get_whisper_model
+    from quality import QUALITY_LADDER, quality_tier
+
+    audio = []
+    for path in args.files:
+        with open(path, 'rb') as f:
+            audio.append((os.path.basename(path), f.read()))
+
+    reference = {}
+    rows = []
+    for name in QUALITY_LADDER:
+        tier = quality_tier(name)
+        if not args.no_whisper:
+            get_whisper_model(tier['whisper_model'])  # load outside the timed section
+
+        chord_seconds = whisper_seconds = audio_seconds = 0.0
+        scores = []
+        for filename, data in audio:
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                result = predict_chords_with_timestamps(data, tier=tier)
+                chord_seconds += time.perf_counter() - started
+                audio_seconds += result['duration']
+
+                if not args.no_whisper:
+                    started = time.perf_counter()
+                    extract_lyrics_with_timestamps(data, None, tier=tier)
+                    whisper_seconds += time.perf_counter() - started
+
+            # Tiers are run best first, so the accurate tier is the reference
+            reference.setdefault(filename, result['progression'])
+            score = agreement(reference[filename], result['progression'], result['duration'])
+            if score is not None:
+                scores.append(score)
+
+        minutes = max(audio_seconds / 60.0, 1e-9)
+        rows.append((name, chord_seconds / minutes, whisper_seconds / minutes,
+                     (chord_seconds + whisper_seconds) / minutes,
+                     sum(scores) / len(scores) if scores else None))
+        print(f"[BENCHMARK] {name}: done")
+
+    print()
+    print(f"Audio: {len(audio)} file(s), {audio_seconds / 60.0:.1f} min per tier, {args.runs} run(s) each")
+    print(f"{'tier':<10}{'chords s/min':>14}{'whisper s/min':>15}{'total s/min':>13}{'agreement':>11}")
+    for name, chords, whisper_cost, total, score in rows:
+        whisper_text = '-' if args.no_whisper else f"{whisper_cost:.2f}"
+        score_text = '-' if score is None else f"{score:.0%}"
+        print(f"{name:<10}{chords:>14.2f}{whisper_text:>15}{total:>13.2f}{score_text:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Cooperative cancellation for analysis requests
+A CancelToken trips when its deadline passes or when the client has gone
+away; the pipeline checks it between chunks of work and stops early
+instead of finishing an analysis nobody will receive
+"""
+
+import select
+import socket
+import threading
+import time
+
+
+class AnalysisCancelled(Exception):
+    """Raised by CancelToken.check() once the work is no longer wanted"""
+
+    def __init__(self, reason):
+        super().__init__(f"Analysis cancelled: {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    Cancellation state for one request
+
+    Cancelled explicitly with cancel(), when deadline (seconds from now)
+    runs out, or when probe() returns True. The probe may cost a syscall, so
+    it runs at most once per probe_interval seconds.
+    """
+
+    DEADLINE = 'deadline exceeded'
+    DISCONNECTED = 'client disconnected'
+
+    def __init__(self, deadline=None, probe=None, probe_interval=1.0):
+        self.deadline_at = time.time() + deadline if deadline else None
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.reason = None
+        self._probed_at = 0
+        self._lock = threading.Lock()
+
+    def cancel(self, reason='cancelled'):
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+
+    @property
+    def cancelled(self):
+        if self.reason is None:
+            now = time.time()
+            if self.deadline_at is not None and now >= self.deadline_at:
+                self.cancel(self.DEADLINE)
+            elif self.probe and now - self._probed_at >= self.probe_interval:
+                self._probed_at = now
+                if self.probe():
+                    self.cancel(self.DISCONNECTED)
+        return self.reason is not None
+
+    def check(self):
+        """Raise AnalysisCancelled if the work should stop"""
+        if self.cancelled:
+            raise AnalysisCancelled(self.reason)
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without one"""
+        if self.deadline_at is None:
+            return None
+        return max(0.0, self.deadline_at - time.time())
+
+
+def socket_closed_probe(sock):
+    """
+    Probe for CancelToken: True once the peer has closed sock
+    Only valid after the request body has been read - a readable socket
+    with nothing to peek at means the other end hung up.
+    """
+    def probe():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+    return probe
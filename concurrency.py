@@ -0,0 +1,178 @@
+"""
+Single-flight call coalescing
+Concurrent calls for the same key share one computation. With a lock
+directory, callers in other processes on the node wait on a file lock and
+pick up the leader's result instead of recomputing it
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing stays in-process
+    fcntl = None
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run compute() once per key among concurrent callers
+
+    In-process followers wait on the leader's thread. When lock_dir is set,
+    the leader also holds an exclusive flock on {lock_dir}/{digest}.lock
+    while it computes and leaves the (JSON-serializable) result beside it;
+    a process that had to wait for that lock uses the result written while
+    it waited. Results are only shared with callers that overlapped the
+    computation - later calls compute again. If the leader fails with one of
+    retry_errors (e.g. its own request was cancelled), waiting callers run
+    the computation again instead of sharing the failure. Result files older
+    than result_ttl and idle lock files are swept from lock_dir periodically.
+    """
+
+    def __init__(self, lock_dir=None, retry_errors=(), result_ttl=60):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.retry_errors = tuple(retry_errors)
+        self.result_ttl = result_ttl
+        self._cleaned_at = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key, compute):
+        """
+        Return compute() for key, sharing the work with concurrent callers
+
+        Returns:
+            Tuple of (value, shared) - shared is True if another caller computed it
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+
+            if leader:
+                break
+            flight.done.wait()
+            if isinstance(flight.error, self.retry_errors):
+                continue  # the leader gave up for its own reasons; try again
+            self.shared += 1
+            if flight.error:
+                raise flight.error
+            return flight.value, True
+
+        try:
+            flight.value, shared = self._lead(key, compute)
+            if shared:
+                self.shared += 1
+            else:
+                self.leaders += 1
+            return flight.value, shared
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _paths(self, key):
+        base = os.path.join(self.lock_dir, hashlib.sha1(key.encode()).hexdigest())
+        return base + '.lock', base + '.json'
+
+    def _lead(self, key, compute):
+        if not self.lock_dir:
+            return compute(), False
+
+        self._cleanup()
+        lock_path, result_path = self._paths(key)
+        with open(lock_path, 'a+') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is computing this key: wait, then take its result
+                waited_since = time.time()
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                result = self._read_result(result_path, waited_since)
+                if result is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    return result['value'], True
+
+            try:
+                os.utime(lock_path)  # marks the lock as in use for _cleanup
+                value = compute()
+                self._write_result(result_path, value)
+                return value, False
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_result(self, path, since):
+        """Return {'value': ...} written at or after since, or None"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return result if result.get('written_at', 0) >= since else None
+
+    def _write_result(self, path, value):
+        try:
+            data = json.dumps({'value': value, 'written_at': time.time()})
+            fd, tmp_path = tempfile.mkstemp(dir=self.lock_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            # Other processes will simply compute it themselves
+            print(f"[SINGLE-FLIGHT] Could not share result: {e}")
+
+    def _cleanup(self):
+        """
+        Sweep lock_dir at most once per result_ttl
+        Results are only read by callers that were already waiting when they
+        were written, so old ones are dead weight; lock files are removed
+        only while nobody holds them.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._cleaned_at < self.result_ttl:
+                return
+            self._cleaned_at = now
+
+        for entry in os.scandir(self.lock_dir):
+            try:
+                if now - entry.stat().st_mtime < self.result_ttl:
+                    continue
+                if not entry.name.endswith('.lock'):
+                    os.remove(entry.path)  # stale result or leftover .tmp
+                    continue
+                with open(entry.path, 'a+') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # a computation is running
+                    os.remove(entry.path)
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            except OSError:
+                pass
+
+    def stats(self):
+        """Counts of computations run and calls answered by another caller's result"""
+        with self._lock:
+            in_flight = len(self._flights)
+        return {'leaders': self.leaders, 'shared': self.shared, 'in_flight': in_flight}
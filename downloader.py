@@ -0,0 +1,305 @@
+"""
+Ranged parallel downloader for direct audio stream URLs
+Splits a URL into byte ranges fetched concurrently over a shared connection
+pool, writing into a preallocated file
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*',
+    'Accept-Encoding': 'identity',
+}
+
+
+class DownloadCancelled(IOError):
+    """The download was cancelled before it finished"""
+
+
+class RangedDownload:
+    """
+    One file being fetched as parallel byte ranges
+
+    Ranges complete out of order, but readers can follow the contiguous
+    prefix (iter_contiguous / wait_for) so analysis can start as soon as the
+    first range lands. cancel() stops fetching between ranges and deletes the
+    partial file.
+    """
+
+    def __init__(self, session, url, dest_path, headers=None, part_size=1024 * 1024,
+                 max_workers=4, retries=3, timeout=30):
+        self.session = session
+        self.url = url
+        self.dest_path = dest_path
+        self.part_path = dest_path + '.part'
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.part_size = part_size
+        self.max_workers = max_workers
+        self.retries = retries
+        self.timeout = timeout
+
+        self.total_bytes = None
+        self.bytes_done = 0
+        self.contiguous_bytes = 0
+        self.error = None
+        self.finished = False
+        self.cancelled = False
+        self.users = 1  # callers sharing this transfer (see DownloadManager.abandon)
+        self.started_at = None
+        self._done_parts = set()
+        self._current_path = self.part_path
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # ---- control ----
+
+    def start(self):
+        """Start downloading in the background and return self"""
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name='ranged-download', daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None, cancel=None):
+        """
+        Wait for completion; raises the download error if it failed
+        cancel, if given, is a CancelToken checked every second while waiting
+        """
+        with self._cond:
+            if cancel is None:
+                self._cond.wait_for(lambda: self.finished, timeout=timeout)
+            else:
+                deadline = time.time() + timeout if timeout is not None else None
+                while not self.finished and (deadline is None or time.time() < deadline):
+                    cancel.check()
+                    self._cond.wait(1)
+        if self.error:
+            raise self.error
+        return self.dest_path
+
+    def cancel(self):
+        """Stop the transfer; the partial file is removed and readers see DownloadCancelled"""
+        with self._cond:
+            if not self.finished:
+                self.cancelled = True
+
+    # ---- progress ----
+
+    def progress(self):
+        """Snapshot of download progress"""
+        with self._cond:
+            elapsed = time.time() - self.started_at if self.started_at else 0
+            return {
+                'total_bytes': self.total_bytes,
+                'bytes_done': self.bytes_done,
+                'contiguous_bytes': self.contiguous_bytes,
+                'percent': round(100.0 * self.bytes_done / self.total_bytes, 1) if self.total_bytes else None,
+                'bytes_per_second': int(self.bytes_done / elapsed) if elapsed else 0,
+                'finished': self.finished,
+                'error': str(self.error) if self.error else None,
+            }
+
+    def wait_for(self, offset, timeout=None):
+        """Block until the first `offset` bytes are on disk (or the download ended)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.contiguous_bytes >= offset or self.finished, timeout=timeout)
+            return self.contiguous_bytes
+
+    def iter_contiguous(self, block_size=256 * 1024):
+        """Yield the file's bytes in order as soon as each contiguous range is written"""
+        position = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.contiguous_bytes > position or self.finished)
+                available = self.contiguous_bytes
+                if self.error:
+                    raise self.error
+                if available <= position and self.finished:
+                    return
+                # Open under the lock so the .part -> dest rename can't slip in between
+                f = open(self._current_path, 'rb')
+
+            with f:
+                f.seek(position)
+                while position < available:
+                    data = f.read(min(block_size, available - position))
+                    if not data:
+                        break
+                    position += len(data)
+                    yield data
+
+    # ---- internals ----
+
+    def _probe(self):
+        """Find the total size and whether the server honours Range requests"""
+        headers = dict(self.headers, Range='bytes=0-0')
+        with self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            content_range = response.headers.get('Content-Range', '')
+            if response.status_code == 206 and '/' in content_range:
+                total = content_range.rsplit('/', 1)[1]
+                if total.isdigit():
+                    return int(total), True
+            length = response.headers.get('Content-Length')
+            return (int(length) if length and length.isdigit() else None), False
+
+    def _mark_done(self, index, size):
+        with self._cond:
+            self._done_parts.add(index)
+            self.bytes_done += size
+            # Advance the contiguous prefix over every finished part
+            next_index = self.contiguous_bytes // self.part_size
+            while next_index in self._done_parts:
+                next_index += 1
+            self.contiguous_bytes = min(next_index * self.part_size, self.total_bytes)
+            self._cond.notify_all()
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise DownloadCancelled(f"Download of {os.path.basename(self.dest_path)} cancelled")
+
+    def _fetch_part(self, index):
+        self._check_cancelled()
+        start = index * self.part_size
+        end = min(start + self.part_size, self.total_bytes) - 1
+        headers = dict(self.headers, Range=f'bytes={start}-{end}')
+
+        for attempt in range(self.retries):
+            try:
+                response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+                if response.status_code != 206:
+                    raise IOError(f"Range request returned {response.status_code}")
+                data = response.content
+                if len(data) != end - start + 1:
+                    raise IOError(f"Short range: got {len(data)} of {end - start + 1} bytes")
+                with open(self.part_path, 'r+b') as f:
+                    f.seek(start)
+                    f.write(data)
+                self._mark_done(index, len(data))
+                return
+            except Exception as e:
+                if attempt == self.retries - 1:
+                    raise
+                print(f"[DOWNLOAD] Range {start}-{end} failed ({e}), retrying")
+                time.sleep(0.5 * (attempt + 1))
+
+    def _fetch_single(self):
+        """Fallback for servers without Range support: one sequential stream"""
+        with self.session.get(self.url, headers=self.headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with open(self.part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=256 * 1024):
+                    self._check_cancelled()
+                    if chunk:
+                        f.write(chunk)
+                        f.flush()
+                        with self._cond:
+                            self.bytes_done += len(chunk)
+                            self.contiguous_bytes = self.bytes_done
+                            self._cond.notify_all()
+        with self._cond:
+            self.total_bytes = self.bytes_done
+
+    def _run(self):
+        try:
+            total, ranged = self._probe()
+            with self._cond:
+                self.total_bytes = total
+
+            if not ranged or not total:
+                self._fetch_single()
+            else:
+                # Preallocate so every range can be written at its final offset
+                with open(self.part_path, 'wb') as f:
+                    f.truncate(total)
+
+                num_parts = -(-total // self.part_size)
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    # map() submits in order, so early ranges are fetched first
+                    list(executor.map(self._fetch_part, range(num_parts)))
+
+            with self._cond:
+                os.replace(self.part_path, self.dest_path)
+                self._current_path = self.dest_path
+        except Exception as e:
+            if not isinstance(e, DownloadCancelled):
+                print(f"[DOWNLOAD ERROR] {e}")
+            self.error = e
+            try:
+                os.remove(self.part_path)
+            except OSError:
+                pass
+        finally:
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+
+class DownloadManager:
+    """
+    Starts ranged downloads over one pooled requests.Session and tracks the
+    active ones, so concurrent requests for the same destination share a
+    single transfer
+    """
+
+    def __init__(self, max_connections=16, part_size=1024 * 1024, workers_per_download=4):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.part_size = part_size
+        self.workers_per_download = workers_per_download
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def start(self, url, dest_path, headers=None):
+        """Start (or join) a download of url into dest_path"""
+        while True:
+            with self._lock:
+                download = self._active.get(dest_path)
+                if not (download and download.cancelled and not download.finished):
+                    if download and not (download.finished and download.error):
+                        download.users += 1
+                        return download
+
+                    download = RangedDownload(self.session, url, dest_path, headers=headers,
+                                              part_size=self.part_size, max_workers=self.workers_per_download)
+                    self._active[dest_path] = download
+
+                    # Forget finished downloads so the registry stays small
+                    for path in [p for p, d in self._active.items() if d.finished and p != dest_path]:
+                        del self._active[path]
+                    break
+
+            # A cancelled transfer still owns the .part file until it winds down
+            try:
+                download.join()
+            except Exception:
+                pass
+
+        return download.start()
+
+    def abandon(self, download):
+        """Drop one caller's interest in a download, cancelling it when nobody else is waiting"""
+        with self._lock:
+            download.users -= 1
+            if download.users > 0 or download.finished:
+                return
+        print(f"[DOWNLOAD] Cancelling unwanted download of {os.path.basename(download.dest_path)}")
+        download.cancel()
+
+    def get(self, dest_path):
+        """Return the tracked download for a destination, if any"""
+        with self._lock:
+            return self._active.get(dest_path)
+
+    def download(self, url, dest_path, headers=None):
+        """Download synchronously and return dest_path"""
+        return self.start(url, dest_path, headers=headers).join()
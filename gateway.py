@@ -0,0 +1,499 @@
+"""
+Async I/O gateway in front of the gunicorn app
+Routes that mostly wait on upstream HTTP (audio proxy, Genius search and
+lyrics) are served here on one asyncio event loop with a bounded connection
+pool; every other request is streamed through to the sync gunicorn workers,
+with CPU-heavy endpoints admitted through per-class concurrency limits
+
+Run with: python gateway.py  (starts gunicorn on GATEWAY_BACKEND_PORT itself)
+"""
+
+import asyncio
+import hashlib
+import hmac
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+import genius as genius_api
+from admission import AdmissionController, AdmissionRejected, AdmissionRouter
+from downloader import DEFAULT_HEADERS
+from stream_proxy import SparseRangeCache, stream_cache_key
+from youtube import StreamURLManager
+
+# Load environment variables from .env file
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+PORT = int(os.getenv('PORT', 5000))
+BACKEND_PORT = int(os.getenv('GATEWAY_BACKEND_PORT', 5001))
+BACKEND_URL = os.getenv('GATEWAY_BACKEND_URL') or f"http://127.0.0.1:{BACKEND_PORT}"
+WEB_WORKERS = os.getenv('WEB_WORKERS', '2')
+MAX_CONNECTIONS = int(os.getenv('GATEWAY_MAX_CONNECTIONS', 200))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv('GATEWAY_MAX_CONNECTIONS_PER_HOST', 32))
+BACKEND_TIMEOUT = int(os.getenv('GATEWAY_BACKEND_TIMEOUT', 600))
+UPSTREAM_TIMEOUT = int(os.getenv('GATEWAY_UPSTREAM_TIMEOUT', 15))
+
+GENIUS_ACCESS_TOKEN = os.getenv('GENIUS_ACCESS_TOKEN', None)
+SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
+GATEWAY_TOKEN = hmac.new(SECRET_KEY.encode(), b'chordis-gateway', hashlib.sha256).hexdigest()
+
+CHORDIS_DATA_DIR = os.getenv('CHORDIS_DATA_DIR', os.path.join(tempfile.gettempdir(), 'chordis'))
+PROXY_MAX_RESPONSE_BYTES = int(os.getenv('PROXY_MAX_RESPONSE_KB', 4096)) * 1024
+# Cap on bodies the gateway itself reads (same limit as the Flask app's MAX_CONTENT_LENGTH);
+# forwarded requests are streamed to gunicorn without being buffered here
+MAX_BODY_BYTES = (int(os.getenv('MAX_UPLOAD_MB', 50)) + 1) * 1024 * 1024
+
+# Admission control: concurrent requests per endpoint class, how many may wait
+# for a slot, and the longest wait before giving up with 429
+ANALYSIS_CONCURRENCY = int(os.getenv('ADMISSION_ANALYSIS_CONCURRENCY', WEB_WORKERS))
+ANALYSIS_QUEUE = int(os.getenv('ADMISSION_ANALYSIS_QUEUE', 8))
+RECOGNITION_CONCURRENCY = int(os.getenv('ADMISSION_RECOGNITION_CONCURRENCY', 1))
+RECOGNITION_QUEUE = int(os.getenv('ADMISSION_RECOGNITION_QUEUE', 4))
+ADMISSION_MAX_WAIT = int(os.getenv('ADMISSION_MAX_WAIT', 30))
+
+# Headers that describe a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade', 'x-gateway-token', 'x-admission-waiting',
+}
+
+
+# ============================================
+# AUDIO PROXY
+# ============================================
+
+async def on_disk(fn, *args):
+    """Run blocking file work (range cache, stream records) off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def _fetch_range(session, cache, key, url, headers, start, end):
+    """Stream [start, end) from upstream into the sparse cache, yielding chunks as they arrive"""
+    written = start
+    headers = dict(headers, Range=f'bytes={start}-{end - 1}')
+    try:
+        async with session.get(url, headers=headers) as response:
+            if response.status != 206:
+                raise IOError(f"Upstream returned {response.status} for a range request")
+            async for chunk in response.content.iter_chunked(256 * 1024):
+                await on_disk(cache.write, key, written, chunk)
+                written += len(chunk)
+                yield chunk
+    finally:
+        if written > start:
+            await on_disk(cache.update, key, start, written)
+
+
+async def serve_stream(request, audio_url, upstream_headers=None):
+    """
+    Range response for a remote stream backed by the same sparse range cache as the Flask routes
+    Raises aiohttp.ClientResponseError if upstream rejects the URL before anything was sent
+    """
+    upstream_headers = dict(DEFAULT_HEADERS, **(upstream_headers or {}))
+    session = request.app['upstream']
+    cache = request.app['range_cache']
+    key = stream_cache_key(audio_url)
+    response = None
+
+    try:
+        meta = await on_disk(cache.load, key)
+        if not meta.get('total'):
+            headers = dict(upstream_headers, Range='bytes=0-0')
+            async with session.get(audio_url, headers=headers) as probe:
+                probe.raise_for_status()
+                content_range = probe.headers.get('Content-Range', '')
+                total = content_range.rsplit('/', 1)[1] if '/' in content_range else probe.headers.get('Content-Length')
+                if not total or not total.isdigit():
+                    raise IOError("Upstream did not report a size")
+                meta = await on_disk(lambda: cache.update(key, total=int(total),
+                                                          content_type=probe.headers.get('Content-Type')))
+        total = meta['total']
+
+        try:
+            byte_range = request.http_range if 'Range' in request.headers else None
+        except ValueError:
+            byte_range = None  # multiple or malformed ranges: send the whole stream
+
+        if byte_range:
+            start = byte_range.start or 0
+            if start < 0:
+                start, end = max(0, total + start), total
+            else:
+                end = min(total, byte_range.stop if byte_range.stop is not None else start + PROXY_MAX_RESPONSE_BYTES)
+        else:
+            start, end = 0, total
+        if start >= total:
+            return web.json_response({"error": "Range not satisfiable"}, status=416,
+                                     headers={'Content-Range': f'bytes */{total}'})
+
+        response = web.StreamResponse(status=206 if byte_range else 200)
+        response.content_type = meta.get('content_type') or 'audio/mp4'
+        response.content_length = end - start
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Cache-Control'] = 'public, max-age=3600'
+        if byte_range:
+            response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{total}'
+        await response.prepare(request)
+
+        for kind, piece_start, piece_end in await on_disk(cache.segments, key, start, end):
+            if kind == 'cache':
+                blocks = cache.read(key, piece_start, piece_end)
+                try:
+                    while True:
+                        data = await on_disk(next, blocks, None)
+                        if data is None:
+                            break
+                        await response.write(data)
+                finally:
+                    blocks.close()
+            else:
+                async for data in _fetch_range(session, cache, key, audio_url, upstream_headers,
+                                               piece_start, piece_end):
+                    await response.write(data)
+        await on_disk(cache.update, key)
+        await response.write_eof()
+        return response
+
+    except (ConnectionResetError, asyncio.CancelledError, aiohttp.ClientResponseError):
+        raise
+    except Exception as e:
+        print(f"[GATEWAY PROXY ERROR] {type(e).__name__}: {e}")
+        if response is not None and response.prepared:
+            raise  # headers already sent - nothing useful left to tell the client
+        if isinstance(e, asyncio.TimeoutError):
+            return web.json_response({"error": "Upstream timeout"}, status=504)
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def proxy_audio(request):
+    """Async /api/proxy-audio"""
+    audio_url = request.query.get('url')
+    if not audio_url:
+        return web.json_response({"error": "No URL provided"}, status=400)
+    try:
+        return await serve_stream(request, audio_url)
+    except aiohttp.ClientResponseError as e:
+        return web.json_response({"error": f"Upstream returned {e.status}"}, status=502)
+
+
+async def proxy_stream(request):
+    """
+    Async /api/stream/<id> for records whose URL is still fresh
+    Anything needing a refresh (unknown, expiring or rejected URL) goes to the Flask route,
+    which owns yt-dlp extraction
+    """
+    streams = request.app['stream_urls']
+    stream_id = request.match_info['stream_id']
+    record = await on_disk(streams.load, stream_id)
+    if not streams.is_fresh(record):
+        return await forward(request)
+
+    await on_disk(streams.touch, stream_id)
+    try:
+        return await serve_stream(request, record['stream_url'], record['http_headers'])
+    except aiohttp.ClientResponseError:
+        print(f"[GATEWAY] Stream {stream_id[:8]} rejected upstream, forwarding for refresh")
+        return await forward(request)
+
+
+# ============================================
+# GENIUS
+# ============================================
+
+async def log_search_in_backend(request, query, results_count):
+    """Record the search through the Flask app so it lands in SearchLog with the user's session"""
+    headers = {'X-Gateway-Token': GATEWAY_TOKEN}
+    if 'Cookie' in request.headers:
+        headers['Cookie'] = request.headers['Cookie']
+    try:
+        async with request.app['backend'].post(f"{BACKEND_URL}/api/internal/search-log", headers=headers,
+                                               json={'query': query, 'search_type': 'song',
+                                                     'results_count': results_count}) as response:
+            await response.read()
+    except Exception as e:
+        print(f"[GATEWAY] Could not log search: {e}")
+
+
+async def search_songs(request):
+    """Async /api/search-songs"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    query = (data.get('query') or '').strip()
+    if not query:
+        return web.json_response({"error": "Query is required", "success": False}, status=400)
+
+    results = []
+    if GENIUS_ACCESS_TOKEN:
+        try:
+            print(f"[SEARCH] Searching Genius for: {query}")
+            async with request.app['upstream'].get(genius_api.GENIUS_SEARCH_URL,
+                                                   headers=genius_api.auth_headers(GENIUS_ACCESS_TOKEN),
+                                                   params={'q': query}) as response:
+                if response.status == 200:
+                    results = genius_api.search_results_from_response(await response.json())
+                    print(f"[SEARCH] Found {len(results)} results")
+                else:
+                    print(f"[ERROR] Genius API returned status {response.status}")
+        except Exception as e:
+            print(f"[ERROR] Genius search error: {e}")
+    else:
+        print("[INFO] Genius API token not configured")
+
+    if not results:
+        print(f"[FALLBACK] Creating mock result for: {query}")
+        results = genius_api.mock_search_results(query)
+
+    asyncio.ensure_future(log_search_in_backend(request, query, len(results)))
+    return web.json_response({"success": True, "results": results, "count": len(results)})
+
+
+async def get_lyrics(request):
+    """Async /api/get-lyrics (falls back to the Flask route if the page can't be parsed here)"""
+    body = await request.read()
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    title = (data.get('title') or '').strip()
+    artist = (data.get('artist') or '').strip()
+
+    if not title:
+        return web.json_response({"error": "Song title is required"}, status=400)
+    if not GENIUS_ACCESS_TOKEN:
+        return web.json_response({
+            "success": False,
+            "error": "Lyrics service is not available. Please configure Genius API token."
+        }, status=503)
+
+    session = request.app['upstream']
+    try:
+        print(f"Getting lyrics for: {title} by {artist}")
+        async with session.get(genius_api.GENIUS_SEARCH_URL, headers=genius_api.auth_headers(GENIUS_ACCESS_TOKEN),
+                               params={'q': f"{title} {artist}".strip()}) as response:
+            response.raise_for_status()
+            song = genius_api.best_song_hit(await response.json(), title, artist)
+
+        if not song or not song.get('url'):
+            return web.json_response({"success": False, "error": "No lyrics found for this song"}, status=404)
+
+        async with session.get(song['url'], headers={'User-Agent': DEFAULT_HEADERS['User-Agent']}) as response:
+            response.raise_for_status()
+            html = await response.text()
+
+        # HTML parsing is CPU work - keep it off the event loop
+        lyrics_text = await asyncio.get_running_loop().run_in_executor(None, genius_api.lyrics_from_song_html, html)
+        if lyrics_text is None:
+            print("[GATEWAY] Could not parse lyrics page, forwarding to backend")
+            return await forward(request, body=body)
+
+        return web.json_response({
+            "success": True,
+            "lyrics": {
+                "text": genius_api.clean_lyrics(lyrics_text),
+                "source": "genius",
+                "title": song.get('title'),
+                "artist": song.get('primary_artist', {}).get('name'),
+                "url": song.get('url')
+            }
+        })
+
+    except Exception as e:
+        print(f"Error getting lyrics: {e}")
+        return web.json_response({
+            "success": False,
+            "error": "Failed to retrieve lyrics. Please try again."
+        }, status=500)
+
+
+# ============================================
+# PASS-THROUGH TO GUNICORN
+# ============================================
+
+async def forward(request, body=None):
+    """Stream a request to the gunicorn backend and its response back to the client"""
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+    headers['X-Forwarded-For'] = request.remote or ''
+    headers['X-Forwarded-Proto'] = request.headers.get('X-Forwarded-Proto', request.scheme)
+    if 'admission_waiting' in request:
+        # Live queue depth, so the app can pick a cheaper analysis tier under load
+        headers['X-Admission-Waiting'] = str(request['admission_waiting'])
+
+    if body is not None:
+        data = body
+    elif request.body_exists:
+        data = request.content
+    else:
+        data = None
+
+    try:
+        async with request.app['backend'].request(request.method, f"{BACKEND_URL}{request.rel_url}",
+                                                  headers=headers, data=data,
+                                                  allow_redirects=False) as upstream:
+            response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+            for name, value in upstream.headers.items():
+                if name.lower() not in HOP_BY_HOP_HEADERS:
+                    response.headers.add(name, value)
+            for name, value in request.get('admission_headers', {}).items():
+                response.headers[name] = value
+            await response.prepare(request)
+            async for chunk in upstream.content.iter_any():
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+    except aiohttp.ClientConnectorError:
+        return web.json_response({"success": False, "error": "Server is starting up, try again shortly"},
+                                 status=503, headers={'Retry-After': '5'})
+
+
+# ============================================
+# ADMISSION CONTROL
+# ============================================
+
+def create_admission_router():
+    """Endpoint classes that run CPU-heavy work on the gunicorn workers"""
+    router = AdmissionRouter()
+    router.add(AdmissionController('analysis', ANALYSIS_CONCURRENCY, ANALYSIS_QUEUE, ADMISSION_MAX_WAIT),
+               [r'/analyze', r'/analyze/stream', r'/api/search-and-analyze', r'/api/uploads/check',
+                r'/api/uploads/[^/]+/finalize'],
+               methods=('GET', 'POST'))
+    router.add(AdmissionController('recognition', RECOGNITION_CONCURRENCY, RECOGNITION_QUEUE, ADMISSION_MAX_WAIT,
+                                   service_time=5.0),
+               [r'/api/recognize-song'], methods=('POST',))
+    return router
+
+
+@web.middleware
+async def admission_middleware(request, handler):
+    """Queue limited requests for a slot, or turn them away fast with 429 + Retry-After"""
+    controller = request.app['admission'].match(request.method, request.path)
+    if controller is None:
+        return await handler(request)
+
+    arrived = time.monotonic()
+    try:
+        position = await controller.acquire()
+    except AdmissionRejected as e:
+        print(f"[ADMISSION] Rejected {request.method} {request.path} ({controller.name}: {e.reason})")
+        return web.json_response({
+            "success": False,
+            "error": f"{e.reason}, please retry in {e.retry_after}s",
+            "retry_after": e.retry_after,
+            "queue_length": e.queue_length
+        }, status=429, headers={'Retry-After': str(e.retry_after)})
+
+    started = time.monotonic()
+    request['admission_waiting'] = controller.status()['waiting']
+    # forward() copies these onto the response before streaming it
+    request['admission_headers'] = {
+        'X-Queue-Position': str(position),
+        'X-Queue-Wait': f"{started - arrived:.2f}",
+    }
+    try:
+        return await handler(request)
+    finally:
+        controller.release(time.monotonic() - started)
+
+
+async def admission_status(request):
+    """Current load per endpoint class, so clients can show their likely place in line"""
+    return web.json_response({"success": True, "classes": request.app['admission'].status()})
+
+
+# ============================================
+# APP / PROCESS MANAGEMENT
+# ============================================
+
+async def on_startup(app):
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST)
+    app['upstream'] = aiohttp.ClientSession(connector=connector,
+                                            timeout=aiohttp.ClientTimeout(total=None, sock_connect=UPSTREAM_TIMEOUT,
+                                                                          sock_read=UPSTREAM_TIMEOUT))
+    # No compression handling: bytes pass through exactly as gunicorn sent them
+    app['backend'] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS),
+                                           auto_decompress=False,
+                                           timeout=aiohttp.ClientTimeout(total=None, sock_read=BACKEND_TIMEOUT))
+    # Read-only use: the gunicorn workers own refreshing (they have the yt-dlp pool)
+    app['stream_urls'] = StreamURLManager(None, os.path.join(CHORDIS_DATA_DIR, 'streams'), SECRET_KEY,
+                                          refresh_margin=int(os.getenv('STREAM_REFRESH_MARGIN', 900)))
+    app['range_cache'] = SparseRangeCache(os.path.join(CHORDIS_DATA_DIR, 'proxy'),
+                                          max_bytes=int(os.getenv('PROXY_CACHE_MAX_MB', 1024)) * 1024 * 1024)
+
+
+async def on_cleanup(app):
+    await app['upstream'].close()
+    await app['backend'].close()
+
+
+def create_app():
+    """Build the gateway application"""
+    app = web.Application(client_max_size=MAX_BODY_BYTES, middlewares=[admission_middleware])
+    app['admission'] = create_admission_router()
+    app.router.add_get('/api/admission', admission_status)
+    app.router.add_get('/api/proxy-audio', proxy_audio)
+    app.router.add_get('/api/stream/{stream_id}', proxy_stream)
+    app.router.add_post('/api/search-songs', search_songs)
+    app.router.add_post('/api/get-lyrics', get_lyrics)
+    app.router.add_route('*', '/{tail:.*}', forward)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def start_backend():
+    """Start gunicorn on the internal port (CPU-heavy routes stay on these sync workers)"""
+    cmd = [sys.executable, '-m', 'gunicorn', 'api:app',
+           '--bind', f'127.0.0.1:{BACKEND_PORT}',
+           '--workers', WEB_WORKERS,
+           '--timeout', '120']
+    print(f"[GATEWAY] Starting backend: {' '.join(cmd[2:])}")
+    return subprocess.Popen(cmd)
+
+
+async def watch_backend(app):
+    """Exit if gunicorn dies so the platform restarts the whole service"""
+    proc = app['backend_process']
+    while proc.poll() is None:
+        await asyncio.sleep(2)
+    print(f"[GATEWAY] Backend exited with code {proc.returncode}, shutting down")
+    os._exit(1)
+
+
+def main():
+    app = create_app()
+
+    if not os.getenv('GATEWAY_BACKEND_URL'):
+        app['backend_process'] = start_backend()
+
+        async def start_watch(app):
+            app['backend_watch'] = asyncio.ensure_future(watch_backend(app))
+
+        async def stop_backend(app):
+            app['backend_watch'].cancel()
+            app['backend_process'].terminate()
+            try:
+                app['backend_process'].wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                app['backend_process'].kill()
+
+        app.on_startup.append(start_watch)
+        app.on_cleanup.append(stop_backend)
+
+    print(f"[GATEWAY] Listening on 0.0.0.0:{PORT}, backend at {BACKEND_URL}")
+    # Cancel handlers whose client went away: forward() then drops its backend
+    # connection, which lets the gunicorn worker notice and stop the analysis
+    web.run_app(app, host='0.0.0.0', port=PORT, print=None, handler_cancellation=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Genius API helpers shared by the Flask app and the async gateway
+Only request building and response parsing live here; callers bring their
+own (sync or async) HTTP client
+"""
+
+import re
+
+GENIUS_API_URL = 'https://api.genius.com'
+GENIUS_SEARCH_URL = f'{GENIUS_API_URL}/search'
+
+
+def auth_headers(access_token):
+    """Authorization headers for the Genius API"""
+    return {'Authorization': f'Bearer {access_token}'}
+
+
+def search_results_from_response(response_data, limit=10):
+    """Turn a Genius /search response into the song list /api/search-songs returns"""
+    results = []
+    hits = response_data.get('response', {}).get('hits', [])
+    for hit in hits[:limit]:
+        result_data = hit.get('result', {})
+        results.append({
+            'title': result_data.get('title', 'Unknown'),
+            'artist': result_data.get('primary_artist', {}).get('name', 'Unknown Artist'),
+            'album': result_data.get('album', {}).get('name', '') if result_data.get('album') else '',
+            'artwork': result_data.get('song_art_image_thumbnail_url', ''),
+            'thumbnail': result_data.get('header_image_thumbnail_url', ''),
+            'url': result_data.get('url', ''),
+            'id': result_data.get('id', '')
+        })
+    return results
+
+
+def mock_search_results(query):
+    """Fallback result when Genius is unavailable or finds nothing"""
+    query_parts = query.split()
+    return [
+        {
+            'title': ' '.join(query_parts[:3]) if len(query_parts) >= 3 else query,
+            'artist': ' '.join(query_parts[3:]) if len(query_parts) > 3 else 'Various Artists',
+            'album': '',
+            'artwork': '',
+            'thumbnail': '',
+            'url': '',
+            'id': '1'
+        }
+    ]
+
+
+def best_song_hit(response_data, title, artist=None):
+    """
+    Pick the song to fetch lyrics for from a Genius /search response
+    Prefers a hit whose primary artist matches, like lyricsgenius.search_song
+    """
+    hits = [hit.get('result', {}) for hit in response_data.get('response', {}).get('hits', [])
+            if hit.get('type') == 'song']
+    if not hits:
+        return None
+    if artist:
+        wanted = artist.lower()
+        for song in hits:
+            name = song.get('primary_artist', {}).get('name', '').lower()
+            if wanted in name or name in wanted:
+                return song
+    return hits[0]
+
+
+def clean_lyrics(lyrics_text):
+    """Strip section headers ([Verse], [Chorus], ...) and collapse blank lines"""
+    lyrics_text = re.sub(r'\[.*?\]', '', lyrics_text)
+    lyrics_text = re.sub(r'\n\s*\n', '\n\n', lyrics_text)
+    return lyrics_text.strip()
+
+
+def lyrics_from_song_html(html):
+    """
+    Extract lyrics from a Genius song page (the data-lyrics-container divs)
+    Returns None if the page has no lyrics or BeautifulSoup is not installed
+    """
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        return None
+
+    soup = BeautifulSoup(html, 'html.parser')
+    containers = soup.select('div[data-lyrics-container="true"]')
+    if not containers:
+        return None
+
+    for br in soup.find_all('br'):
+        br.replace_with('\n')
+    return '\n'.join(container.get_text() for container in containers).strip() or None
@@ -0,0 +1,421 @@
+"""
+Durable analysis job queue
+Jobs live in the app's SQL database, so workers on any node can claim them
+under a time-limited lease; a job whose worker dies is picked up again once
+its lease runs out, failures are retried with backoff and finally dead-lettered
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+JOB_STATUSES = ('queued', 'running', 'done', 'dead')
+
+# available_at of a held job: queued, but not claimable until advance() releases it
+HELD_UNTIL = datetime(9999, 1, 1)
+
+
+def job_id_for(key):
+    """Deterministic job id for a dedup key (same inputs -> same job)"""
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class JobQueue:
+    """
+    SQL-backed job queue with leases
+
+    Claiming is a conditional UPDATE that only matches while the row is still
+    claimable, so two workers never hold the same attempt. Running jobs must
+    heartbeat within lease_seconds; failed attempts are requeued after
+    backoff_base * 2**(attempt - 1) seconds, and a job that has used up its
+    attempts is moved to 'dead' and kept for dead_ttl seconds for inspection.
+    Jobs enqueued with hold=True wait until advance() releases them, which is
+    how a group of jobs (a batch) is held to a concurrency limit.
+    """
+
+    def __init__(self, db, model, lease_seconds=60, max_attempts=3, backoff_base=15,
+                 ttl=3600, dead_ttl=7 * 24 * 3600):
+        self.db = db
+        self.model = model
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.ttl = ttl
+        self.dead_ttl = dead_ttl
+        self._reaped_at = None
+
+    def get(self, job_id):
+        """Return a job row, or None"""
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            raise ValueError("Invalid job id")
+        return self.db.session.get(self.model, job_id)
+
+    def depth(self):
+        """Number of jobs waiting to be claimed right now"""
+        model = self.model
+        return model.query.filter(model.status == 'queued', model.available_at <= datetime.utcnow()).count()
+
+    def _reusable(self, job):
+        if job.status == 'done':
+            return job.finished_at and datetime.utcnow() - job.finished_at < timedelta(seconds=self.ttl)
+        return job.status in ('queued', 'running')  # abandoned runs come back via lease expiry
+
+    def enqueue(self, key, kind, payload, input_data=None, user_id=None, hold=False):
+        """
+        Queue a job for a dedup key unless an equivalent one is queued, running or recently done
+        hold=True queues it unclaimable until advance() releases it
+
+        Returns:
+            Tuple of (job row, created)
+        """
+        job_id = job_id_for(key)
+        job = self.get(job_id)
+        if job and self._reusable(job):
+            return job, False
+
+        if job is None:
+            job = self.model(id=job_id)
+            self.db.session.add(job)
+        job.kind = kind
+        job.payload = json.dumps(payload)
+        job.input_data = input_data
+        job.user_id = user_id
+        job.status = 'queued'
+        job.stage = 'held' if hold else 'queued'
+        job.percent = 0
+        job.result = None
+        job.error = None
+        job.attempts = 0
+        job.max_attempts = self.max_attempts
+        job.available_at = HELD_UNTIL if hold else datetime.utcnow()
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.finished_at = None
+        try:
+            self.db.session.commit()
+        except IntegrityError:
+            # Another node inserted the same job first
+            self.db.session.rollback()
+            return self.get(job_id), False
+        return job, True
+
+    def get_many(self, job_ids):
+        """Return {job id: job row} for the ids that still exist"""
+        model = self.model
+        return {job.id: job for job in model.query.filter(model.id.in_(list(job_ids))).all()}
+
+    def advance(self, job_ids, limit, lock=None):
+        """
+        Keep up to limit of job_ids queued or running, releasing held ones in list order
+
+        The count and the release must not interleave with another advance of
+        the same group, or both could release a job: lock, if given, is called
+        first in the same transaction to take a lock that is held until the
+        commit (e.g. a no-op UPDATE of the batch row).
+
+        Returns:
+            Number of jobs released
+        """
+        if lock:
+            lock()
+        model = self.model
+        # Re-read rows this session may have loaded before the lock was granted
+        jobs = {job.id: job for job in model.query.filter(model.id.in_(list(job_ids))).populate_existing().all()}
+        active = sum(1 for job in jobs.values()
+                     if job.status == 'running' or (job.status == 'queued' and job.available_at != HELD_UNTIL))
+        held = [job_id for job_id in job_ids
+                if job_id in jobs and jobs[job_id].status == 'queued' and jobs[job_id].available_at == HELD_UNTIL]
+        release = held[:max(0, limit - active)]
+        if not release:
+            self.db.session.commit()  # ends the transaction (and drops the lock)
+            return 0
+
+        released = model.query.filter(model.id.in_(release), model.available_at == HELD_UNTIL).update({
+            'available_at': datetime.utcnow(),
+            'stage': 'queued'
+        }, synchronize_session=False)
+        self.db.session.commit()
+        return released
+
+    def _claimable(self, now):
+        model = self.model
+        return or_(
+            and_(model.status == 'queued', model.available_at <= now),
+            and_(model.status == 'running', model.lease_expires_at < now,
+                 model.attempts < model.max_attempts)
+        )
+
+    def _reap(self, now):
+        """Dead-letter running jobs whose lease expired on their final attempt
+
+        Runs at most once per lease period rather than on every poll; a lease
+        that expires just after a sweep is picked up by the next one.
+        """
+        if self._reaped_at and now - self._reaped_at < timedelta(seconds=self.lease_seconds):
+            return
+        self._reaped_at = now
+        model = self.model
+        reaped = model.query.filter(
+            model.status == 'running', model.lease_expires_at < now,
+            model.attempts >= model.max_attempts
+        ).update({
+            'status': 'dead',
+            'error': 'Worker lost its lease on the final attempt',
+            'input_data': None,
+            'lease_owner': None,
+            'finished_at': now
+        }, synchronize_session=False)
+        if reaped:
+            self.db.session.commit()
+            print(f"[JOBS] Dead-lettered {reaped} job(s) with expired leases")
+
+    def claim(self, owner):
+        """Lease the next claimable job for owner; returns the job row or None"""
+        model = self.model
+        now = datetime.utcnow()
+        self._reap(now)
+        candidates = self.db.session.query(model.id).filter(self._claimable(now)) \
+            .order_by(model.available_at).limit(5).all()
+        for (job_id,) in candidates:
+            claimed = model.query.filter(model.id == job_id, self._claimable(now)).update({
+                'status': 'running',
+                'stage': 'starting',
+                'lease_owner': owner,
+                'lease_expires_at': now + timedelta(seconds=self.lease_seconds),
+                'heartbeat_at': now,
+                'attempts': model.attempts + 1
+            }, synchronize_session=False)
+            self.db.session.commit()
+            if claimed:
+                return self.get(job_id)
+        return None
+
+    def _owned(self, job_id, owner):
+        model = self.model
+        return model.query.filter(model.id == job_id, model.lease_owner == owner,
+                                  model.status == 'running')
+
+    def heartbeat(self, job_id, owner, stage=None, percent=None):
+        """Extend a held lease (and record progress); False if the lease was lost"""
+        now = datetime.utcnow()
+        fields = {'lease_expires_at': now + timedelta(seconds=self.lease_seconds), 'heartbeat_at': now}
+        if stage is not None:
+            fields['stage'] = stage
+        if percent is not None:
+            fields['percent'] = int(max(0, min(100, percent)))
+        held = self._owned(job_id, owner).update(fields, synchronize_session=False)
+        self.db.session.commit()
+        return bool(held)
+
+    def complete(self, job_id, owner, result):
+        """Store a job's result; False if the lease was lost to another worker"""
+        done = self._owned(job_id, owner).update({
+            'status': 'done',
+            'stage': 'done',
+            'percent': 100,
+            'result': json.dumps(result),
+            'error': None,
+            'input_data': None,
+            'lease_owner': None,
+            'finished_at': datetime.utcnow()
+        }, synchronize_session=False)
+        self.db.session.commit()
+        return bool(done)
+
+    def fail(self, job_id, owner, error):
+        """Requeue a failed attempt after backoff, or dead-letter it when out of attempts"""
+        job = self.get(job_id)
+        if not job or job.lease_owner != owner or job.status != 'running':
+            return False
+        now = datetime.utcnow()
+        if job.attempts >= job.max_attempts:
+            fields = {'status': 'dead', 'input_data': None, 'finished_at': now}
+        else:
+            delay = self.backoff_base * 2 ** (job.attempts - 1)
+            fields = {'status': 'queued', 'stage': 'retrying', 'available_at': now + timedelta(seconds=delay)}
+        fields.update({'error': str(error), 'lease_owner': None, 'lease_expires_at': None})
+        self._owned(job_id, owner).update(fields, synchronize_session=False)
+        self.db.session.commit()
+        return fields['status']
+
+    def release(self, job_id, owner):
+        """Hand a running job back without using up an attempt (worker shutting down)"""
+        model = self.model
+        released = self._owned(job_id, owner).update({
+            'status': 'queued',
+            'stage': 'queued',
+            'attempts': model.attempts - 1,
+            'available_at': datetime.utcnow(),
+            'lease_owner': None,
+            'lease_expires_at': None
+        }, synchronize_session=False)
+        self.db.session.commit()
+        return bool(released)
+
+    def cleanup_expired(self):
+        """Delete finished jobs past the TTL and dead jobs past the dead-letter TTL"""
+        model = self.model
+        now = datetime.utcnow()
+        removed = model.query.filter(or_(
+            and_(model.status == 'done', model.finished_at < now - timedelta(seconds=self.ttl)),
+            and_(model.status == 'dead', model.finished_at < now - timedelta(seconds=self.dead_ttl))
+        )).delete(synchronize_session=False)
+        self.db.session.commit()
+        return removed
+
+
+class JobWorker:
+    """
+    Claims jobs from a JobQueue and runs them
+
+    handlers maps a job kind to fn(progress, **payload), with input_data=bytes
+    added when the job carries uploaded audio; progress(stage, percent) is
+    written through (at most once a second per stage) and extends the lease.
+    A heartbeat thread keeps the lease alive through long silent stages, and
+    idle workers periodically purge expired jobs. on_settled, if given, is
+    called as fn(job_id, status, payload) once a job is 'done' or 'dead'.
+    """
+
+    def __init__(self, queue, handlers, context=None, poll_interval=2, cleanup_interval=600, on_settled=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.on_settled = on_settled
+        self.context = context or contextlib.nullcontext  # e.g. app.app_context, entered around all queue access
+        self.poll_interval = poll_interval
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0
+        self.stop_event = threading.Event()
+        self._threads = []
+        self._running = {}  # owner -> job id in progress
+        self._lock = threading.Lock()
+
+    def _owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+    def start(self, threads=1):
+        """Start worker threads; returns self"""
+        for i in range(threads):
+            thread = threading.Thread(target=self.run_forever, name=f'analysis-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def run_forever(self):
+        owner = self._owner()
+        while not self.stop_event.is_set():
+            try:
+                with self.context():
+                    ran = self.run_once(owner)
+            except Exception as e:
+                print(f"[WORKER ERROR] {owner}: {e}")
+                ran = False
+            if not ran:
+                self._cleanup()
+                self.stop_event.wait(self.poll_interval)
+
+    def _cleanup(self):
+        if time.time() - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = time.time()
+        try:
+            with self.context():
+                removed = self.queue.cleanup_expired()
+            if removed:
+                print(f"[JOBS] Removed {removed} expired job(s)")
+        except Exception as e:
+            print(f"[JOBS] Cleanup failed: {e}")
+
+    def run_once(self, owner):
+        """Claim and run one job; returns False if there was nothing to do"""
+        job = self.queue.claim(owner)
+        if job is None:
+            return False
+
+        job_id = job.id
+        handler = self.handlers.get(job.kind)
+        payload = json.loads(job.payload)
+        kwargs = dict(payload)
+        if job.input_data is not None:
+            kwargs['input_data'] = job.input_data
+        print(f"[WORKER] {owner} running {job.kind} job {job_id[:12]} (attempt {job.attempts}/{job.max_attempts})")
+
+        last_write = {'stage': None, 'at': 0}
+
+        def progress(stage, percent):
+            now = time.time()
+            if stage == last_write['stage'] and now - last_write['at'] < 1:
+                return
+            last_write.update(stage=stage, at=now)
+            self.queue.heartbeat(job_id, owner, stage, percent)
+
+        with self._lock:
+            self._running[owner] = job_id
+        beating = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, owner, beating),
+                                     name=f'job-heartbeat-{job_id[:8]}', daemon=True)
+        heartbeat.start()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler for job kind {job.kind!r}")
+            result = handler(progress, **kwargs)
+            if self.queue.complete(job_id, owner, result):
+                self._settled(job_id, 'done', payload)
+            else:
+                print(f"[WORKER] Lost the lease on {job_id[:12]}; result discarded")
+        except Exception as e:
+            print(f"[JOB ERROR] {job_id[:12]}: {e}")
+            traceback.print_exc()
+            self.queue.db.session.rollback()
+            outcome = self.queue.fail(job_id, owner, e)
+            if outcome == 'dead':
+                print(f"[JOBS] Job {job_id[:12]} dead-lettered after {job.max_attempts} attempts")
+                self._settled(job_id, 'dead', payload)
+        finally:
+            beating.set()
+            with self._lock:
+                self._running.pop(owner, None)
+        return True
+
+    def _settled(self, job_id, status, payload):
+        if not self.on_settled:
+            return
+        try:
+            self.on_settled(job_id, status, payload)
+        except Exception as e:
+            print(f"[WORKER] Settle hook failed for {job_id[:12]}: {e}")
+            self.queue.db.session.rollback()
+
+    def _heartbeat(self, job_id, owner, stop):
+        interval = max(1, self.queue.lease_seconds / 3)
+        with self.context():
+            while not stop.wait(interval):
+                try:
+                    if not self.queue.heartbeat(job_id, owner):
+                        print(f"[WORKER] Lease on {job_id[:12]} was lost")
+                        return
+                except Exception as e:
+                    print(f"[WORKER] Heartbeat failed for {job_id[:12]}: {e}")
+                    self.queue.db.session.rollback()
+
+    def shutdown(self, grace=30):
+        """Stop claiming, wait up to grace seconds, then hand unfinished jobs back to the queue"""
+        self.stop_event.set()
+        deadline = time.time() + grace
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()))
+        with self._lock:
+            unfinished = dict(self._running)
+        if unfinished:
+            with self.context():
+                for owner, job_id in unfinished.items():
+                    if self.queue.release(job_id, owner):
+                        print(f"[WORKER] Released job {job_id[:12]} back to the queue")
@@ -219,3 +219,84 @@ class AnalysisActivityLog(db.Model):
     
     def __repr__(self):
         return f'<AnalysisActivityLog {self.activity_type}: "{self.song_title}">'
+
+
+class AnalysisJob(db.Model):
+    """Queued analysis job, claimed by workers under a time-limited lease"""
+    id = db.Column(db.String(32), primary_key=True)  # job_id_for(dedup key)
+    kind = db.Column(db.String(20), nullable=False)  # 'youtube', 'upload'
+    payload = db.Column(db.Text, nullable=False)  # JSON kwargs for the job handler
+    input_data = db.Column(db.LargeBinary, nullable=True)  # Uploaded audio, so any node can run the job
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # 'queued', 'running', 'done', 'dead'
+    stage = db.Column(db.String(20), default='queued')
+    percent = db.Column(db.Integer, default=0)
+    result = db.Column(db.Text, nullable=True)  # JSON string
+    error = db.Column(db.Text, nullable=True)
+    
+    # Retry / lease bookkeeping
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Not claimable before this (backoff)
+    lease_owner = db.Column(db.String(200), nullable=True)  # host:pid:thread of the claiming worker
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def get_result(self):
+        """Get result as dict"""
+        return json.loads(self.result) if self.result else None
+    
+    def to_dict(self):
+        """Convert to dictionary for JSON response"""
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'percent': self.percent or 0,
+            'result': self.get_result(),
+            'error': self.error,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'available_at': self.available_at.isoformat() if self.available_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<AnalysisJob {self.id[:12]} [{self.status}]>'
+
+
+class AnalysisBatch(db.Model):
+    """Analyses submitted together; each item is an AnalysisJob, at most max_concurrency run at once"""
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    items = db.Column(db.Text, nullable=False)  # JSON list of {'job_id', 'kind', 'source'} in submission order
+    max_concurrency = db.Column(db.Integer, default=2, nullable=False)
+    quality = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def get_items(self):
+        """Get items as list"""
+        return json.loads(self.items) if self.items else []
+    
+    def job_ids(self):
+        return [item['job_id'] for item in self.get_items()]
+    
+    def to_dict(self):
+        """Convert to dictionary for JSON response"""
+        return {
+            'batch_id': self.id,
+            'items': self.get_items(),
+            'max_concurrency': self.max_concurrency,
+            'quality': self.quality,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
+    def __repr__(self):
+        return f'<AnalysisBatch {self.id[:12]} ({len(self.get_items())} items)>'
@@ -0,0 +1,169 @@
+"""
+Waveform peaks for the player
+Min/max peaks are built from the PCM the analysis already decodes and kept
+as a small multi-resolution binary file per stored audio blob
+"""
+
+import os
+import re
+import struct
+import tempfile
+
+import numpy as np
+
+PEAKS_MAGIC = b'CPK1'
+PEAKS_KEY_PATTERN = re.compile(r'^[0-9a-f]{8,64}$')
+
+
+class PeaksBuilder:
+    """
+    Incremental min/max peaks pyramid
+
+    Samples can be fed in blocks of any size (whole files or streaming
+    decoder output). Level 0 holds one (min, max) pair per samples_per_peak
+    samples; each further level halves the resolution until it has at most
+    min_peaks pairs.
+
+    Binary layout (little-endian):
+        b'CPK1', uint32 sample_rate, uint32 level_count,
+        then per level: uint32 samples_per_peak, uint32 pair_count,
+        then every level's pairs as interleaved int8 (min, max) in [-127, 127]
+    """
+
+    def __init__(self, sample_rate, samples_per_peak=256, min_peaks=64):
+        self.sample_rate = sample_rate
+        self.samples_per_peak = samples_per_peak
+        self.min_peaks = min_peaks
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._mins = []
+        self._maxs = []
+
+    def add(self, samples):
+        """Feed the next block of mono float samples"""
+        samples = np.concatenate([self._carry, np.asarray(samples, dtype=np.float32).ravel()])
+        usable = len(samples) - len(samples) % self.samples_per_peak
+        if usable:
+            frames = samples[:usable].reshape(-1, self.samples_per_peak)
+            self._mins.append(frames.min(axis=1))
+            self._maxs.append(frames.max(axis=1))
+        self._carry = samples[usable:]
+
+    def levels(self):
+        """Return [(samples_per_peak, mins, maxs), ...] from finest to coarsest"""
+        mins = list(self._mins)
+        maxs = list(self._maxs)
+        if len(self._carry):
+            mins.append(self._carry.min(keepdims=True))
+            maxs.append(self._carry.max(keepdims=True))
+        mins = np.concatenate(mins) if mins else np.zeros(0, dtype=np.float32)
+        maxs = np.concatenate(maxs) if maxs else np.zeros(0, dtype=np.float32)
+
+        levels = [(self.samples_per_peak, mins, maxs)]
+        spp = self.samples_per_peak
+        while len(mins) > self.min_peaks:
+            if len(mins) % 2:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = mins.reshape(-1, 2).min(axis=1)
+            maxs = maxs.reshape(-1, 2).max(axis=1)
+            spp *= 2
+            levels.append((spp, mins, maxs))
+        return levels
+
+    def to_bytes(self):
+        """Serialize the pyramid into the compact binary layout"""
+        levels = self.levels()
+        header = [PEAKS_MAGIC, struct.pack('<II', self.sample_rate, len(levels))]
+        body = []
+        for spp, mins, maxs in levels:
+            header.append(struct.pack('<II', spp, len(mins)))
+            pairs = np.empty(len(mins) * 2, dtype=np.int8)
+            pairs[0::2] = np.round(np.clip(mins, -1, 1) * 127)
+            pairs[1::2] = np.round(np.clip(maxs, -1, 1) * 127)
+            body.append(pairs.tobytes())
+        return b''.join(header + body)
+
+
+def compute_peaks(y, sample_rate, samples_per_peak=256):
+    """Peaks pyramid bytes for a whole mono signal"""
+    builder = PeaksBuilder(sample_rate, samples_per_peak=samples_per_peak)
+    builder.add(y)
+    return builder.to_bytes()
+
+
+class PeaksStore:
+    """
+    Peaks files on disk keyed by the audio blob's content key
+
+    Bounded by max_bytes: the least recently read files (by mtime, which get()
+    bumps) are removed after each write. Peaks can always be recomputed from
+    the audio blob.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 ** 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        if not PEAKS_KEY_PATTERN.match(key or ''):
+            raise ValueError(f"Invalid peaks key: {key!r}")
+        return os.path.join(self.directory, f"{key}.peaks")
+
+    def get(self, key):
+        """Return the stored peaks bytes for a key, or None"""
+        try:
+            path = self._path(key)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def set(self, key, data):
+        """Store peaks bytes atomically"""
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[PEAKS ERROR] Could not store peaks {key[:12]}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used peaks files until the store fits max_bytes"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.peaks'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+
+        used = sum(size for _, _, size in files)
+        for _, path, size in sorted(files):
+            if used <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            used -= size
+
+    def __contains__(self, key):
+        try:
+            return os.path.exists(self._path(key))
+        except ValueError:
+            return False
@@ -0,0 +1,165 @@
+"""
+Analysis quality tiers and load-adaptive tier selection
+Each tier is a bundle of pipeline settings. Clients pick fast, balanced or
+accurate; under load the governor steps down the ladder from there to
+cheaper tiers and climbs back once load has stayed low
+"""
+
+import threading
+import time
+
+# Best first. 'balanced' is the pipeline's long-standing configuration. All
+# tiers keep ~4.6 s chord segments so results stay comparable; see the README
+# for the cost model and benchmark_quality.py for measured costs. 'cost' is
+# the expected processing time relative to balanced, used to normalize the
+# latency samples the governor sees.
+QUALITY_TIERS = {
+    'accurate': {
+        'sample_rate': 22050,
+        'hop_length': 512,  # must be a multiple of 64 for chroma_cqt
+        'n_fft': 4096,
+        'chroma': 'cqt',  # constant-Q chroma: sharper pitch classes, several times the cost of STFT
+        'segment_frames': 200,
+        'whisper_model': 'base',
+        'whisper_window': None,
+        'genius_tag_lookup': False,
+        'cost': 3.0,
+    },
+    'balanced': {
+        'sample_rate': 11025,
+        'hop_length': 1024,
+        'n_fft': 2048,
+        'chroma': 'stft',
+        'segment_frames': 50,
+        'whisper_model': 'tiny',
+        'whisper_window': None,  # seconds of audio transcribed (None = all)
+        'genius_tag_lookup': False,  # without a client-given title, look the file's tags up on Genius before Whisper
+        'cost': 1.0,
+    },
+    'fast': {
+        'sample_rate': 8000,
+        'hop_length': 2048,
+        'n_fft': 2048,
+        'chroma': 'stft',
+        'segment_frames': 18,
+        'whisper_model': 'tiny',
+        'whisper_window': 120,
+        'genius_tag_lookup': True,
+        'cost': 0.5,
+    },
+    # Not offered to clients; only reached when the server is overloaded
+    'minimal': {
+        'sample_rate': 8000,
+        'hop_length': 4096,
+        'n_fft': 4096,
+        'chroma': 'stft',
+        'segment_frames': 9,
+        'whisper_model': 'tiny',
+        'whisper_window': 45,
+        'genius_tag_lookup': True,
+        'cost': 0.25,
+    },
+}
+QUALITY_LADDER = ['accurate', 'balanced', 'fast', 'minimal']
+USER_TIERS = ('fast', 'balanced', 'accurate')
+DEFAULT_TIER = 'balanced'
+
+
+def quality_tier(name):
+    """Settings for a tier name (with 'name' filled in); unknown names get the default tier"""
+    name = name if name in QUALITY_TIERS else DEFAULT_TIER
+    return dict(QUALITY_TIERS[name], name=name)
+
+
+def tier_rank(name):
+    """Position on the ladder (0 = best); unknown or missing names rank as the default tier"""
+    return QUALITY_LADDER.index(name if name in QUALITY_TIERS else DEFAULT_TIER)
+
+
+class QualityGovernor:
+    """
+    Picks the quality tier for an analysis from live load signals
+
+    Pressure is the larger of queue depth / queue_step and recent analysis
+    latency (seconds per minute of audio, scaled to the balanced tier by each
+    tier's 'cost') / target_latency; each whole unit
+    of pressure is one step down the ladder from the tier the client asked
+    for. Degrading is immediate, while recovering happens one step at a time,
+    only after cooldown seconds and with some margin so the tier doesn't flap. Latency samples older than
+    latency_window no longer count, so an idle server returns to full quality.
+    """
+
+    def __init__(self, ladder=None, queue_step=4, target_latency=10.0, cooldown=60,
+                 latency_window=120, pinned=None):
+        self.ladder = list(ladder or QUALITY_LADDER)
+        self.queue_step = queue_step
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.latency_window = latency_window
+        self.pinned = pinned if pinned in self.ladder else None
+        self.level = 0
+        self.changed_at = 0
+        self.latency = None  # moving average, seconds per minute of audio
+        self.observed_at = 0
+        self.last_depth = None
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed, audio_seconds, tier=None):
+        """Record how long an analysis of audio_seconds of audio took at tier (settings dict)"""
+        per_minute = elapsed / max(audio_seconds / 60.0, 0.5)
+        # An accurate analysis is slow by design, not a sign of load
+        per_minute /= (tier or {}).get('cost') or 1.0
+        with self._lock:
+            fresh = self.latency is not None and time.time() - self.observed_at < self.latency_window
+            self.latency = 0.7 * self.latency + 0.3 * per_minute if fresh else per_minute
+            self.observed_at = time.time()
+
+    def pressure(self, depth=None):
+        """Current load in tier steps (0 = no pressure)"""
+        pressure = 0.0
+        if depth is not None:
+            pressure = depth / float(self.queue_step)
+        if self.latency is not None and time.time() - self.observed_at < self.latency_window:
+            pressure = max(pressure, self.latency / self.target_latency)
+        return pressure
+
+    def choose(self, depth=None, requested=None):
+        """
+        Tier settings for an analysis starting now
+
+        Args:
+            depth: Requests or jobs currently waiting, if known
+            requested: Tier the client asked for (default: DEFAULT_TIER)
+
+        Returns:
+            Settings dict from quality_tier(), including 'name'
+        """
+        if self.pinned:
+            return quality_tier(self.pinned)
+        start = tier_rank(requested)
+
+        with self._lock:
+            if depth is not None:
+                self.last_depth = depth
+            pressure = self.pressure(self.last_depth)
+            wanted = min(len(self.ladder) - 1, int(pressure))
+            now = time.time()
+            if wanted > self.level:
+                print(f"[QUALITY] Load {pressure:.1f}: degrading {wanted} step(s)")
+                self.level, self.changed_at = wanted, now
+            elif (wanted < self.level and now - self.changed_at >= self.cooldown
+                  and pressure < self.level - 0.25):
+                print(f"[QUALITY] Load {pressure:.1f}: recovering to {self.level - 1} step(s) down")
+                self.level, self.changed_at = self.level - 1, now
+            return quality_tier(self.ladder[min(len(self.ladder) - 1, start + self.level)])
+
+    def status(self):
+        """Snapshot for /health"""
+        return {
+            'pinned': self.pinned,
+            'steps_down': 0 if self.pinned else self.level,
+            'default_tier': self.pinned or self.ladder[min(len(self.ladder) - 1, tier_rank(DEFAULT_TIER) + self.level)],
+            'pressure': round(self.pressure(self.last_depth), 2),
+            'queue_depth': self.last_depth,
+            'seconds_per_audio_minute': round(self.latency, 2) if self.latency is not None else None,
+        }
@@ -0,0 +1,270 @@
+"""
+Caching proxy for remote audio streams
+Byte ranges fetched from upstream are kept in a sparse file per stream with
+a range map beside it, so repeated and overlapping requests are served
+locally and only the gaps go upstream over a pooled session
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from downloader import DEFAULT_HEADERS
+
+
+def stream_cache_key(url):
+    """
+    Stable cache key for a stream URL
+
+    Signed googlevideo URLs change on every extraction, but id + itag name
+    the same bytes, so the cache survives stream URL refreshes. Only trusted
+    for googlevideo hosts: anything else is keyed by its full URL, so an
+    arbitrary server can't fill the cache entry of a real stream.
+    """
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    host = (parsed.hostname or '').lower()
+    if parsed.scheme == 'https' and host.endswith('.googlevideo.com') and query.get('id') and query.get('itag'):
+        basis = f"{query['id'][0]}:{query['itag'][0]}:{query.get('clen', [''])[0]}"
+    else:
+        basis = url
+    return hashlib.sha1(basis.encode()).hexdigest()
+
+
+def merge_ranges(ranges):
+    """Merge half-open [start, end) ranges into a sorted, non-overlapping list"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class SparseRangeCache:
+    """
+    On-disk cache of fetched byte ranges, one sparse data file per stream
+
+    {key}.data holds bytes at their real offsets; {key}.json records which
+    [start, end) ranges are present plus the total size and content type.
+    Whole streams are evicted least-recently-used first past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.data', base + '.json'
+
+    def load(self, key):
+        """Return the stream's descriptor (ranges, total, content_type), empty if unknown"""
+        _, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'ranges': [], 'total': None, 'content_type': None}
+
+    def _save(self, key, meta):
+        _, meta_path = self._paths(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def update(self, key, start=None, end=None, total=None, content_type=None):
+        """Record a newly written range and/or stream facts"""
+        with self._lock:
+            meta = self.load(key)
+            is_new = not meta['ranges']
+            if start is not None and end > start:
+                meta['ranges'] = merge_ranges(meta['ranges'] + [[start, end]])
+            if total is not None:
+                meta['total'] = total
+            if content_type:
+                meta['content_type'] = content_type
+            meta['accessed_at'] = time.time()
+            self._save(key, meta)
+        if is_new:
+            self._evict()
+        return meta
+
+    def segments(self, key, start, end):
+        """Split [start, end) into ('cache', s, e) and ('fetch', s, e) pieces in order"""
+        pieces = []
+        position = start
+        for cached_start, cached_end in self.load(key)['ranges']:
+            if cached_end <= position or position >= end:
+                continue
+            if cached_start > position:
+                gap_end = min(cached_start, end)
+                pieces.append(('fetch', position, gap_end))
+                position = gap_end
+            if position < end:
+                hit_end = min(cached_end, end)
+                pieces.append(('cache', position, hit_end))
+                position = hit_end
+        if position < end:
+            pieces.append(('fetch', position, end))
+        return pieces
+
+    def write(self, key, offset, data):
+        """Write bytes at their offset in the stream's sparse data file"""
+        data_path, _ = self._paths(key)
+        # Never truncate: another process may be filling other ranges of the same file
+        with os.fdopen(os.open(data_path, os.O_CREAT | os.O_RDWR, 0o644), 'r+b') as f:
+            f.seek(offset)
+            f.write(data)
+
+    def read(self, key, start, end, block_size=256 * 1024):
+        """Yield cached bytes in [start, end)"""
+        data_path, _ = self._paths(key)
+        with open(data_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = f.read(min(block_size, remaining))
+                if not data:
+                    raise IOError("Cached range is shorter than recorded")
+                remaining -= len(data)
+                yield data
+
+    def _evict(self):
+        """Drop least recently used streams until the cache fits max_bytes"""
+        streams = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            meta = self.load(key)
+            cached = sum(end - start for start, end in meta['ranges'])
+            streams.append((meta.get('accessed_at', 0), key, cached))
+
+        used = sum(cached for _, _, cached in streams)
+        for _, key, cached in sorted(streams):
+            if used <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            used -= cached
+            print(f"[PROXY CACHE] Evicted stream {key[:12]}")
+
+
+class CachingStreamProxy:
+    """
+    Range-aware proxy that fills gaps in the sparse cache from upstream
+
+    Open-ended requests are answered with at most max_response_bytes so a
+    sync worker is released quickly; media elements simply ask for the next
+    range. Upstream chunk sizes grow while a transfer keeps going.
+    """
+
+    def __init__(self, cache, max_connections=16, max_response_bytes=4 * 1024 * 1024,
+                 min_chunk=64 * 1024, max_chunk=1024 * 1024, timeout=15):
+        self.cache = cache
+        self.max_response_bytes = max_response_bytes
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _probe(self, key, url, headers):
+        """Learn total size and content type with a 1-byte upstream request"""
+        with self.session.get(url, headers=dict(headers, Range='bytes=0-0'), stream=True,
+                              timeout=self.timeout) as response:
+            response.raise_for_status()
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rsplit('/', 1)[1] if '/' in content_range else response.headers.get('Content-Length')
+            if not total or not total.isdigit():
+                raise IOError("Upstream did not report a size")
+            return self.cache.update(key, total=int(total),
+                                     content_type=response.headers.get('Content-Type'))
+
+    def open(self, url, byte_range=None, headers=None):
+        """
+        Resolve a client range against the stream
+
+        Args:
+            url: Upstream stream URL
+            byte_range: (start, stop) from the client's Range header as werkzeug parses it
+                (stop exclusive or None; negative start for suffix ranges), or None
+            headers: Extra upstream request headers
+
+        Returns:
+            Tuple of (start, end_exclusive, total, content_type, body_iterator)
+        """
+        headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        key = stream_cache_key(url)
+        meta = self.cache.load(key)
+        if not meta.get('total'):
+            meta = self._probe(key, url, headers)
+        total = meta['total']
+
+        # Clients that don't send Range get the whole stream
+        start, end = byte_range if byte_range else (0, total)
+        if start < 0:
+            start, end = max(0, total + start), total
+        if start >= total:
+            raise ValueError("Range not satisfiable")
+        end = min(total, end if end is not None else start + self.max_response_bytes)
+
+        return start, end, total, meta.get('content_type') or 'audio/mp4', self._body(key, url, headers, start, end)
+
+    def _body(self, key, url, headers, start, end):
+        """Yield [start, end) from the cache, fetching each missing gap from upstream"""
+        for kind, piece_start, piece_end in self.cache.segments(key, start, end):
+            if kind == 'cache':
+                yield from self.cache.read(key, piece_start, piece_end)
+            else:
+                yield from self._fetch(key, url, headers, piece_start, piece_end)
+        self.cache.update(key)
+
+    def _fetch(self, key, url, headers, start, end):
+        """Stream [start, end) from upstream into the cache and to the client"""
+        written = start
+        chunk_size = self.min_chunk
+        try:
+            with self.session.get(url, headers=dict(headers, Range=f'bytes={start}-{end - 1}'),
+                                  stream=True, timeout=self.timeout) as response:
+                if response.status_code != 206:
+                    raise IOError(f"Upstream returned {response.status_code} for a range request")
+                pending, pending_size = [], 0
+                for chunk in response.iter_content(chunk_size=self.min_chunk):
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    if pending_size < chunk_size and written + pending_size < end:
+                        continue
+                    data = b''.join(pending)
+                    self.cache.write(key, written, data)
+                    written += len(data)
+                    yield data
+                    pending, pending_size = [], 0
+                    # Bigger writes/yields as the transfer proves steady
+                    chunk_size = min(chunk_size * 2, self.max_chunk)
+                if pending:
+                    data = b''.join(pending)
+                    self.cache.write(key, written, data)
+                    written += len(data)
+                    yield data
+        finally:
+            # Record whatever arrived, even if the client went away mid-range
+            if written > start:
+                self.cache.update(key, start, written)
@@ -0,0 +1,203 @@
+"""
+Resumable chunked uploads
+Each session is a staging file plus a small JSON descriptor on disk, so any
+worker process can accept the next chunk of an upload another one started
+"""
+
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import time
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    """Raised for invalid upload session operations (maps to HTTP 4xx)"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadSessionStore:
+    """
+    Disk-backed store of resumable upload sessions
+
+    Chunk N of a session is written at offset N * chunk_size of the staging
+    file, so retries are idempotent and chunks may arrive in any order.
+    A marker file per received chunk records progress without a shared
+    read-modify-write of the descriptor.
+    """
+
+    def __init__(self, directory, chunk_size=5 * 1024 * 1024, max_bytes=None, ttl=24 * 3600):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+            raise UploadError("Invalid upload id", 404)
+        base = os.path.join(self.directory, upload_id)
+        return base + '.json', base + '.part', base + '.chunks'
+
+    def create(self, filename, size=None, expected_hash=None, song_info=None):
+        """Start a new upload session and return its descriptor"""
+        self.cleanup_expired()
+
+        if size is not None:
+            size = int(size)
+            if size <= 0:
+                raise UploadError("size must be positive")
+            if self.max_bytes and size > self.max_bytes:
+                raise UploadError(f"File too large. Maximum upload size is {self.max_bytes // (1024 * 1024)} MB.", 413)
+
+        upload_id = secrets.token_hex(16)
+        meta_path, part_path, chunks_dir = self._paths(upload_id)
+        session = {
+            'upload_id': upload_id,
+            'filename': os.path.basename(filename or 'upload'),
+            'ext': os.path.splitext(filename or '')[1].lower() or '.wav',
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': -(-size // self.chunk_size) if size else None,
+            'expected_hash': (expected_hash or '').lower() or None,
+            'song_info': song_info,
+            'created_at': time.time(),
+        }
+
+        os.makedirs(chunks_dir)
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        return session
+
+    def get(self, upload_id):
+        """Return a session descriptor with the list of received chunks"""
+        meta_path, _, chunks_dir = self._paths(upload_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError("Upload session not found", 404)
+
+        session['received'] = self._received(chunks_dir)
+        return session
+
+    def _received(self, chunks_dir):
+        try:
+            return sorted(int(name) for name in os.listdir(chunks_dir) if name.isdigit())
+        except OSError:
+            return []
+
+    def write_chunk(self, upload_id, index, data):
+        """Write one chunk into the staging file at its fixed offset"""
+        session = self.get(upload_id)
+        _, part_path, chunks_dir = self._paths(upload_id)
+        chunk_size = session['chunk_size']
+        total_chunks = session['total_chunks']
+
+        if index < 0 or (total_chunks is not None and index >= total_chunks):
+            raise UploadError(f"Chunk index {index} out of range")
+        if not data:
+            raise UploadError("Empty chunk")
+        if len(data) > chunk_size:
+            raise UploadError(f"Chunk larger than chunk_size ({chunk_size} bytes)")
+        if total_chunks is not None and index < total_chunks - 1 and len(data) != chunk_size:
+            raise UploadError(f"Only the last chunk may be shorter than chunk_size ({chunk_size} bytes)")
+
+        end = index * chunk_size + len(data)
+        if self.max_bytes and end > self.max_bytes:
+            raise UploadError(f"File too large. Maximum upload size is {self.max_bytes // (1024 * 1024)} MB.", 413)
+        if session['size'] is not None and end > session['size']:
+            raise UploadError("Chunk extends past the declared file size")
+
+        with open(part_path, 'r+b') as f:
+            f.seek(index * chunk_size)
+            f.write(data)
+
+        with open(os.path.join(chunks_dir, str(index)), 'w') as f:
+            f.write(str(len(data)))
+
+        session['received'] = self._received(chunks_dir)
+        return session
+
+    def finalize(self, upload_id):
+        """
+        Verify a session is complete and hash the staged file
+
+        Returns:
+            Tuple of (session, staging_path, sha256_hex)
+        """
+        session = self.get(upload_id)
+        _, part_path, chunks_dir = self._paths(upload_id)
+        received = session['received']
+        chunk_size = session['chunk_size']
+
+        if not received:
+            raise UploadError("No chunks received")
+
+        # Without a declared size the highest received chunk marks the end
+        total_chunks = session['total_chunks'] or (received[-1] + 1)
+        missing = sorted(set(range(total_chunks)) - set(received))
+        if missing:
+            raise UploadError(f"Missing chunks: {missing[:20]}", 409)
+
+        # A short chunk before the last would leave a zero-filled hole in the file
+        lengths = []
+        for index in range(total_chunks):
+            with open(os.path.join(chunks_dir, str(index))) as f:
+                lengths.append(int(f.read() or 0))
+        short = [index for index, length in enumerate(lengths[:-1]) if length != chunk_size]
+        if short:
+            raise UploadError(f"Chunks shorter than chunk_size: {short[:20]}", 409)
+        total_size = (total_chunks - 1) * chunk_size + lengths[-1]
+        if session['size'] is not None and total_size != session['size']:
+            raise UploadError(f"Received {total_size} bytes, expected {session['size']}", 409)
+
+        with open(part_path, 'r+b') as f:
+            f.truncate(total_size)
+
+        sha256 = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(block)
+        content_hash = sha256.hexdigest()
+
+        if session['expected_hash'] and session['expected_hash'] != content_hash:
+            raise UploadError("Uploaded content does not match the declared hash", 409)
+
+        return session, part_path, content_hash
+
+    def discard(self, upload_id):
+        """Remove a session's descriptor, staging file and chunk markers"""
+        meta_path, part_path, chunks_dir = self._paths(upload_id)
+        for path in (meta_path, part_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        shutil.rmtree(chunks_dir, ignore_errors=True)
+
+    def cleanup_expired(self):
+        """Drop sessions older than the TTL"""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    self.discard(name[:-5])
+            except (OSError, UploadError):
+                pass
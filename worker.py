@@ -0,0 +1,42 @@
+"""
+Standalone analysis worker
+Pulls jobs from the shared SQL job queue (see jobs.py); run any number of
+these on any node that can reach DATABASE_URL: python worker.py
+"""
+
+import os
+import signal
+import threading
+
+# This process is the worker pool; the app module must not start its own threads too
+os.environ['ANALYSIS_WORKERS'] = '0'
+
+from api import app, analysis_jobs, JOB_HANDLERS, on_job_settled
+from jobs import JobWorker
+
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', 1))
+# Seconds a stopping worker waits for running jobs before handing them back to the queue
+WORKER_SHUTDOWN_GRACE = int(os.getenv('WORKER_SHUTDOWN_GRACE', 30))
+
+
+def main():
+    worker = JobWorker(analysis_jobs, JOB_HANDLERS, context=app.app_context, on_settled=on_job_settled)
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"[WORKER] Received signal {signum}, finishing up")
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    worker.start(WORKER_THREADS)
+    print(f"[WORKER] Started {WORKER_THREADS} worker thread(s) on pid {os.getpid()}")
+    while not stopping.wait(1):
+        pass
+    worker.shutdown(grace=WORKER_SHUTDOWN_GRACE)
+    print("[WORKER] Stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,645 @@
+"""
+YouTube helpers
+Warm YoutubeDL instance pool plus a metadata cache for yt-dlp extraction,
+keyed by canonical video id and expired according to the signed stream URL
+it holds
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+
+import yt_dlp
+
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes are only deduplicated per process
+    fcntl = None
+
+VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+PLAYLIST_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{12,64}$')
+STREAM_ID_PATTERN = re.compile(r'^[0-9a-f]{24}$')
+
+# Options used for metadata-only extraction (no download)
+METADATA_OPTS = {
+    'format': 'bestaudio[ext=m4a]/bestaudio/best',
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': True,
+    'extract_flat': False,
+}
+
+# Options used for ytsearch queries
+SEARCH_OPTS = dict(METADATA_OPTS, default_search='ytsearch1:')
+
+# Options used for downloads; outtmpl is set per checkout
+DOWNLOAD_OPTS = {
+    'format': 'bestaudio[ext=m4a]/bestaudio/best',
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': True,
+}
+
+# Options used to list a playlist: flat extraction returns id/title per entry
+# without fetching each video's metadata
+PLAYLIST_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': False,
+    'extract_flat': 'in_playlist',
+}
+
+# Option profiles served by the instance pool, with the extractors to warm up
+YDL_PROFILES = {
+    'metadata': (METADATA_OPTS, ['Youtube']),
+    'search': (SEARCH_OPTS, ['YoutubeSearch', 'Youtube']),
+    'download': (DOWNLOAD_OPTS, ['Youtube']),
+    'playlist': (PLAYLIST_OPTS, ['YoutubeTab']),
+}
+
+# Placeholder titles of playlist entries that cannot be played
+UNAVAILABLE_TITLES = {'[Private video]', '[Deleted video]'}
+
+
+def video_id_from_url(url):
+    """Return the 11-character video id of a YouTube URL, or None"""
+    if not url:
+        return None
+    if VIDEO_ID_PATTERN.match(url):
+        return url
+
+    parsed = urlparse(url if '://' in url else f"https://{url}")
+    host = (parsed.hostname or '').lower()
+    path_parts = [p for p in parsed.path.split('/') if p]
+
+    if host.endswith('youtu.be') and path_parts:
+        candidate = path_parts[0]
+    elif 'youtube' in host:
+        candidate = parse_qs(parsed.query).get('v', [None])[0]
+        if not candidate and len(path_parts) >= 2 and path_parts[0] in ('shorts', 'embed', 'live', 'v'):
+            candidate = path_parts[1]
+    else:
+        return None
+
+    return candidate if candidate and VIDEO_ID_PATTERN.match(candidate) else None
+
+
+def playlist_id_from_url(url):
+    """Return the playlist id (list= parameter) of a YouTube URL, or None"""
+    if not url:
+        return None
+    if PLAYLIST_ID_PATTERN.match(url) and not VIDEO_ID_PATTERN.match(url):
+        return url
+
+    parsed = urlparse(url if '://' in url else f"https://{url}")
+    host = (parsed.hostname or '').lower()
+    if 'youtube' not in host and not host.endswith('youtu.be'):
+        return None
+    candidate = parse_qs(parsed.query).get('list', [None])[0]
+    return candidate if candidate and PLAYLIST_ID_PATTERN.match(candidate) else None
+
+
+def playlist_entries(info):
+    """Reduce a flat playlist extraction to playable entries: video_id, title, url, duration"""
+    entries = []
+    for entry in (info or {}).get('entries') or []:
+        video_id = entry.get('id') if entry else None
+        if not video_id or not VIDEO_ID_PATTERN.match(video_id) or entry.get('title') in UNAVAILABLE_TITLES:
+            continue
+        entries.append({
+            'video_id': video_id,
+            'title': entry.get('title') or '',
+            'url': f"https://www.youtube.com/watch?v={video_id}",
+            'duration': entry.get('duration'),
+        })
+    return entries
+
+
+def stream_url_expiry(stream_url):
+    """Return the unix expiry time embedded in a googlevideo stream URL, or None"""
+    if not stream_url:
+        return None
+
+    parsed = urlparse(stream_url)
+    expire = parse_qs(parsed.query).get('expire', [None])[0]
+    if not expire:
+        # Manifest-style URLs carry parameters as path segments: /expire/<ts>/
+        match = re.search(r'/expire/(\d+)', parsed.path)
+        expire = match.group(1) if match else None
+
+    try:
+        return int(expire) if expire else None
+    except ValueError:
+        return None
+
+
+def metadata_from_info(info):
+    """Reduce a yt-dlp info dict to the fields the app uses"""
+    return {
+        'video_id': info.get('id'),
+        'title': info.get('title', ''),
+        'uploader': info.get('uploader', ''),
+        'thumbnail': info.get('thumbnail', ''),
+        'duration': info.get('duration') or 0,
+        'stream_url': info.get('url'),
+        'ext': info.get('ext') or 'm4a',
+        'http_headers': info.get('http_headers') or {},
+        'webpage_url': info.get('webpage_url') or (f"https://www.youtube.com/watch?v={info['id']}" if info.get('id') else None),
+    }
+
+
+def extract_info(target, ydl_opts=None):
+    """Run a yt-dlp metadata extraction without downloading"""
+    with yt_dlp.YoutubeDL(ydl_opts or METADATA_OPTS) as ydl:
+        return ydl.extract_info(target, download=False)
+
+
+class YoutubeDLPool:
+    """
+    Pool of pre-initialized YoutubeDL objects per option profile
+
+    A YoutubeDL instance is not thread-safe, so each request checks one out
+    exclusively. Instances that raised are closed and replaced, as are
+    instances that have served max_uses requests. When a profile's pool is
+    exhausted an extra short-lived instance is created rather than blocking.
+    """
+
+    def __init__(self, profiles=None, size=2, max_uses=200):
+        self.profiles = profiles or YDL_PROFILES
+        self.size = size
+        self.max_uses = max_uses
+        self._idle = {name: queue.LifoQueue() for name in self.profiles}
+        self._pooled = {name: 0 for name in self.profiles}
+        self._uses = {}
+        self._lock = threading.Lock()
+
+    def _create(self, profile):
+        opts, extractors = self.profiles[profile]
+        ydl = yt_dlp.YoutubeDL(dict(opts))
+        for ie_key in extractors:
+            try:
+                ydl.get_info_extractor(ie_key)  # instantiates and caches the extractor
+            except Exception as e:
+                print(f"[YTDLP POOL] Could not warm {ie_key}: {e}")
+        with self._lock:
+            self._uses[id(ydl)] = 0
+        return ydl
+
+    def _close(self, ydl):
+        with self._lock:
+            self._uses.pop(id(ydl), None)
+        try:
+            ydl.close()
+        except Exception:
+            pass
+
+    def warm(self):
+        """Fill every profile up to the pool size"""
+        for profile in self.profiles:
+            while True:
+                with self._lock:
+                    if self._pooled[profile] >= self.size:
+                        break
+                    self._pooled[profile] += 1
+                try:
+                    self._idle[profile].put(self._create(profile))
+                except Exception as e:
+                    with self._lock:
+                        self._pooled[profile] -= 1
+                    print(f"[YTDLP POOL] Warm-up failed for '{profile}': {e}")
+                    break
+
+    def _acquire(self, profile):
+        try:
+            return self._idle[profile].get_nowait(), True
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            pooled = self._pooled[profile] < self.size
+            if pooled:
+                self._pooled[profile] += 1
+        try:
+            return self._create(profile), pooled
+        except Exception:
+            if pooled:
+                with self._lock:
+                    self._pooled[profile] -= 1
+            raise
+
+    def _release(self, profile, ydl, pooled, healthy):
+        with self._lock:
+            uses = self._uses[id(ydl)] = self._uses.get(id(ydl), 0) + 1
+
+        if pooled and healthy and uses < self.max_uses:
+            self._idle[profile].put(ydl)
+            return
+
+        self._close(ydl)
+        if pooled:
+            with self._lock:
+                self._pooled[profile] -= 1
+
+    @contextmanager
+    def checkout(self, profile, outtmpl=None, **params):
+        """
+        Borrow a YoutubeDL for the given profile; it is returned (or recycled) on exit
+        outtmpl and any other params apply to this checkout only and are reset on return.
+        """
+        ydl, pooled = self._acquire(profile)
+        if outtmpl:
+            params['outtmpl'] = {'default': outtmpl}
+        missing = object()
+        saved = {name: ydl.params.get(name, missing) for name in params}
+        ydl.params.update(params)
+
+        healthy = True
+        try:
+            yield ydl
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            for name, value in saved.items():
+                if value is missing:
+                    ydl.params.pop(name, None)
+                else:
+                    ydl.params[name] = value
+            self._release(profile, ydl, pooled, healthy)
+
+    def extract_info(self, target):
+        """Metadata extraction using a pooled instance (search queries use the search profile)"""
+        profile = 'search' if target.startswith('ytsearch') else 'metadata'
+        with self.checkout(profile) as ydl:
+            return ydl.extract_info(target, download=False)
+
+    def extract_playlist(self, playlist_id, limit=None):
+        """
+        Flat-extract a playlist (entries carry ids and titles only)
+
+        Returns:
+            Tuple of (playlist title, entries from playlist_entries())
+        """
+        with self.checkout('playlist', playlistend=limit) as ydl:
+            info = ydl.extract_info(f"https://www.youtube.com/playlist?list={playlist_id}", download=False)
+        return (info or {}).get('title') or '', playlist_entries(info)
+
+    def stats(self):
+        """Pool occupancy per profile"""
+        return {name: {'pooled': self._pooled[name], 'idle': self._idle[name].qsize()}
+                for name in self.profiles}
+
+
+class _Pending:
+    """An extraction in progress that other callers for the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class YouTubeMetadataCache:
+    """
+    In-process cache of yt-dlp metadata
+
+    Entries live until shortly before the signed stream URL they contain
+    expires. Concurrent misses for the same video id share one extraction.
+    """
+
+    def __init__(self, extractor=extract_info, default_ttl=3600, expiry_margin=300,
+                 search_ttl=6 * 3600, max_entries=1024):
+        self.extractor = extractor
+        self.default_ttl = default_ttl
+        self.expiry_margin = expiry_margin
+        self.search_ttl = search_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # video_id -> metadata (with expires_at)
+        self._searches = OrderedDict()  # normalized query -> (video_id, expires_at)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expires_at(self, metadata):
+        expire = stream_url_expiry(metadata.get('stream_url'))
+        if expire:
+            return expire - self.expiry_margin
+        return time.time() + self.default_ttl
+
+    def _lookup(self, video_id):
+        entry = self._entries.get(video_id)
+        if entry and entry['expires_at'] > time.time():
+            self._entries.move_to_end(video_id)
+            return entry
+        if entry:
+            del self._entries[video_id]
+        return None
+
+    def _store(self, metadata):
+        metadata = dict(metadata, expires_at=self._expires_at(metadata))
+        with self._lock:
+            self._entries[metadata['video_id']] = metadata
+            self._entries.move_to_end(metadata['video_id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return metadata
+
+    def _coalesced(self, key, compute):
+        """Run compute() once per key; concurrent callers wait for the same result"""
+        with self._lock:
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = _Pending()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = compute()
+            return pending.value
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.done.set()
+
+    def get(self, url):
+        """Return metadata for a video URL, extracting it only on a cache miss"""
+        video_id = video_id_from_url(url)
+
+        if video_id:
+            with self._lock:
+                entry = self._lookup(video_id)
+            if entry:
+                self.hits += 1
+                return dict(entry)
+
+        self.misses += 1
+        key = video_id or url
+
+        def compute():
+            info = self.extractor(f"https://www.youtube.com/watch?v={video_id}" if video_id else url)
+            if not info:
+                raise ValueError("Could not extract video info")
+            if info.get('entries'):
+                info = info['entries'][0]
+            return self._store(metadata_from_info(info))
+
+        return dict(self._coalesced(key, compute))
+
+    def search(self, query):
+        """Return metadata for the first YouTube search result of a query"""
+        normalized = ' '.join(query.lower().split())
+
+        with self._lock:
+            hit = self._searches.get(normalized)
+            if hit and hit[1] > time.time():
+                entry = self._lookup(hit[0])
+                if entry:
+                    self.hits += 1
+                    return dict(entry)
+
+        self.misses += 1
+
+        def compute():
+            # Query mapped to a known video whose stream URL lapsed: refresh by id
+            if hit and hit[1] > time.time():
+                return self.get(hit[0])
+
+            result = self.extractor(f"ytsearch1:{query}")
+            entries = (result or {}).get('entries') or []
+            if not entries:
+                raise LookupError(f"No YouTube results for: {query}")
+            metadata = self._store(metadata_from_info(entries[0]))
+
+            with self._lock:
+                self._searches[normalized] = (metadata['video_id'], time.time() + self.search_ttl)
+                while len(self._searches) > self.max_entries:
+                    self._searches.popitem(last=False)
+            return metadata
+
+        return dict(self._coalesced(f"search:{normalized}", compute))
+
+    def invalidate(self, url):
+        """Forget a video (e.g. after its stream URL was rejected upstream)"""
+        video_id = video_id_from_url(url)
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+    def stats(self):
+        """Cache counters for health/debug output"""
+        with self._lock:
+            return {'entries': len(self._entries), 'searches': len(self._searches),
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class StreamURLManager:
+    """
+    Opaque, stable stream ids for YouTube audio with background URL refresh
+
+    Each id maps to a small JSON record on disk (video id, current signed
+    stream URL, headers, expiry) so every worker and the gateway can resolve
+    it. Records used within active_window are re-extracted refresh_margin
+    seconds before their URL expires; resolve() also refreshes on demand.
+    Every process may run the refresher: a refresh holds a per-stream file
+    lock and reuses a URL another process fetched meanwhile, and only one
+    process at a time sweeps the directory.
+    """
+
+    def __init__(self, metadata_cache, directory, secret, refresh_margin=900,
+                 active_window=6 * 3600, retention=24 * 3600, check_interval=60):
+        self.metadata_cache = metadata_cache
+        self.directory = directory
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.refresh_margin = refresh_margin
+        self.active_window = active_window
+        self.retention = retention
+        self.check_interval = check_interval
+        self._refreshing = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def stream_id(self, video_id):
+        """Stable opaque id for a video (doesn't reveal the video id or URL)"""
+        return hmac.new(self.secret, video_id.encode(), hashlib.sha256).hexdigest()[:24]
+
+    def _paths(self, stream_id):
+        if not STREAM_ID_PATTERN.match(stream_id or ''):
+            raise ValueError("Invalid stream id")
+        base = os.path.join(self.directory, stream_id)
+        return base + '.json', base + '.seen'
+
+    @contextmanager
+    def _file_lock(self, name, blocking=True):
+        """Exclusive flock on {directory}/{name}.lock; yields False if not blocking and it is taken"""
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.directory, f"{name}.lock"), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self, record):
+        record_path, _ = self._paths(record['stream_id'])
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, record_path)
+
+    def _record(self, stream_id, metadata):
+        return {
+            'stream_id': stream_id,
+            'video_id': metadata['video_id'],
+            'webpage_url': metadata.get('webpage_url') or f"https://www.youtube.com/watch?v={metadata['video_id']}",
+            'stream_url': metadata['stream_url'],
+            'http_headers': metadata.get('http_headers') or {},
+            'ext': metadata.get('ext') or 'm4a',
+            'expires_at': stream_url_expiry(metadata['stream_url']) or metadata.get('expires_at') or 0,
+        }
+
+    def register(self, metadata):
+        """Record the current stream URL for a video and return its stream id"""
+        stream_id = self.stream_id(metadata['video_id'])
+        self._save(self._record(stream_id, metadata))
+        self.touch(stream_id)
+        return stream_id
+
+    def load(self, stream_id):
+        """Return the stored record for a stream id, or None"""
+        try:
+            record_path, _ = self._paths(stream_id)
+            with open(record_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def touch(self, stream_id):
+        """Mark a stream as in use so the background refresher keeps it fresh"""
+        _, seen_path = self._paths(stream_id)
+        try:
+            with open(seen_path, 'a'):
+                pass
+            os.utime(seen_path)
+        except OSError:
+            pass
+
+    def is_fresh(self, record):
+        """Whether a record's URL is good for longer than the refresh margin"""
+        return bool(record) and record.get('expires_at', 0) - self.refresh_margin > time.time()
+
+    def refresh(self, stream_id):
+        """Re-extract the stream URL for a stream id (one refresh per id at a time across processes)"""
+        record = self.load(stream_id)
+        if not record:
+            return None
+
+        with self._lock:
+            pending = self._refreshing.get(stream_id)
+            owner = pending is None
+            if owner:
+                pending = self._refreshing[stream_id] = threading.Event()
+        if not owner:
+            pending.wait()
+            return self.load(stream_id)
+
+        try:
+            with self._file_lock(stream_id):
+                current = self.load(stream_id)
+                if current and current['stream_url'] != record['stream_url']:
+                    return current  # refreshed by another process while we waited
+
+                self.metadata_cache.invalidate(record['webpage_url'])
+                metadata = self.metadata_cache.get(record['webpage_url'])
+                record = self._record(stream_id, metadata)
+                self._save(record)
+                print(f"[STREAMS] Refreshed {stream_id[:8]} (expires in {int(record['expires_at'] - time.time())}s)")
+                return record
+        finally:
+            with self._lock:
+                self._refreshing.pop(stream_id, None)
+            pending.set()
+
+    def resolve(self, stream_id, force_refresh=False):
+        """Return a usable record for a stream id, refreshing it if it is (nearly) expired"""
+        record = self.load(stream_id)
+        if not record:
+            return None
+        self.touch(stream_id)
+        if force_refresh or not self.is_fresh(record):
+            record = self.refresh(stream_id)
+        return record
+
+    def refresh_due(self):
+        """Refresh active streams close to expiry and forget long-unused ones (skipped if another process is at it)"""
+        with self._file_lock('.sweep', blocking=False) as locked:
+            return self._refresh_due() if locked else 0
+
+    def _refresh_due(self):
+        now = time.time()
+        refreshed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            stream_id = name[:-5]
+            try:
+                record_path, seen_path = self._paths(stream_id)
+                last_seen = os.path.getmtime(seen_path) if os.path.exists(seen_path) else os.path.getmtime(record_path)
+            except (OSError, ValueError):
+                continue
+
+            if now - last_seen > self.retention:
+                for path in (record_path, seen_path, os.path.join(self.directory, f"{stream_id}.lock")):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+
+            if now - last_seen <= self.active_window and not self.is_fresh(self.load(stream_id)):
+                try:
+                    self.refresh(stream_id)
+                    refreshed += 1
+                except Exception as e:
+                    print(f"[STREAMS ERROR] Refresh failed for {stream_id[:8]}: {e}")
+        return refreshed
+
+    def start(self):
+        """Run refresh_due every check_interval seconds in a daemon thread"""
+        if self._thread:
+            return self
+
+        def loop():
+            while True:
+                time.sleep(self.check_interval)
+                try:
+                    self.refresh_due()
+                except Exception as e:
+                    print(f"[STREAMS ERROR] {e}")
+
+        self._thread = threading.Thread(target=loop, name='stream-url-refresh', daemon=True)
+        self._thread.start()
+        return self